@@ -1,19 +1,47 @@
+
 """
 benchmark 0.4.5
 
 A suite of worlds to characterize the performance of BECCA variants.
-Other agents may use this benchmark as well, as long as they have the 
+Other agents may use this benchmark as well, as long as they have the
 same interface. (See BECCA documentation for a detailed specification.)
-In order to facilitate apples-to-apples comparisons between agents, the 
+In order to facilitate apples-to-apples comparisons between agents, the
 benchmark will be version numbered.
 
 Run at the command line as a script with no argmuments:
 > python benchmark.py
 
+To run the agent in a different floating point precision, name it:
+> python benchmark.py float32
+
+Each (run, world) pair is a separate job with its own seed, and the
+jobs are spread across a pool of processes, one per core by default.
+To choose the number of processes or the base seed:
+> python benchmark.py --jobs 8 --seed 12
+
+The scores are the same for a given seed, however many processes
+are used.
+
 For N_RUNS = 7, Becca 0.4.5 scored 78.5
 """
+import os
+# Each job runs in its own process, so let each of them use
+# a single BLAS thread rather than all of them competing for every core.
+# This has to happen before numpy is first imported.
+for blas_variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                      'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                      'NUMEXPR_NUM_THREADS']:
+    os.environ.setdefault(blas_variable, '1')
+# Plots from the jobs are only saved, never displayed, so matplotlib
+# needn't load a GUI toolkit, if it is loaded at all.
+# This has to happen before matplotlib is first imported.
+os.environ['MPLBACKEND'] = 'agg'
+
+import argparse
+import multiprocessing
+import numpy as np
+
 import tester
-from agent.agent import Agent
 from worlds.grid_1D import World as World_grid_1D
 from worlds.grid_1D_ms import World as World_grid_1D_ms
 from worlds.grid_1D_noise import World as World_grid_1D_noise
@@ -22,64 +50,93 @@ from worlds.grid_2D_dc import World as World_grid_2D_dc
 from worlds.image_1D import World as World_image_1D
 from worlds.image_2D import World as World_image_2D
 
-import matplotlib.pyplot as plt
-import numpy as np
+N_RUNS = 7
+WORLDS = [World_grid_1D, World_grid_1D_ms, World_grid_1D_noise,
+          World_grid_2D, World_grid_2D_dc, World_image_1D, World_image_2D]
 
-def main():
-    N_RUNS = 7
-    overall_performance = []
-    # Run all the worlds in the benchmark and tabulate their performance
-    for i in range(N_RUNS):
-        performance = []
-        world = World_grid_1D()
-        performance.append(tester.test(world, show=False))
-        world = World_grid_1D_ms()
-        performance.append(tester.test(world, show=False))
-        world = World_grid_1D_noise()
-        performance.append(tester.test(world, show=False))
-        world = World_grid_2D()
-        performance.append(tester.test(world, show=False))
-        world = World_grid_2D_dc()
-        performance.append(tester.test(world, show=False))
-        world = World_image_1D()
-        performance.append(tester.test(world, show=False))
-        world = World_image_2D()
-        performance.append(tester.test(world, show=False))
+def run_job(job):
+    """
+    Run one world once and return the agent's performance
 
+    job is a (run, World, seed, dtype) tuple. Both the world and
+    the agent draw their random numbers from numpy's global stream,
+    which is seeded with seed before either of them is created.
+    """
+    (run, World, seed, dtype) = job
+    np.random.seed(seed)
+    world = World()
+    # Give every run its own agent name, so that jobs running
+    # at the same time don't overwrite each other's saved agents
+    agent_name = '_'.join((world.name, 'agent', str(run)))
+    return tester.test(world, show=False, agent_name=agent_name,
+                       dtype=dtype)
+
+def trimmed_mean(scores, num_trimmed=2):
+    """
+    Average scores after throwing away the highest and lowest values
+
+    The num_trimmed highest and num_trimmed lowest values are only
+    thrown away if there are at least 7 scores.
+    """
+    scores = sorted(scores)
+    if len(scores) >= 7:
+        scores = scores[num_trimmed:len(scores) - num_trimmed]
+    return sum(scores) / float(len(scores))
+
+def main(dtype=np.float64, num_processes=None, seed=0, num_runs=N_RUNS):
+    """
+    Run all the worlds in the benchmark and tabulate their performance
+
+    The job for run i and world j is seeded with
+    seed + i * len(WORLDS) + j. num_processes defaults to the number
+    of cores. With one process, the jobs run one at a time in this one.
+    Returns the typical performance score.
+    """
+    if num_processes is None:
+        num_processes = multiprocessing.cpu_count()
+    jobs = []
+    for run in range(num_runs):
+        for (world_index, World) in enumerate(WORLDS):
+            job_seed = seed + run * len(WORLDS) + world_index
+            jobs.append((run, World, job_seed, dtype))
+    if num_processes > 1:
+        pool = multiprocessing.Pool(processes=num_processes)
+        try:
+            # map hands back the scores in the order of the jobs,
+            # however the jobs are scheduled
+            scores = pool.map(run_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        scores = [run_job(job) for job in jobs]
+
+    overall_performance = []
+    for run in range(num_runs):
+        performance = scores[run * len(WORLDS):(run + 1) * len(WORLDS)]
         print "Individual benchmark scores: " , performance
-        total = 0
-        for val in performance:
-            total += val
-        mean_performance = total / len(performance)
+        mean_performance = sum(performance) / len(performance)
         overall_performance.append(mean_performance)
-        print "Overall benchmark score, ", i , "th run: ", mean_performance 
-    print "All overall benchmark scores: ", overall_performance 
-    
-    # Automatically throw away the 2 highest and 2 lowest values 
+        print "Overall benchmark score, ", run , "th run: ", mean_performance
+    print "All overall benchmark scores: ", overall_performance
+
+    # Automatically throw away the 2 highest and 2 lowest values
     # if you choose N_RUNS to be 7 or more.
-    if N_RUNS >= 7:
-        for i in range(2):
-            highest_val = -10 ** 6
-            lowest_val = 10 ** 6
-            
-            for indx in range(len(overall_performance)):
-                if overall_performance[indx] > highest_val:
-                    highest_val = overall_performance[indx]
-                if overall_performance[indx] < lowest_val:
-                    lowest_val = overall_performance[indx]
-            overall_performance.remove(highest_val)
-            overall_performance.remove(lowest_val)
-
-    # Find the average of what's left
-    sum_so_far = 0.
-    for indx in range(len(overall_performance)):
-        sum_so_far += overall_performance[indx]
-    typical_performance = sum_so_far / len(overall_performance)
-    print "Typical performance score: ", typical_performance 
-    
-    # Block the program, displaying all plots.
-    # When the plot windows are closed, the program closes.
-    plt.show()
-    
+    typical_performance = trimmed_mean(overall_performance)
+    print "Typical performance score: ", typical_performance
+    return typical_performance
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(
+            description='Run BECCA through the benchmark worlds')
+    parser.add_argument("dtype", nargs='?', default='float64',
+                        help="floating point type the agent runs in")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of processes (default: one per core)")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="base random seed for the jobs")
+    parser.add_argument("-r", "--runs", type=int, default=N_RUNS,
+                        help="number of passes through the worlds")
+    args = parser.parse_args()
+    main(dtype=np.dtype(args.dtype), num_processes=args.jobs,
+         seed=args.seed, num_runs=args.runs)
@@ -1,8 +1,16 @@
 import cPickle as pickle
-import matplotlib.pyplot as plt
 import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+import time
 
+from arraystore import ArrayStore
 from block import Block
+import checkpoint
+import display
+from instruments import Instruments
 import tools
 
 class Agent(object):
@@ -12,7 +20,10 @@ class Agent(object):
     Takes in a time series of sensory input vectors and 
     a scalar reward and puts out a time series of action commands."""
     def __init__(self, num_sensors, num_actions, show=True, 
-                 agent_name='test_agent'):
+                 agent_name='test_agent', dtype=np.float64, compact=False,
+                 instrument=False, trace_steps=None, memmap_directory=None,
+                 display=None, compress_level=None, max_cables_per_cog=8,
+                 max_successors=None, random_state=None, gearbox=None):
         """
         Configure the Agent
 
@@ -20,23 +31,90 @@ class Agent(object):
         arguments. They define the number of elements in the 
         sensors and actions arrays that the agent and the world use to
         communicate with each other. 
+        If show is False, the agent never plots, and never 
+        imports matplotlib. If it is True, its plots are published 
+        to display, a Display that draws them in a process of its own.
+        dtype is the floating point type that the agent works in
+        and keeps all of its state in. np.float32 halves the memory
+        and bandwidth it needs. 
+        If compact is True, the daisychain counts are kept in 
+        16 bit fixed point, as described in Gearbox.
+        If instrument is True, the time spent in each step, in each 
+        block's step_up and step_down, in the cog updates, in bundle 
+        growth and in saving is recorded, and can be read with stats(). 
+        The steps listed in trace_steps are also kept in detail, 
+        to be written out with write_trace().
+        If memmap_directory is given, the blocks' largest arrays are 
+        kept in memory-mapped files under it, in a new directory within
+        one named for the agent, so that the agent can outgrow 
+        physical memory.
+        compress_level is the zlib level its checkpoints are 
+        compressed at, from 1 to 9, or 0 to leave them uncompressed,
+        so that they are memory-mapped when they are restored. 
+        It defaults to 0 if memmap_directory is given, and to 
+        checkpoint.COMPRESS_LEVEL otherwise.
+        max_cables_per_cog and max_successors set the size of the 
+        blocks' cogs, as described in Block.
+        The agent and its blocks draw their random numbers using
+        random_state, a np.random.RandomState, so that agents seeded 
+        alike behave alike. If it is None, they use np.random.
+        gearbox is passed on to the first block, as described in Block.
         """
         self.BACKUP_PERIOD = 10 ** 4
+        # Between full checkpoints, only what has changed is saved
+        self.FULL_CHECKPOINT_PERIOD = 10 ** 5
         self.show = show
+        self.checkpoint_directory = "log/" + agent_name + ".checkpoint"
+        # Agents saved by earlier versions were pickled whole
         self.pickle_filename ="log/" + agent_name + ".pickle"
+        self.backup_filename = ''.join((self.pickle_filename, '.bak'))
+        # Checkpoints are written to disk in the background, 
+        # one at a time, by this thread
+        self._checkpoint_thread = None
+        # The timestep, size and timings of the last checkpoint written
+        self.last_checkpoint = None
+        # The header of the last full checkpoint written, 
+        # which the delta checkpoints after it build on
+        self._checkpoint_base = None
+        if compress_level is None:
+            if memmap_directory is None:
+                compress_level = checkpoint.COMPRESS_LEVEL
+            else:
+                compress_level = 0
+        self.compress_level = compress_level
         # TODO: Automatically adapt to the number of sensors pass in
         self.num_sensors = num_sensors
         self.num_actions = num_actions
+        self.dtype = np.dtype(dtype)
+        self.compact = compact
+        self.max_cables_per_cog = max_cables_per_cog
+        self.max_successors = max_successors
+        self.random_state = random_state
+        # The blocks share the agent's instruments
+        self.instruments = Instruments(enabled=instrument, 
+                                       trace_steps=trace_steps)
+        if memmap_directory is None:
+            self.store = None
+        else:
+            self.store = ArrayStore(os.path.join(memmap_directory, 
+                                                 agent_name))
 
         # Initialize agent infrastructure
         self.num_blocks =  1
         first_block_name = ''.join(('block_', str(self.num_blocks - 1)))
         self.blocks = [Block(self.num_actions + self.num_sensors, 
-                             name=first_block_name)]
-        self.action = np.zeros((self.num_actions,1))
+                             name=first_block_name, dtype=self.dtype,
+                             compact=self.compact, 
+                             max_cables_per_cog=self.max_cables_per_cog,
+                             instruments=self.instruments, 
+                             store=self.store,
+                             max_successors=self.max_successors,
+                             random_state=self.random_state,
+                             gearbox=gearbox)]
+        self.action = np.zeros((self.num_actions,1), dtype=self.dtype)
         # Constants for adaptively rescaling the cable activities
-        self.max_vals = np.zeros((self.num_sensors, 1)) 
-        self.min_vals = np.zeros((self.num_sensors, 1))
+        self.max_vals = np.zeros((self.num_sensors, 1), dtype=self.dtype) 
+        self.min_vals = np.zeros((self.num_sensors, 1), dtype=self.dtype)
         self.RANGE_DECAY_RATE = 10 ** -5
         # Constants for adaptive reward scaling 
         self.REWARD_RANGE_DECAY_RATE = 10 ** -5
@@ -50,11 +128,16 @@ class Agent(object):
         self.surprise_history = []
         self.recent_surprise_history = [0.] * 100
         self.timestep = 0
-        self.graphing = True
+        # Agents that aren't shown don't plot, or even import matplotlib
+        self.graphing = show
+        self.display = display
 
     def step(self, sensors, unscaled_reward):
         """ Step through one time interval of the agent's operation """
         self.timestep += 1
+        self.instruments.timestep = self.timestep
+        start_time = self.instruments.start()
+        sensors = np.asarray(sensors, dtype=self.dtype)
         if sensors.ndim == 1:
             sensors = sensors[:,np.newaxis]
         # Condition the sensors to fall between 0 and 1
@@ -73,23 +156,28 @@ class Agent(object):
                        (spread + tools.EPSILON))
         self.reward_min += spread * self.REWARD_RANGE_DECAY_RATE
         self.reward_max -= spread * self.REWARD_RANGE_DECAY_RATE
+        self.reward = self.dtype.type(self.reward)
+        action = self._step_blocks(sensors, unscaled_reward)
+        if (self.timestep % self.BACKUP_PERIOD) == 0:
+            self._save()
+        self.instruments.stop('agent.step', start_time)
+        return action
 
+    def _step_blocks(self, sensors, unscaled_reward):
+        """ 
+        Step through the blocks and choose the next action
+
+        sensors have already been conditioned to fall between 0 and 1,
+        and self.reward has been scaled.
+        """
         # Propogate the new sensor inputs up through the blocks
         cable_activities = np.vstack((self.action, sensors))
         for block in self.blocks:
             cable_activities = block.step_up(cable_activities, self.reward) 
         # Create a new block if the top block has had enough bundles assigned
-        block_bundles_full = (float(block.bundles_created()) / 
-                              float(block.max_bundles))
-        if block_bundles_full > 1./2.:
-            self.num_blocks +=  1
-            next_block_name = ''.join(('block_', str(self.num_blocks - 1)))
-            self.blocks.append(Block(self.num_actions + self.num_sensors,
-                                     name=next_block_name, 
-                                     level=self.num_blocks))
-            cable_activities = self.blocks[-1].step_up(cable_activities, 
-                                                     self.reward) 
-            print "Added block", self.num_blocks - 1
+        if self._top_block_full():
+            cable_activities = self.add_block().step_up(cable_activities, 
+                                                        self.reward) 
         # TODO: straighten out cable_activity_goals and deliberation_votes
         # Which to use where in agent?
         # Which to translate into actions?
@@ -97,7 +185,8 @@ class Agent(object):
         # Propogate the deliberation_goal_votes down through the blocks
         # debug
         agent_surprise = 0.0
-        cable_activity_goals = np.zeros((cable_activities.size,1))
+        cable_activity_goals = np.zeros((cable_activities.size,1), 
+                                        dtype=self.dtype)
         #deliberation_goal_votes = np.zeros((cable_activities.size,1))
        
         for block in reversed(self.blocks):
@@ -105,6 +194,46 @@ class Agent(object):
             #deliberation_goal_votes = block.get_cable_deliberation_vote()
             if np.nonzero(block.surprise)[0].size > 0:
                 agent_surprise = np.sum(block.surprise)
+        return self._act(agent_surprise, unscaled_reward)
+
+    def _top_block_full(self):
+        """ Whether the top block has had enough bundles assigned """
+        block = self.blocks[-1]
+        block_bundles_full = (float(block.bundles_created()) / 
+                              float(block.max_bundles))
+        return block_bundles_full > 1./2.
+
+    def add_block(self, gearbox=None):
+        """ 
+        Put a new block on top of the others 
+
+        gearbox is passed on to the block, as described in Block.
+        Returns the new block.
+        """
+        self.num_blocks +=  1
+        next_block_name = ''.join(('block_', str(self.num_blocks - 1)))
+        self.blocks.append(Block(self.num_actions + self.num_sensors,
+                                 name=next_block_name, 
+                                 level=self.num_blocks, 
+                                 dtype=self.dtype, 
+                                 compact=self.compact,
+                                 max_cables_per_cog=self.max_cables_per_cog,
+                                 instruments=self.instruments,
+                                 store=self.store,
+                                 max_successors=self.max_successors,
+                                 random_state=self.random_state,
+                                 gearbox=gearbox))
+        print "Added block", self.num_blocks - 1
+        return self.blocks[-1]
+
+    def _act(self, agent_surprise, unscaled_reward):
+        """ 
+        Finish the time step, once the blocks have been stepped
+
+        agent_surprise is the surprise of the lowest block that had any.
+        Returns the action.
+        """
+        random = tools.random_source(self.random_state)
         self.recent_surprise_history.pop(0)
         self.recent_surprise_history.append(agent_surprise)
         self.typical_surprise = np.median(np.array(
@@ -117,22 +246,20 @@ class Agent(object):
         # For actions, each goal is a probability threshold. If a roll of
         # dice comes up lower than the goal value, the action is taken
         # with a magnitude of 1.
-        self.action = np.zeros((self.num_actions, 1))
+        self.action = np.zeros((self.num_actions, 1), dtype=self.dtype)
         #action_thresholds = np.random.random_sample((self.num_actions, 1))
         #self.action[np.nonzero(cable_activity_goals[:self.num_actions,:] 
         #            > action_thresholds)] = 1.
         # debug
         # choose a single random action
-        if np.random.random_sample() < 0.2:
+        if random.random_sample() < 0.2:
             if self.num_actions > 0:
-                self.action[np.random.randint(self.num_actions),0] = 1.             
-        if (self.timestep % self.BACKUP_PERIOD) == 0:
-                self._save()    
+                self.action[random.randint(self.num_actions),0] = 1.             
         # Log reward
         self.cumulative_reward += unscaled_reward
         self.time_since_reward_log += 1
         # debug
-        if np.random.random_sample() < 0.001:
+        if random.random_sample() < 0.001:
             self.visualize()
         return self.action
 
@@ -217,80 +344,228 @@ class Agent(object):
         self.time_since_reward_log = 0
         self.reward_steps.append(self.timestep)
         self._show_reward_history()
-        for block in self.blocks:
-            block.visualize()
-            pass
+        if self.display is not None:
+            for block in self.blocks:
+                block.visualize()
         return
  
     def report_performance(self):
         """ Report on the reward amassed by the agent """
         performance = np.mean(self.reward_history)
         print("Final performance is %f" % performance)
-        self._show_reward_history(hold_plot=self.show)
+        self._show_reward_history()
         return performance
     
-    def _show_reward_history(self, hold_plot=False, 
-                            filename='log/reward_history.png'):
-        """ Show the agent's reward history and save it to a file """
-        if self.graphing:
-            fig = plt.figure(1)
-            plt.plot(self.reward_steps, self.reward_history)
-            plt.xlabel("time step")
-            plt.ylabel("average reward")
-            fig.show()
-            fig.canvas.draw()
-            plt.savefig(filename, format='png')
-            if hold_plot:
-                plt.show()
+    def _show_reward_history(self, filename='log/reward_history.png'):
+        """ Publish the agent's reward history, to be plotted and saved """
+        if self.graphing and self.display is not None:
+            (indices, rewards) = display.downsample(self.reward_history)
+            steps = np.asarray(self.reward_steps)[indices]
+            self.display.publish(display.plot_history, 1, steps, rewards,
+                                 'reward history', ylabel='average reward',
+                                 filename=filename)
         return
     
+    def stats(self):
+        """ 
+        Summarize the agent's instruments 
+
+        Returns a dict with a 'timers' dict, giving the count and the 
+        total, mean, p50, p99 and max milliseconds spent in each 
+        instrumented section, and a 'counters' dict. 
+        Both are empty unless the agent was created with instrument=True.
+        """
+        return self.instruments.summary()
+
+    def write_trace(self, filename='log/agent_trace.json'):
+        """ Write the steps in trace_steps out as a Chrome trace """
+        self.instruments.write_trace(filename)
+
+    def __getstate__(self):
+        """ Leave the checkpoint thread out of the pickle """
+        state = self.__dict__.copy()
+        state['_checkpoint_thread'] = None
+        # A restored agent starts over with a full checkpoint
+        state['_checkpoint_base'] = None
+        # The display belongs to this run, and is handed on by restore()
+        state['display'] = None
+        # Blocks restored lazily from a checkpoint are pickled as a list
+        state['blocks'] = list(self.blocks)
+        return state
+
     def _save(self):
-        """ Archive a copy of the agent object for future use """
+        """ 
+        Archive a copy of the agent object for future use 
+
+        The agent is snapshotted into memory as a checkpoint: copies 
+        of its blocks' arrays and a small pickle of everything else 
+        (see checkpoint.py). Arrays kept in the store are copied to 
+        files instead. Every FULL_CHECKPOINT_PERIOD time steps 
+        all of the arrays are copied. In between, only those that 
+        have changed since the last full checkpoint are. 
+        The snapshot is then written to disk by a background thread, 
+        so that the agent can keep stepping in the meantime. 
+        It is written to a temporary directory and renamed into place, 
+        so that a crash part way through never leaves a partial 
+        checkpoint. 
+        If the last checkpoint is still being written, this waits for it.
+        Returns True if the snapshot was taken. Whether it was written 
+        is reported by the background thread.
+        """
         success = False
-        make_backup = True
+        start_time = self.instruments.start()
+        self.wait_for_checkpoint()
         print "Attempting to save agent..."
+        snapshot_start_time = time.time()
+        base = self._checkpoint_base
+        if (base is not None and self.timestep - base['timestep'] >= 
+            self.FULL_CHECKPOINT_PERIOD):
+            base = None
+        # The arrays in the store are copied file to file,
+        # through a staging directory, rather than into memory
+        staging_directory = None
+        if self.store is not None:
+            self.store.flush()
+            if not os.path.isdir(self.checkpoint_directory):
+                os.makedirs(self.checkpoint_directory)
+            staging_directory = tempfile.mkdtemp(
+                    suffix='.tmp', dir=self.checkpoint_directory)
         try:
-            with open(self.pickle_filename, 'wb') as agent_data:
-                pickle.dump(self, agent_data)
-            if make_backup:
-                with open(''.join((self.pickle_filename, '.bak')), 
-                          'wb') as agent_data_bak:
-                    pickle.dump(self, agent_data_bak)
-            print("Agent data saved at " + str(self.timestep) + " time steps")
-        except IOError as err:
-            print("File error: " + str(err) + 
-                  " encountered while saving agent data")
+            snapshot = checkpoint.snapshot(self, base, staging_directory)
         except pickle.PickleError as perr: 
             print("Pickling error: " + str(perr) + 
                   " encountered while saving agent data")        
+            if staging_directory is not None:
+                shutil.rmtree(staging_directory, ignore_errors=True)
         else:
+            snapshot_duration = time.time() - snapshot_start_time
+            self._checkpoint_thread = threading.Thread(
+                    target=self._write_checkpoint, 
+                    args=(snapshot, self.timestep, snapshot_duration, 
+                          staging_directory))
+            self._checkpoint_thread.start()
             success = True
+        self.instruments.stop('agent.save', start_time)
         return success
+
+    def _write_checkpoint(self, snapshot, timestep, snapshot_duration,
+                          staging_directory=None):
+        """ 
+        Write a snapshot to disk and make it the latest checkpoint 
+
+        staging_directory, if given, holds the snapshot's staged arrays.
+        It is removed afterward.
+        """
+        start_time = self.instruments.start()
+        write_start_time = time.time()
+        (header, skeleton, arrays) = snapshot
+        try:
+            size = checkpoint.write(self.checkpoint_directory, 
+                                    header, skeleton, arrays, 
+                                    compress_level=self.compress_level)
+        except (IOError, OSError) as err:
+            print("File error: " + str(err) + 
+                  " encountered while saving agent data")
+            return
+        finally:
+            if staging_directory is not None:
+                shutil.rmtree(staging_directory, ignore_errors=True)
+        write_duration = time.time() - write_start_time
+        if header['base'] is None:
+            self._checkpoint_base = header
+            kind = 'full'
+        else:
+            kind = 'delta'
+        self.last_checkpoint = {'timestep': timestep, 
+                                'kind': kind,
+                                'size_bytes': size,
+                                'snapshot_ms': snapshot_duration * 1e3,
+                                'write_ms': write_duration * 1e3}
+        self.instruments.stop('agent.checkpoint_write', start_time)
+        self.instruments.count('agent.checkpoint_bytes', size)
+        print("Agent data saved at %d time steps, %s: %.2f MB, "
+              "%.1f ms to snapshot, %.1f ms to write" % (
+              timestep, kind, size / 2. ** 20, 
+              snapshot_duration * 1e3, write_duration * 1e3))
+
+    def wait_for_checkpoint(self):
+        """ Wait until the last checkpoint has been written to disk """
+        if self._checkpoint_thread is not None:
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+
+    def _fits(self, num_sensors, num_actions, source):
+        """ 
+        Check whether a saved agent has the same dimensions as this one 
+
+        If it doesn't, print a message. The just-initialized agent 
+        is kept.
+        """
+        if (num_sensors == self.num_sensors and 
+            num_actions == self.num_actions):
+            return True
+        print("The agent " + source + " does not have " +
+              "the same number of input and output elements as " + 
+              "the world.")
+        print("Creating a new agent from scratch.")
+        return False
         
     def restore(self):
-        """ Reconstitute the agent from a previously saved agent """
-        restored_agent = self
-        try:
-            with open(self.pickle_filename, 'rb') as agent_data:
-                loaded_agent = pickle.load(agent_data)
+        """ 
+        Reconstitute the agent from a previously saved agent 
+        
+        The latest checkpoint is tried first, then the ones before it.
+        A delta checkpoint is restored on top of the full checkpoint 
+        it was based on. Only a checkpoint's header is read before its 
+        dimensions are checked against this agent's, and its blocks' 
+        arrays are loaded as they are used. If this agent keeps its 
+        arrays in memory-mapped files, the restored ones are copied 
+        into them.
+        Agents pickled whole by earlier versions can't be restored.
+        """
+        directory = self.checkpoint_directory
+        for name in checkpoint.list_checkpoints(directory):
+            source = os.path.join(directory, name)
+            try:
+                header = checkpoint.read_header(directory, name)
+            except (IOError, ValueError) as err:
+                print("Couldn't read %s: %s" % (source, err))
+                continue
+            if not self._fits(header['num_sensors'], header['num_actions'],
+                              source):
+                return self
+            try:
+                loaded_agent = checkpoint.load(directory, header)
+            except (IOError, EOFError, pickle.UnpicklingError) as err:
+                print("Couldn't load %s: %s" % (source, err))
+                continue
+            print(''.join(('Agent restored at timestep ', 
+                           str(loaded_agent.timestep),
+                           ' from ', source)))
+            loaded_agent.display = self.display
+            loaded_agent.compress_level = self.compress_level
+            # The restored arrays are moved into this agent's store,
+            # if it has one, which loads all of the blocks
+            if self.store is not None or loaded_agent.store is not None:
+                loaded_agent.store = self.store
+                for block in loaded_agent.blocks:
+                    block.use_store(self.store)
+            return loaded_agent
+        return self._refuse_pickle()
 
-            # Compare the number of channels in the restored agent with 
-            # those in the already initialized agent. If it matches, 
-            # accept the agent. If it doesn't,
-            # print a message, and keep the just-initialized agent.
-            if((loaded_agent.num_sensors == self.num_sensors) and 
-               (loaded_agent.num_actions == self.num_actions)):
-                print(''.join(('Agent restored at timestep ', 
-                               str(loaded_agent.timestep),
-                               ' from ', self.pickle_filename)))
-                restored_agent = loaded_agent
-            else:
-                print("The agent " + self.pickle_filename + " does not have " +
-                      "the same number of input and output elements as " + 
-                      "the world.")
+    def _refuse_pickle(self):
+        """ 
+        Explain why an agent pickled whole by an earlier version is unused
+
+        Those agents' blocks were built from cogs, which no longer 
+        exist, so they can't be restored. The just-initialized agent 
+        is kept.
+        """
+        for filename in (self.pickle_filename, self.backup_filename):
+            if os.path.exists(filename):
+                print(' '.join(('The agent in', filename, 
+                                'was pickled whole by an earlier version',
+                                'of BECCA and can\'t be restored.')))
                 print("Creating a new agent from scratch.")
-        except IOError:
-            print("Couldn't open %s for loading" % self.pickle_filename)
-        except pickle.PickleError, e:
-            print("Error unpickling world: %s" % e)
-        return restored_agent
+                break
+        return self
@@ -0,0 +1,200 @@
+import numpy as np
+
+from agent import Agent
+import tools
+
+class AgentBatch(object):
+    """
+    A batch of independent agents, stepped together
+
+    Seed studies and repeated benchmark runs step many agents
+    in the same worlds. The batch keeps the agents' sensor and reward
+    ranges stacked along a leading agent axis, and conditions the sensors
+    and rewards of all the agents at once. The blocks at each level of
+    all the agents share a gearbox, as described in Gearbox, so each
+    level's cogs, where most of the time goes, are stepped together
+    with a handful of array operations, however many agents there are.
+    Only the blocks' zipties and the agents' bookkeeping are stepped
+    one agent at a time.
+
+    Every agent draws its random numbers from a np.random.RandomState
+    of its own, seeded with seeds[i]. Its actions are the same as those
+    of an Agent created with random_state=np.random.RandomState(seeds[i])
+    and stepped on its own, with the same sensors and rewards.
+    The global random state isn't used, so worlds can keep using it.
+    Since their gearboxes are shared, the agents aren't checkpointed.
+    """
+    def __init__(self, num_agents, num_sensors, num_actions, seeds=None,
+                 agent_name='test_agent', dtype=np.float64, compact=False,
+                 max_cables_per_cog=8, max_successors=None):
+        """
+        Create num_agents agents
+
+        seeds defaults to 0 through num_agents - 1. The rest of the
+        arguments are as in Agent.
+        """
+        self.num_agents = num_agents
+        self.num_sensors = num_sensors
+        self.num_actions = num_actions
+        self.dtype = np.dtype(dtype)
+        if seeds is None:
+            seeds = range(num_agents)
+        # The gearbox shared by each level's blocks. The first agent's
+        # first block makes the first one.
+        self.gearboxes = []
+        self.agents = []
+        for (i, seed) in enumerate(seeds):
+            gearbox = self.gearboxes[0] if self.gearboxes else None
+            self.agents.append(Agent(
+                    num_sensors, num_actions, show=False,
+                    agent_name=''.join((agent_name, '_', str(i))),
+                    dtype=dtype, compact=compact,
+                    max_cables_per_cog=max_cables_per_cog,
+                    max_successors=max_successors,
+                    random_state=np.random.RandomState(seed),
+                    gearbox=gearbox))
+            if gearbox is None:
+                self.gearboxes.append(self.agents[0].blocks[0].gearbox)
+        self.RANGE_DECAY_RATE = self.agents[0].RANGE_DECAY_RATE
+        self.REWARD_RANGE_DECAY_RATE = self.agents[0].REWARD_RANGE_DECAY_RATE
+        # Each agent's sensor ranges are views into these
+        self.max_vals = np.zeros((num_agents, num_sensors, 1),
+                                 dtype=self.dtype)
+        self.min_vals = np.zeros((num_agents, num_sensors, 1),
+                                 dtype=self.dtype)
+        for (i, agent) in enumerate(self.agents):
+            agent.max_vals = self.max_vals[i]
+            agent.min_vals = self.min_vals[i]
+        self.actions = np.zeros((num_agents, num_actions), dtype=self.dtype)
+
+    def step(self, sensors, unscaled_rewards):
+        """
+        Step all the agents through one time interval
+
+        sensors is a (num_agents x num_sensors) array and
+        unscaled_rewards has one element per agent.
+        Returns a (num_agents x num_actions) array of actions.
+        """
+        sensors = np.asarray(sensors, dtype=self.dtype).reshape(
+                self.num_agents, self.num_sensors, 1)
+        unscaled_rewards = np.asarray(unscaled_rewards,
+                                      dtype=float).ravel()
+        # Condition the sensors to fall between 0 and 1, as in Agent.step
+        np.minimum(sensors, self.min_vals, out=self.min_vals)
+        np.maximum(sensors, self.max_vals, out=self.max_vals)
+        spread = self.max_vals - self.min_vals
+        sensors = ((sensors - self.min_vals) /
+                   (self.max_vals - self.min_vals + tools.EPSILON))
+        self.min_vals += spread * self.RANGE_DECAY_RATE
+        self.max_vals -= spread * self.RANGE_DECAY_RATE
+        # Adapt the rewards so that they fall between 0 and 1.
+        # The reward ranges are kept by the agents,
+        # where worlds can set them.
+        reward_min = np.array([agent.reward_min for agent in self.agents],
+                              dtype=float)
+        reward_max = np.array([agent.reward_max for agent in self.agents],
+                              dtype=float)
+        np.minimum(unscaled_rewards, reward_min, out=reward_min)
+        np.maximum(unscaled_rewards, reward_max, out=reward_max)
+        spread = reward_max - reward_min
+        rewards = ((unscaled_rewards - reward_min) /
+                   (spread + tools.EPSILON)).astype(self.dtype)
+        reward_min += spread * self.REWARD_RANGE_DECAY_RATE
+        reward_max -= spread * self.REWARD_RANGE_DECAY_RATE
+        for (i, agent) in enumerate(self.agents):
+            agent.timestep += 1
+            agent.instruments.timestep = agent.timestep
+            agent.reward = rewards[i]
+            agent.reward_min = reward_min[i]
+            agent.reward_max = reward_max[i]
+
+        # Propogate the new sensor inputs up through the blocks,
+        # a level at a time, as in Agent._step_blocks
+        cable_activities = [np.vstack((agent.action, sensors[i]))
+                            for (i, agent) in enumerate(self.agents)]
+        num_blocks = [len(agent.blocks) for agent in self.agents]
+        level = 0
+        while level < len(self.gearboxes):
+            self._step_up(level, cable_activities, rewards)
+            # Agents whose top block this is can add a new one,
+            # to be stepped at the next level
+            for (i, agent) in enumerate(self.agents):
+                if num_blocks[i] == level + 1 and agent._top_block_full():
+                    self._add_block(i)
+            level += 1
+
+        # Propogate the goals down through the blocks
+        agent_surprise = [0.] * self.num_agents
+        cable_activity_goals = [np.zeros((activities.size, 1),
+                                         dtype=self.dtype)
+                                for activities in cable_activities]
+        for level in reversed(range(len(self.gearboxes))):
+            self._step_down(level, cable_activity_goals, agent_surprise)
+        for (i, agent) in enumerate(self.agents):
+            self.actions[i,:] = agent._act(agent_surprise[i],
+                                           unscaled_rewards[i])[:,0]
+        return self.actions.copy()
+
+    def _level_blocks(self, level):
+        """
+        The agents that have a block at level, and their blocks
+
+        They are listed in the order they were added to the gearbox.
+        """
+        blocks = [(agent.blocks[level].agent_index, i, agent.blocks[level])
+                  for (i, agent) in enumerate(self.agents)
+                  if len(agent.blocks) > level]
+        blocks.sort()
+        return [(i, block) for (agent_index, i, block) in blocks]
+
+    def _step_up(self, level, cable_activities, rewards):
+        """
+        Step up the blocks at one level, and all their cogs at once
+
+        cable_activities are replaced by the blocks' bundle activities.
+        """
+        gearbox = self.gearboxes[level]
+        level_blocks = self._level_blocks(level)
+        gearbox_inputs = [block.step_up_to_gearbox(cable_activities[i])
+                          for (i, block) in level_blocks]
+        gearbox_rewards = np.zeros(gearbox.num_agents, dtype=self.dtype)
+        for (i, block) in level_blocks:
+            gearbox_rewards[block.agent_index] = rewards[i]
+        cog_bundle_activities = gearbox.step_up(
+                np.concatenate([inputs[0] for inputs in gearbox_inputs]),
+                np.concatenate([block.cog_cable_counts
+                                for (i, block) in level_blocks]),
+                gearbox_rewards,
+                np.concatenate([inputs[1] for inputs in gearbox_inputs]))
+        for (i, block) in level_blocks:
+            cable_activities[i] = block.step_up_from_gearbox(
+                    cog_bundle_activities[gearbox.cog_slice(
+                            block.agent_index)])
+
+    def _step_down(self, level, cable_activity_goals, agent_surprise):
+        """
+        Step down the blocks at one level, and all their cogs at once
+
+        cable_activity_goals are replaced by the blocks' cable activity
+        goals, and agent_surprise by the blocks' surprise, where they
+        have any.
+        """
+        gearbox = self.gearboxes[level]
+        level_blocks = self._level_blocks(level)
+        cog_cable_activity_goals = gearbox.step_down(np.concatenate(
+                [block.step_down_to_gearbox(cable_activity_goals[i])
+                 for (i, block) in level_blocks]))
+        for (i, block) in level_blocks:
+            cable_activity_goals[i] = block.step_down_from_gearbox(
+                    cog_cable_activity_goals[gearbox.cog_slice(
+                            block.agent_index)])
+            if np.nonzero(block.surprise)[0].size > 0:
+                agent_surprise[i] = np.sum(block.surprise)
+
+    def _add_block(self, i):
+        """ Put a new block on top of agent i's others """
+        level = len(self.agents[i].blocks)
+        if level < len(self.gearboxes):
+            self.agents[i].add_block(gearbox=self.gearboxes[level])
+        else:
+            self.gearboxes.append(self.agents[i].add_block().gearbox)
@@ -0,0 +1,73 @@
+import os
+import tempfile
+
+import numpy as np
+
+class ArrayStore(object):
+    """
+    Arrays backed by memory-mapped files in a directory
+
+    Each array is kept in a raw file of its own, named for it,
+    and mapped into memory, so that the operating system can page
+    the parts that haven't been used lately out to disk. This lets
+    an agent's largest arrays grow beyond physical memory.
+    The files are created sparse, so the zeros in them take up
+    no disk space until they are written to.
+
+    Each store keeps its files in a new subdirectory of directory,
+    so that two stores given the same directory, such as those of 
+    two agents with the same name, can't overwrite each other's 
+    arrays. The files are left on disk when the store is done with.
+
+    The store pickles as its directory and the layouts of its arrays.
+    Their files are mapped again by get() when they are next needed.
+    """
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = tempfile.mkdtemp(prefix='store_', dir=directory)
+        # The shape and dtype of each array, by name
+        self.layouts = {}
+        self._arrays = {}
+
+    def _filename(self, name):
+        return os.path.join(self.directory, name + '.dat')
+
+    def zeros(self, name, shape, dtype):
+        """ Create an array of zeros called name, replacing any before it """
+        dtype = np.dtype(dtype)
+        filename = self._filename(name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        if np.prod(shape) == 0:
+            # Empty files can't be memory-mapped
+            array = np.zeros(shape, dtype=dtype)
+        else:
+            array = np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+        self.layouts[name] = (tuple(shape), dtype.str)
+        self._arrays[name] = array
+        return array
+
+    def get(self, name):
+        """ The array called name, mapping its file again if need be """
+        array = self._arrays.get(name)
+        if array is None:
+            (shape, dtype) = self.layouts[name]
+            if np.prod(shape) == 0:
+                array = np.zeros(shape, dtype=dtype)
+            else:
+                array = np.memmap(self._filename(name), dtype=dtype,
+                                  mode='r+', shape=shape)
+            self._arrays[name] = array
+        return array
+
+    def flush(self):
+        """ Write any changes to the arrays out to their files """
+        for array in self._arrays.values():
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
@@ -1,6 +1,7 @@
 import numpy as np
 
-from cog import Cog
+from gearbox import Gearbox
+from instruments import Instruments
 import tools
 from ziptie import ZipTie
 
@@ -23,17 +24,51 @@ class Block(object):
     and converted into cable activity goals. 
     Internally, a block contains a number of cogs that work in parallel
     to convert cable activities into bundle activities and back again.
+    The cogs are kept together in a gearbox, which steps them all at once.
+    The blocks of several agents at the same level can share a gearbox,
+    as they do in AgentBatch. Then step_up and step_down are each taken 
+    in two parts, one either side of the gearbox's step, 
+    so that the gearbox can step all of the agents' cogs at once.
     """
-    def __init__(self, min_cables, name='anonymous', level=0):
+    def __init__(self, min_cables, name='anonymous', level=0, 
+                 dtype=np.float64, compact=False, max_cables_per_cog=8,
+                 instruments=None, store=None, max_successors=None,
+                 random_state=None, gearbox=None):
     #def __init__(self, max_cables=1400, max_cogs=280,
     #             max_cables_per_cog=10, max_bundles_per_cog=5, 
     #             name='anonymous', level=0):
     #def __init__(self, max_cables=250, max_cogs=50,
     #             max_cables_per_cog=10, max_bundles_per_cog=5, 
     #             name='anonymous', level=0):
-        """ Initialize the level, defining the dimensions of its cogs """
+        """ 
+        Initialize the level, defining the dimensions of its cogs 
+        
+        dtype is the floating point type that all the block's 
+        activities and learned state are kept in. 
+        compact is passed on to the gearbox.
+        max_cables_per_cog sets the size of each cog. Its daisychain
+        and ziptie grow with its square, unless max_successors is 
+        given. Then each of a cog's cables keeps only that many 
+        successors, as described in Gearbox, and the cog grows with 
+        max_cables_per_cog * max_successors instead.
+        instruments are shared with the block's ziptie and gearbox. 
+        A disabled set is created if none are given.
+        store is an ArrayStore for the ziptie's and gearbox's 
+        largest arrays. If it is None they are kept in memory.
+        The block draws its random numbers using random_state, 
+        or np.random if it is None.
+        If a gearbox is given, the block's cogs are added to it as 
+        those of a new agent, rather than being given a gearbox 
+        of their own. It has to have been made by a block created 
+        with the same arguments.
+        """
+        self.dtype = np.dtype(dtype)
+        self.random_state = random_state
+        if instruments is None:
+            instruments = Instruments()
+        self.instruments = instruments
         self.max_cables = int(2 ** np.ceil(np.log2(min_cables)))
-        self.max_cables_per_cog = 8
+        self.max_cables_per_cog = max_cables_per_cog
         self.max_bundles_per_cog = 4
         self.max_cogs = self.max_cables / self.max_bundles_per_cog
         self.max_bundles = self.max_cogs * self.max_bundles_per_cog
@@ -43,26 +78,59 @@ class Block(object):
         self.ziptie = ZipTie(self.max_cables, self.max_cogs, 
                              max_cables_per_bundle=self.max_cables_per_cog,
                              mean_exponent=-2,
-                             joining_threshold=0.05, name=ziptie_name)
-        self.cogs = []
-        # TODO: only create cogs as needed
-        for cog_index in range(self.max_cogs):
-            self.cogs.append(Cog(self.max_cables_per_cog, 
-                                 self.max_bundles_per_cog,
-                                 max_chains_per_bundle=self.max_cables_per_cog,
-                                 name='cog'+str(cog_index), 
-                                 level=self.level))
-        self.cable_activities = np.zeros((self.max_cables, 1))
+                             joining_threshold=0.05, name=ziptie_name, 
+                             dtype=self.dtype, instruments=self.instruments,
+                             store=store, random_state=random_state)
+        # Cogs are only created as the ziptie nucleates their bundles
+        if gearbox is None:
+            gearbox_name = ''.join(('gearbox_', self.name))
+            gearbox = Gearbox(self.max_cogs, self.max_cables_per_cog, 
+                              self.max_bundles_per_cog,
+                              max_chains_per_bundle=self.max_cables_per_cog,
+                              name=gearbox_name, level=self.level,
+                              dtype=self.dtype, compact=compact,
+                              instruments=self.instruments, store=store,
+                              max_successors=max_successors, 
+                              random_state=random_state)
+            self.agent_index = 0
+        else:
+            self.agent_index = gearbox.add_agent(random_state)
+        self.gearbox = gearbox
+        # The cables feeding each cog only change when the ziptie 
+        # changes its bundle_map, so they are cached between time steps.
+        self.cog_cables_version = -1
+        self._update_cog_cables()
+        self.cable_activities = np.zeros((self.max_cables, 1), 
+                                         dtype=self.dtype)
         self.ACTIVITY_DECAY_RATE = .5 # real, 0 < x < 1
         # Constants for adaptively rescaling the cable activities
-        self.max_vals = np.zeros((self.max_cables, 1)) 
-        self.min_vals = np.zeros((self.max_cables, 1))
+        self.max_vals = np.zeros((self.max_cables, 1), dtype=self.dtype) 
+        self.min_vals = np.zeros((self.max_cables, 1), dtype=self.dtype)
         self.RANGE_DECAY_RATE = 10 ** -5
         
     def step_up(self, new_cable_activities, reward):
         """ Find bundle_activities that result from new_cable_activities """
-        new_cable_activities = tools.pad(new_cable_activities, 
-                                         (self.max_cables, 1))
+        start_time = self.instruments.start()
+        (cog_cable_activities, enough_cables) = self.step_up_to_gearbox(
+                new_cable_activities)
+        cog_bundle_activities = self.gearbox.step_up(
+                cog_cable_activities, self.cog_cable_counts, reward, 
+                enough_cables)
+        self.step_up_from_gearbox(cog_bundle_activities)
+        self.instruments.stop(self.name + '.step_up', start_time)
+        return self.bundle_activities
+
+    def step_up_to_gearbox(self, new_cable_activities):
+        """ 
+        Take step_up as far as the gearbox
+
+        Returns the cable activities of each of the block's cogs, 
+        and which of them have enough cables to start bundling, 
+        for the gearbox's step_up. cog_cable_counts are its other input.
+        """
+        new_cable_activities = tools.pad(
+                new_cable_activities.astype(self.dtype, copy=False), 
+                (self.max_cables, 1))
         '''
         # Condition the new_cable_activities to fall between 0 and 1
         self.min_vals = np.minimum(new_cable_activities, self.min_vals)
@@ -83,80 +151,134 @@ class Block(object):
 
         # Update the map from self.cable_activities to cogs
         self.ziptie.update(self.cable_activities)
-        # Process the upward pass of each of the cogs in the block
-        self.bundle_activities = np.zeros((0, 1))
-        for cog_index in range(len(self.cogs)):
-            # Pick out the cog's cable_activities, process them, 
-            # and assign the results to block's bundle_activities
-            cog_cable_activities = self.cable_activities[
-                    self.ziptie.get_projection(cog_index).ravel().astype(bool)]
-            enough_cables = (self.ziptie.cable_fraction_in_bundle(cog_index)
-                             > 0.7)
-            cog_bundle_activities = self.cogs[cog_index].step_up(
-                    cog_cable_activities, reward, enough_cables)
-            self.bundle_activities = np.concatenate((self.bundle_activities, 
-                                                     cog_bundle_activities))
+        # Each of the ziptie's bundles feeds a cog. Create cogs for any
+        # bundles that have been nucleated since the last time step.
+        self.gearbox.add_cogs(self.ziptie.num_bundles - self.num_cogs(), 
+                              agent=self.agent_index)
+        # Pick out each cog's cable_activities, 
+        # to be processed all together in the gearbox
+        self._update_cog_cables()
+        cog_cable_activities = np.zeros((self.num_cogs(), 
+                                         self.max_cables_per_cog, 1), 
+                                        dtype=self.dtype)
+        cog_cable_activities[self.cog_cable_assigned] = (
+                self.cable_activities[self.assigned_cables])
+        enough_cables = (self.cog_cable_counts.astype(float) / 
+                         float(self.ziptie.max_cables_per_bundle) > 0.7)
+        return (cog_cable_activities, enough_cables)
+
+    def step_up_from_gearbox(self, cog_bundle_activities):
+        """ 
+        Finish step_up, given the bundle activities of the block's cogs 
+
+        Returns the block's bundle_activities.
+        """
+        self.bundle_activities = np.zeros((self.max_bundles, 1), 
+                                          dtype=self.dtype)
+        self.bundle_activities[:cog_bundle_activities.size,:] = (
+                cog_bundle_activities.reshape((-1, 1)))
         return self.bundle_activities
 
+    def num_cogs(self):
+        """ How many cogs the block has """
+        cogs = self.gearbox.cog_slice(self.agent_index)
+        return cogs.stop - cogs.start
+
+    def _update_cog_cables(self):
+        """ 
+        Find the block cables that feed each of the existing cogs
+
+        cog_cable_indices is a (num_cogs x max_cables_per_cog) array of 
+        cable indices, in ascending order for each cog and padded 
+        with -1. cog_cable_assigned shows which of its elements are
+        real cables, and assigned_cables lists them in the same order.
+        cog_cable_counts is the number of cables in each cog.
+        These are only rebuilt when the ziptie's bundle_map has changed.
+        """
+        num_cogs = self.num_cogs()
+        if (self.cog_cables_version == self.ziptie.map_version and
+                self.cog_cable_counts.size == num_cogs):
+            return
+        # The ziptie already lists each bundle's cables in this form
+        self.cog_cable_counts = self.ziptie.cables_per_bundle[:num_cogs].copy()
+        self.cog_cable_indices = self.ziptie.bundle_cables[:num_cogs,:].copy()
+        self.cog_cable_assigned = self.cog_cable_indices >= 0
+        self.assigned_cables = self.cog_cable_indices[self.cog_cable_assigned]
+        self.cog_cables_version = self.ziptie.map_version
+        return
+
     def step_down(self, bundle_activity_goals):
         """ Find cable_activity_goals, given a set of bundle_activity_goals """
+        start_time = self.instruments.start()
+        # Process the downward pass of all the cogs in the block at once
+        cog_cable_activity_goals = self.gearbox.step_down(
+                self.step_down_to_gearbox(bundle_activity_goals))
+        cable_activity_goals = self.step_down_from_gearbox(
+                cog_cable_activity_goals)
+        self.instruments.stop(self.name + '.step_down', start_time)
+        return cable_activity_goals
+
+    def step_down_to_gearbox(self, bundle_activity_goals):
+        """ 
+        Take step_down as far as the gearbox
+
+        Returns the bundle activity goals of each of the block's cogs,
+        for the gearbox's step_down.
+        """
         bundle_activity_goals = tools.pad(bundle_activity_goals, 
                                           (self.max_bundles, 1))
-        instant_cable_activity_goals = np.zeros((self.max_cables, 1))
-        #self.cable_activity_goals = np.zeros((self.max_cables, 1))
-        #self.reaction = np.zeros((self.max_cables, 1))
-        self.surprise = np.zeros((self.max_cables, 1))
-        # Process the downward pass of each of the cogs in the level
-        cog_index = 0
-        for cog in self.cogs:
-            # Gather the goal inputs for each cog
-            cog_bundle_activity_goals = bundle_activity_goals[
-                    cog_index * self.max_bundles_per_cog:
-                    cog_index + 1 * self.max_bundles_per_cog,:]
-            # Update the downward outputs for the level 
-            instant_cable_activity_goals_by_cog = cog.step_down(
-                    cog_bundle_activity_goals)
-            cog_cable_indices = self.ziptie.get_projection(
-                    cog_index).ravel().astype(bool)
-            #instant_cable_activity_goals[cog_cable_indices] = np.maximum(
-            #        tools.pad(instant_cable_activity_goals_by_cog, 
-            #                  (cog_cable_indices[0].size, 0)),
-            #        instant_cable_activity_goals[cog_cable_indices]) 
-            instant_cable_activity_goals[cog_cable_indices] = np.maximum(
-                    instant_cable_activity_goals_by_cog, 
-                    instant_cable_activity_goals[cog_cable_indices]) 
-            #self.cable_activity_goals[cog_cable_indices] = np.maximum(
-            #        tools.pad(cog.goal_output, (cog_cable_indices[0].size, 0)),
-            #        self.cable_activity_goals[cog_cable_indices]) 
-            #self.reaction[cog_cable_indices] = np.maximum(
-            #        tools.pad(cog.reaction, (cog_cable_indices[0].size, 0)),
-            #        self.reaction[cog_cable_indices]) 
-            self.surprise[cog_cable_indices] = np.maximum(
-                    cog.surprise, self.surprise[cog_cable_indices]) 
-            cog_index += 1
+        return bundle_activity_goals.reshape(
+                (self.max_cogs, self.max_bundles_per_cog, 1))[
+                :self.num_cogs(),:,:]
+
+    def step_down_from_gearbox(self, cog_cable_activity_goals):
+        """ 
+        Finish step_down, given the cable activity goals of the 
+        block's cogs 
+
+        Returns the block's cable activity goals.
+        """
+        # Scatter the results back to the block's cables. Where a cable 
+        # feeds several cogs, it takes the largest of their values.
+        instant_cable_activity_goals = np.zeros((self.max_cables, 1), 
+                                                dtype=self.dtype)
+        np.maximum.at(instant_cable_activity_goals[:,0], self.assigned_cables,
+                      cog_cable_activity_goals[self.cog_cable_assigned, 0])
+        cog_surprise = self.gearbox.surprise[
+                self.gearbox.cog_slice(self.agent_index)]
+        self.surprise = np.zeros((self.max_cables, 1), dtype=self.dtype)
+        np.maximum.at(self.surprise[:,0], self.assigned_cables, 
+                      cog_surprise[self.cog_cable_assigned, 0])
         return instant_cable_activity_goals 
 
+    def use_store(self, store):
+        """ Keep the ziptie's and gearbox's largest arrays in store """
+        self.ziptie.use_store(store)
+        self.gearbox.use_store(store)
+
     def get_projection(self, bundle_index):
         """ Represent one of the bundles in terms of its cables """
         # Find which cog it belongs to and which output it corresponds to
         cog_index = int(bundle_index / self.max_bundles_per_cog)
         cog_bundle_index = bundle_index - cog_index * self.max_bundles_per_cog
+        projection = np.zeros((self.max_cables, 2))
+        if cog_index >= self.num_cogs():
+            return projection
         # Find the projection to the cog's own cables
-        cog_cable_indices = self.ziptie.get_projection(
-                cog_index).ravel().astype(bool)
-        num_cables_in_cog = np.sum(cog_cable_indices)
-        cog_projection = self.cogs[cog_index].get_projection(cog_bundle_index)
+        self._update_cog_cables()
+        num_cables_in_cog = self.cog_cable_counts[cog_index]
+        cog_cables = self.cog_cable_indices[cog_index, :num_cables_in_cog]
+        cog_projection = self.gearbox.get_projection(
+                self.gearbox.cog_slice(self.agent_index).start + cog_index, 
+                cog_bundle_index)
         # Then re-sort them to the block's cables
-        projection = np.zeros((self.max_cables, 2))
-        projection[cog_cable_indices,:] = cog_projection[:num_cables_in_cog,:]
+        projection[cog_cables,:] = cog_projection[:num_cables_in_cog,:]
         return projection
 
     def bundles_created(self):
-        total = 0.
-        for cog in self.cogs:
-            # Check whether all cogs have created all their bundles
-                total += cog.num_bundles()
-        if np.random.random_sample() < 0.01:
+        # Check whether all cogs have created all their bundles
+        total = float(self.gearbox.bundles_created(self.agent_index))
+        if tools.random_source(self.random_state).random_sample() < 0.01:
             print total, 'bundles in', self.name, ', max of', self.max_bundles
         return total
 
@@ -0,0 +1,440 @@
+import cPickle as pickle
+import copy
+import cStringIO
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
+import tempfile
+import zlib
+
+import numpy as np
+
+"""
+An array-native checkpoint format for agents
+
+An agent's checkpoints are kept together in one directory,
+one subdirectory per checkpoint, named for the timestep it was taken at:
+    0000010000/
+        header.json     the agent's dimensions and a list of its arrays
+        agent.pickle    everything else about the agent, which is small
+        block_0/        one file per array in the block, its ziptie
+        block_1/        and its gearbox
+        ...
+
+A full checkpoint holds all of the agent's arrays. A delta checkpoint
+only holds the arrays that have changed since the last full one,
+its base. Whether an array has changed is judged by a hash of its
+contents, which is kept in the header. The header also says which
+checkpoint holds each array, so restoring from a delta replays it
+on top of its base. Arrays that are memory-mapped, such as those in
+an ArrayStore, can be snapshotted file to file, a chunk at a time,
+so that they are never copied into memory as a whole.
+
+The header can be read on its own, to check that a checkpoint fits
+a world before anything else is loaded. Blocks are loaded lazily,
+the first time they are accessed. Arrays are compressed with zlib,
+in chunks that are spread across a pool of threads. With compression
+turned off, the arrays are memory-mapped when they are loaded,
+copy-on-write, so that they are only read from disk as they are used.
+"""
+
+FORMAT_VERSION = 3
+HEADER_FILENAME = 'header.json'
+SKELETON_FILENAME = 'agent.pickle'
+COMPRESSED_SUFFIX = '.z'
+# The parts of a block that have arrays of their own
+BLOCK_COMPONENTS = ['ziptie', 'gearbox']
+# zlib compression level, from 1 (fastest) to 9 (smallest).
+# 0 writes uncompressed arrays, which can be memory-mapped.
+COMPRESS_LEVEL = 6
+# Arrays are compressed in chunks of this many bytes, so that even
+# a single large array can be spread across the threads
+CHUNK_BYTES = 2 ** 22
+NUM_THREADS = 4
+
+class ArrayReference(object):
+    """ Stands in for an array that is stored in a file of its own """
+    def __init__(self, filename):
+        self.filename = filename
+
+class StagedArray(object):
+    """ A snapshot of an array that was copied to a .npy file at path """
+    def __init__(self, path):
+        self.path = path
+
+    def size(self):
+        return os.path.getsize(self.path)
+
+    def read(self, start, length):
+        with open(self.path, 'rb') as array_file:
+            array_file.seek(start)
+            return array_file.read(length)
+
+def _stage(array, path):
+    """ Copy array to a .npy file at path, a chunk at a time """
+    array = np.ascontiguousarray(array)
+    flat = array.reshape(-1)
+    chunk_length = max(1, CHUNK_BYTES // array.itemsize)
+    with open(path, 'wb') as array_file:
+        np.lib.format.write_array_header_1_0(
+                array_file, np.lib.format.header_data_from_array_1_0(array))
+        for start in range(0, flat.size, chunk_length):
+            flat[start:start + chunk_length].tofile(array_file)
+    return StagedArray(path)
+
+def _move_arrays(obj, directory, arrays):
+    """
+    Replace the arrays in a shallow copy of obj with ArrayReferences
+
+    The arrays themselves are added to the arrays dict, keyed by their
+    filenames. Objects that have an _allocate_workspace() method
+    rebuild their workspaces, which start with an underscore,
+    so those are left out altogether. Returns the copy.
+    """
+    obj = copy.copy(obj)
+    has_workspace = hasattr(obj, '_allocate_workspace')
+    for (name, value) in obj.__dict__.items():
+        if not isinstance(value, np.ndarray) or value.dtype == object:
+            continue
+        if has_workspace and name.startswith('_'):
+            obj.__dict__[name] = None
+            continue
+        filename = '/'.join((directory, name + '.npy'))
+        arrays[filename] = value
+        obj.__dict__[name] = ArrayReference(filename)
+    return obj
+
+def _hash(array):
+    """ A digest of an array's contents, taken a chunk at a time """
+    digest = hashlib.sha1()
+    flat = np.ascontiguousarray(array).reshape(-1)
+    chunk_length = max(1, CHUNK_BYTES // flat.itemsize)
+    for start in range(0, flat.size, chunk_length):
+        digest.update(flat[start:start + chunk_length])
+    return digest.hexdigest()
+
+def snapshot(agent, base=None, staging_directory=None):
+    """
+    Take a copy of the agent that can be written out in the background
+
+    base is the header of the last full checkpoint. If it is given,
+    the snapshot is a delta on top of it, and only the arrays that
+    have changed since are copied. Otherwise it is a full snapshot.
+    If staging_directory is given, arrays that are memory-mapped
+    are copied to files in it, rather than into memory.
+    Returns a (header, skeleton, arrays) tuple. The skeleton is the
+    pickled agent, with the blocks' arrays replaced by ArrayReferences,
+    and arrays is a dict of copies of them, or of StagedArrays, 
+    keyed by filename.
+    """
+    name = '%010d' % agent.timestep
+    live_arrays = {}
+    blocks = []
+    for (block_index, block) in enumerate(agent.blocks):
+        block_directory = ''.join(('block_', str(block_index)))
+        block_copy = _move_arrays(block, block_directory, live_arrays)
+        for component_name in BLOCK_COMPONENTS:
+            setattr(block_copy, component_name, _move_arrays(
+                    getattr(block, component_name),
+                    '/'.join((block_directory, component_name)),
+                    live_arrays))
+        blocks.append(block_copy)
+    skeleton = copy.copy(agent)
+    skeleton.blocks = blocks
+
+    array_headers = {}
+    arrays = {}
+    for (filename, array) in live_arrays.items():
+        array_header = {'shape': list(array.shape),
+                        'dtype': array.dtype.str,
+                        'hash': _hash(array),
+                        'checkpoint': name}
+        if base is not None:
+            base_header = base['arrays'].get(filename)
+            if (base_header is not None and
+                    base_header['hash'] == array_header['hash'] and
+                    base_header['shape'] == array_header['shape'] and
+                    base_header['dtype'] == array_header['dtype']):
+                array_headers[filename] = dict(base_header)
+                continue
+        array_headers[filename] = array_header
+        if staging_directory is not None and isinstance(array, np.memmap):
+            arrays[filename] = _stage(array, os.path.join(
+                    staging_directory, 
+                    '.'.join((str(len(arrays)), 'npy'))))
+        else:
+            arrays[filename] = np.array(array, copy=True)
+    header = {'format_version': FORMAT_VERSION,
+              'name': name,
+              'base': None if base is None else base['name'],
+              'num_sensors': agent.num_sensors,
+              'num_actions': agent.num_actions,
+              'timestep': agent.timestep,
+              'dtype': agent.dtype.name,
+              'num_blocks': len(blocks),
+              'arrays': array_headers}
+    return (header, pickle.dumps(skeleton, pickle.HIGHEST_PROTOCOL), arrays)
+
+def _write_file(filename, write):
+    """ Write a file with write(file), making sure it reaches the disk """
+    with open(filename, 'wb') as checkpoint_file:
+        write(checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+def _sync_file(filename):
+    """ Make sure a file that was written elsewhere reaches the disk """
+    with open(filename, 'rb+') as checkpoint_file:
+        os.fsync(checkpoint_file.fileno())
+
+def _compress_chunk(job):
+    (data, start, compress_level) = job
+    if isinstance(data, StagedArray):
+        return zlib.compress(data.read(start, CHUNK_BYTES), compress_level)
+    return zlib.compress(data[start:start + CHUNK_BYTES], compress_level)
+
+def _compress(arrays, compress_level, num_threads):
+    """
+    Compress each array in the .npy format, in parallel
+
+    Each chunk is compressed on its own, and the chunks of each
+    array are concatenated. zlib lets go of the interpreter lock
+    while it compresses, so the threads run side by side.
+    StagedArrays are read from their files a chunk at a time.
+    Returns a dict of the compressed arrays, keyed by filename.
+    """
+    jobs = []
+    for (filename, array) in arrays.items():
+        if isinstance(array, StagedArray):
+            (data, size) = (array, array.size())
+        else:
+            npy_file = cStringIO.StringIO()
+            np.save(npy_file, array)
+            data = npy_file.getvalue()
+            size = len(data)
+        for start in range(0, size, CHUNK_BYTES):
+            jobs.append((filename, (data, start, compress_level)))
+    pool = ThreadPool(processes=num_threads)
+    try:
+        chunks = pool.map(_compress_chunk, [job[1] for job in jobs])
+    finally:
+        pool.close()
+        pool.join()
+    compressed = dict([(filename, []) for filename in arrays.keys()])
+    for ((filename, job), chunk) in zip(jobs, chunks):
+        compressed[filename].append(chunk)
+    return dict([(filename, ''.join(chunks))
+                 for (filename, chunks) in compressed.items()])
+
+def _decompress(data):
+    """ Decompress the concatenated chunks written by _compress() """
+    chunks = []
+    while data:
+        decompressor = zlib.decompressobj()
+        chunks.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return ''.join(chunks)
+
+def write(directory, header, skeleton, arrays,
+          compress_level=COMPRESS_LEVEL, num_threads=NUM_THREADS):
+    """
+    Write a snapshot out as a checkpoint in directory
+
+    It is written to a temporary directory, which is then renamed
+    into place, so that a crash part way through never leaves a
+    partial checkpoint. Once a full checkpoint is in place, the
+    checkpoints before the last full one are removed, leaving
+    the last one and its deltas as the backup. So are any after
+    it, which are left over from an earlier run.
+    The files of any StagedArrays are moved into the checkpoint, 
+    or removed once they have been compressed.
+    Returns the number of bytes written.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    name = header['name']
+    temp_directory = tempfile.mkdtemp(prefix=name, suffix='.tmp',
+                                      dir=directory)
+    try:
+        if compress_level > 0:
+            compressed = _compress(arrays, compress_level, num_threads)
+        for (filename, array) in arrays.items():
+            path = os.path.join(temp_directory, filename)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            if compress_level > 0:
+                _write_file(path + COMPRESSED_SUFFIX,
+                            lambda array_file: array_file.write(
+                                    compressed[filename]))
+                if isinstance(array, StagedArray):
+                    os.remove(array.path)
+            elif isinstance(array, StagedArray):
+                os.rename(array.path, path)
+                _sync_file(path)
+            else:
+                _write_file(path,
+                            lambda array_file: np.save(array_file, array))
+            header['arrays'][filename]['compressed'] = compress_level > 0
+        _write_file(os.path.join(temp_directory, SKELETON_FILENAME),
+                    lambda skeleton_file: skeleton_file.write(skeleton))
+        # The header goes last, so that a checkpoint with a header is whole
+        _write_file(os.path.join(temp_directory, HEADER_FILENAME),
+                    lambda header_file: json.dump(header, header_file))
+        size = 0
+        for (path, directories, filenames) in os.walk(temp_directory):
+            for filename in filenames:
+                size += os.path.getsize(os.path.join(path, filename))
+        checkpoint_directory = os.path.join(directory, name)
+        if os.path.isdir(checkpoint_directory):
+            shutil.rmtree(checkpoint_directory)
+        os.rename(temp_directory, checkpoint_directory)
+    except:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        raise
+    if header['base'] is None:
+        _prune(directory, name)
+    return size
+
+def _prune(directory, name):
+    """ Remove the checkpoints that the full checkpoint name supersedes """
+    full_names = []
+    for checkpoint_name in list_checkpoints(directory):
+        if checkpoint_name >= name:
+            continue
+        try:
+            if read_header(directory, checkpoint_name)['base'] is None:
+                full_names.append(checkpoint_name)
+        except (IOError, ValueError):
+            continue
+    oldest_kept = full_names[0] if full_names else name
+    for entry in os.listdir(directory):
+        if entry == name:
+            continue
+        if entry < oldest_kept or entry > name or entry.endswith('.tmp'):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+def list_checkpoints(directory):
+    """ The names of the checkpoints in directory, latest first """
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory)
+             if name.isdigit() and os.path.isfile(
+                     os.path.join(directory, name, HEADER_FILENAME))]
+    names.sort(reverse=True)
+    return names
+
+def read_header(directory, name):
+    """ Read a checkpoint's header, without loading anything else """
+    with open(os.path.join(directory, name, HEADER_FILENAME),
+              'r') as header_file:
+        header = json.load(header_file)
+    if header['format_version'] != FORMAT_VERSION:
+        raise ValueError(' '.join(('Checkpoint format',
+                                   str(header['format_version']),
+                                   'is not supported')))
+    return header
+
+def load(directory, header, mmap_mode='c'):
+    """
+    Load the agent from the checkpoint in directory that header is for
+
+    Its blocks are loaded as they are accessed. Uncompressed arrays are
+    memory-mapped with mmap_mode, which defaults to copy-on-write.
+    Pass mmap_mode=None to read them into memory instead.
+    """
+    for checkpoint_name in set([array_header['checkpoint'] for array_header
+                                in header['arrays'].values()]):
+        if not os.path.isfile(os.path.join(directory, checkpoint_name,
+                                           HEADER_FILENAME)):
+            raise IOError(' '.join(('Checkpoint', checkpoint_name,
+                                    'is missing')))
+    with open(os.path.join(directory, header['name'], SKELETON_FILENAME),
+              'rb') as skeleton:
+        agent = pickle.load(skeleton)
+    agent.blocks = LazyBlocks(agent.blocks, directory, header['arrays'],
+                              mmap_mode)
+    return agent
+
+def _load_array(directory, filename, array_header, mmap_mode):
+    path = os.path.join(directory, array_header['checkpoint'], filename)
+    if array_header.get('compressed'):
+        with open(path + COMPRESSED_SUFFIX, 'rb') as array_file:
+            data = _decompress(array_file.read())
+        return np.load(cStringIO.StringIO(data))
+    # Empty files can't be memory-mapped
+    if np.prod(array_header['shape']) == 0:
+        return np.load(path)
+    return np.load(path, mmap_mode=mmap_mode)
+
+def _restore_arrays(obj, directory, array_headers, mmap_mode):
+    """ Replace the ArrayReferences in obj with the arrays they refer to """
+    for (name, value) in obj.__dict__.items():
+        if not isinstance(value, ArrayReference):
+            continue
+        expected = array_headers[value.filename]
+        array = _load_array(directory, value.filename, expected, mmap_mode)
+        if (list(array.shape) != expected['shape'] or
+                array.dtype.str != expected['dtype']):
+            raise ValueError(' '.join((value.filename, 'is',
+                                       str(array.shape), array.dtype.str,
+                                       'but the header says',
+                                       str(tuple(expected['shape'])),
+                                       expected['dtype'])))
+        obj.__dict__[name] = array
+    if hasattr(obj, '_allocate_workspace'):
+        obj._allocate_workspace()
+
+class LazyBlocks(list):
+    """
+    A list of blocks that are loaded from a checkpoint on first access
+
+    Until then, each block is a skeleton whose arrays are
+    ArrayReferences. It behaves as a list in every other way,
+    and blocks appended to it are taken as they are.
+    """
+    def __init__(self, blocks, directory, array_headers, mmap_mode):
+        list.__init__(self, blocks)
+        self.directory = directory
+        self.array_headers = array_headers
+        self.mmap_mode = mmap_mode
+        self.loaded = [False] * len(blocks)
+
+    def _load(self, index):
+        if self.loaded[index]:
+            return
+        block = list.__getitem__(self, index)
+        for obj in [block] + [getattr(block, component_name)
+                              for component_name in BLOCK_COMPONENTS]:
+            _restore_arrays(obj, self.directory, self.array_headers,
+                            self.mmap_mode)
+        self.loaded[index] = True
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if 0 <= index < len(self.loaded):
+            self._load(index)
+        return list.__getitem__(self, index)
+
+    def __getslice__(self, start, stop):
+        return self[slice(start, stop)]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __reversed__(self):
+        for index in reversed(range(len(self))):
+            yield self[index]
+
+    def append(self, block):
+        list.append(self, block)
+        self.loaded.append(True)
+
+    def __reduce__(self):
+        # Pickle as a plain list, with every block loaded
+        return (list, (list(self),))
@@ -0,0 +1,126 @@
+import multiprocessing
+import Queue
+import traceback
+
+import numpy as np
+
+"""
+Plotting, kept out of the process that steps the agent and the world
+
+The agent and the world publish small snapshots of what they want
+shown to a Display. Each snapshot is a render function, along with
+the arguments to call it with. They are passed through a queue to
+a plotting process of the display's own, which calls them. Nothing
+is drawn in the stepping process, and it never imports matplotlib.
+
+Render functions have to be picklable, so they are module-level
+functions, such as plot_history() and show_image() below. Their
+arguments are pickled too, so they should be copies of any state
+that will keep changing, and downsampled if they are long.
+"""
+
+# The longest history that is sent to be plotted.
+# Longer ones are downsampled to this many points.
+MAX_POINTS = 1000
+# How often the plotting process lets the figure windows
+# handle their events while it waits, in seconds
+REFRESH_INTERVAL = .1
+
+def downsample(values, max_points=MAX_POINTS):
+    """
+    Pick out at most max_points evenly spaced values
+
+    Returns an array of the indices of the values picked,
+    and an array of the values.
+    """
+    values = np.asarray(values)
+    stride = max(1, int(np.ceil(float(values.shape[0]) / max_points)))
+    indices = np.arange(0, values.shape[0], stride)
+    return (indices, values[indices])
+
+class Display(object):
+    """ Hands snapshots to a separate process that plots them """
+    def __init__(self, interactive=True, queue_size=16):
+        """
+        Start the plotting process
+
+        If interactive is False, the figures are only saved,
+        never shown, and matplotlib doesn't load a GUI toolkit.
+        At most queue_size snapshots wait to be plotted. When the
+        plotting process falls further behind than that, new
+        snapshots are dropped rather than holding up the caller.
+        """
+        self.interactive = interactive
+        self.num_dropped = 0
+        self._queue = multiprocessing.Queue(queue_size)
+        self._process = multiprocessing.Process(
+                target=_render, args=(self._queue, interactive))
+        # The plotting process doesn't outlive the one that started it
+        self._process.daemon = True
+        self._process.start()
+
+    def publish(self, render, *args, **kwargs):
+        """ Have render(*args, **kwargs) called in the plotting process """
+        try:
+            self._queue.put_nowait((render, args, kwargs))
+        except Queue.Full:
+            self.num_dropped += 1
+
+    def close(self, hold=False):
+        """
+        Wait for the snapshots that are queued to be plotted
+
+        If hold is True and the display is interactive, the figures
+        stay up until they are closed.
+        """
+        self._queue.put(('close', hold))
+        self._process.join()
+
+def _render(queue, interactive):
+    """ Plot snapshots from queue until the display is closed """
+    import matplotlib.pyplot as plt
+    if not interactive:
+        plt.switch_backend('agg')
+    while True:
+        try:
+            item = queue.get(timeout=REFRESH_INTERVAL)
+        except Queue.Empty:
+            if interactive and plt.get_fignums():
+                plt.pause(REFRESH_INTERVAL)
+            continue
+        if item[0] == 'close':
+            if interactive and item[1]:
+                plt.show()
+            return
+        (render, args, kwargs) = item
+        try:
+            render(*args, **kwargs)
+        except Exception:
+            # A broken plot shouldn't take the display down with it
+            traceback.print_exc()
+
+def plot_history(figure, steps, values, title, xlabel='time step',
+                 ylabel='', style='-', filename=None):
+    """ Plot values against steps, replacing what was in figure """
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figure)
+    plt.clf()
+    plt.plot(steps, values, style)
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    fig.canvas.draw()
+    if filename is not None:
+        plt.savefig(filename, format='png')
+
+def show_image(figure, image, title, filename=None):
+    """ Show a grayscale image, replacing what was in figure """
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figure)
+    plt.clf()
+    plt.gray()
+    plt.imshow(image, interpolation='nearest')
+    plt.title(title)
+    fig.canvas.draw()
+    if filename is not None:
+        plt.savefig(filename, format='png')
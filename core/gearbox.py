@@ -0,0 +1,983 @@
+import numpy as np
+
+from instruments import Instruments
+import tools
+import ziptie
+
+class Gearbox(object):
+    """
+    All of the cogs in a block, stepped together
+
+    Cogs are named for their similarity to clockwork cogwheels.
+    Each has a daisychain and a ziptie. The daisychain joins the 
+    cog's cables end to end in two-element sequences, chains, 
+    each with a pre cable and a post cable. If activity in the 
+    post cable follows activity in the pre cable, the activity 
+    in the chain they share is high. Each chain also tracks the 
+    expected post activity and reward, the uncertainty in them, 
+    and a count of how many times it has been active. The ziptie 
+    bundles co-active chains together, as ZipTie does with cables, 
+    using the constants and formulas in ziptie.py.
+
+    A block may contain hundreds of cogs. Stepping them one at a time
+    spends most of its effort in the Python interpreter, shuffling 
+    tiny arrays. The gearbox holds the state of every cog's daisychain
+    and ziptie stacked along a leading cog axis, and updates all of 
+    them with a handful of array operations.
+
+    A daisychain that keeps every pre-post pair grows with the square
+    of its cables, even though most pairs are never active together.
+    If the cogs are given fewer than max_cables successors for each 
+    cable, each cable keeps only its strongest successors, each in 
+    a slot. successors holds the post cable in each slot, or -1 
+    where the slot is empty. When a post cable follows a pre cable 
+    that it isn't already a successor of, it takes an empty slot. 
+    If there are none, it takes the slot with the smallest count, 
+    as long as that count is smaller than the activity of the new 
+    chain. Pairs that don't have a slot behave like pairs that have 
+    never been active. The chains are then indexed by 
+    (pre cable, slot), rather than by (pre cable, post cable).
+
+    A gearbox can also hold the cogs of the blocks of several agents, 
+    all at the same level, as in AgentBatch. Each agent's cogs are 
+    kept together, in the order the agents were added, and are stepped 
+    with its own reward and its own count of time steps. The cogs are 
+    stepped in groups that never split an agent's first WORKSPACE_COGS 
+    cogs, or its next WORKSPACE_COGS, and so on, and each agent's 
+    random numbers are drawn from its own random state. This way each 
+    agent's cogs end up just as they would have in a gearbox of its own.
+    """
+    # The largest parts of the state, which are kept in the array store
+    # if there is one. They are all updated in place.
+    STORED_STATE = ['count', 'expected_post', 'post_uncertainty', 
+                    'reward_value', 'reward_uncertainty', 'last_aged', 
+                    'bundle_masks', 'agglomeration_energy', 
+                    'nucleation_energy']
+
+    def __init__(self, max_cogs, max_cables, max_bundles,
+                 max_chains_per_bundle=None, name='anonymous', level=0,
+                 dtype=np.float64, compact=False, instruments=None,
+                 store=None, max_successors=None, random_state=None):
+        """ 
+        Initialize an empty gearbox 
+        
+        Cogs are only created, by add_cogs(), as the block finds 
+        cables for them. Until then they take up no memory and 
+        no time. Their state is kept in the floating point type dtype.
+        If compact is True, their counts are kept in 16 bit fixed point
+        instead, at a quarter of the size. They are rounded to 
+        COUNT_RESOLUTION stochastically, so that the aging and the 
+        small increments they get each step, which are much finer 
+        than that, aren't lost. The cog updates 
+        are timed, and bundle growth counted, in instruments, if they 
+        are given and enabled.
+        If an ArrayStore is given, the STORED_STATE of all max_cogs 
+        cogs is allocated in it up front, and the cogs are 
+        slices of it, rather than growing by concatenation.
+        If max_successors is given, and is less than max_cables, 
+        each cable keeps at most that many successors, 
+        as described above, and the daisychains and zipties grow with 
+        max_cables * max_successors, rather than with max_cables ** 2.
+        The gearbox starts out holding the cogs of a single agent, 
+        which draws its random numbers using random_state, 
+        or np.random if it is None. max_cogs is the most cogs 
+        that each agent can have.
+        """
+        self.name = name
+        if instruments is None:
+            instruments = Instruments()
+        self.instruments = instruments
+        self.store = store
+        self.dtype = np.dtype(dtype)
+        self.compact = compact
+        self.level = level
+        self.max_cogs = max_cogs
+        self.num_cogs = 0
+        self.max_cables = max_cables
+        self.max_bundles = max_bundles
+        if max_successors is None:
+            max_successors = max_cables
+        self.max_successors = min(max_successors, max_cables)
+        self.sparse = self.max_successors < max_cables
+        # Each cog's chains are indexed by (pre cable, successor).
+        # Without a limit on successors, a cable's successors are 
+        # all the cables, in order.
+        self.max_chains = max_cables * self.max_successors
+        if max_chains_per_bundle is None:
+            max_chains_per_bundle = int(self.max_chains / max_bundles)
+        self.max_chains_per_bundle = max_chains_per_bundle
+        # Each bundle's chains are kept as a bitset, 
+        # packed into this many 64 bit words
+        self.words_per_bundle = tools.num_words(self.max_chains)
+
+        # Daisychain constants
+        self.AGING_TIME_CONSTANT = 10 ** 6 # real, large
+        self.CHAIN_UPDATE_RATE = 10 ** -5 # real, 0 < x < 1
+        self.VOTE_DECAY_RATE = 0.1 # real, 0 < x < 1
+        self.INITIAL_UNCERTAINTY = 0.5 # real, 0 < x < 1
+        self.COUNT_RESOLUTION = 2. ** -7 # real, 0 < x
+        # The zipties' constants are those in ziptie.py, 
+        # which every ziptie shares
+        # The cogs are stepped in groups of at most this many, so that 
+        # the workspaces and temporary arrays stay small however many 
+        # cogs there are
+        self.WORKSPACE_COGS = 64 # int, 0 < x
+        if self.sparse:
+            self.STORED_STATE = Gearbox.STORED_STATE + ['successors']
+
+        self.num_agents = 1
+        self.random_states = [random_state]
+        # Agent a's cogs are agent_cogs[a] up to agent_cogs[a + 1], 
+        # and cog_agents holds the agent of each cog
+        self.agent_cogs = np.zeros(2, dtype=np.int)
+        self.cog_agents = np.zeros(0, dtype=np.int)
+        # Each agent's reward and time steps
+        self.current_reward = np.zeros(1, dtype=self.dtype)
+        self.time_steps = np.zeros(1, dtype=np.int)
+        for (state_name, state) in self._initial_state(0).items():
+            setattr(self, state_name, state)
+        self.store = None
+        self.use_store(store)
+        self._allocate_workspace()
+
+    def _store_name(self, state_name):
+        return '/'.join((self.name, state_name))
+
+    def use_store(self, store):
+        """ 
+        Keep the STORED_STATE in an ArrayStore from now on
+
+        Room is made in store for all max_cogs cogs, and the state of 
+        the cogs that already exist is copied in. If store is None, 
+        the state is left where it is, and grows in memory.
+        """
+        if store is self.store:
+            return
+        if store is not None and self.num_agents > 1:
+            raise ValueError("A gearbox shared by several agents " +
+                             "can't keep its state in an ArrayStore")
+        self.store = store
+        if store is None:
+            return
+        for state_name in self.STORED_STATE:
+            state = getattr(self, state_name)
+            capacity = store.zeros(self._store_name(state_name), 
+                                   (self.max_cogs,) + state.shape[1:], 
+                                   state.dtype)
+            capacity[:self.num_cogs] = state
+            setattr(self, state_name, capacity[:self.num_cogs])
+
+    def _initial_state(self, num_cogs):
+        """ Build the state of num_cogs freshly created cogs """
+        # Daisychain state, one (max_cables x max_successors) slice per cog
+        daisychain_shape = (num_cogs, self.max_cables, self.max_successors)
+        cable_shape = (num_cogs, self.max_cables, 1)
+        # ZipTie state, one (max_bundles x max_chains) slice per cog
+        map_shape = (num_cogs, self.max_bundles, self.max_chains)
+        count_dtype = np.uint16 if self.compact else self.dtype
+        state = {
+            'count': np.zeros(daisychain_shape, dtype=count_dtype),
+            # Every chain in a row shares the same pre cable, so the 
+            # pre counts are all the same along a row. 
+            # One column of them is kept.
+            'pre_count': np.zeros(cable_shape, dtype=count_dtype),
+            'expected_post': np.zeros(daisychain_shape, dtype=self.dtype),
+            'post_uncertainty': np.zeros(daisychain_shape, dtype=self.dtype),
+            'reward_value': np.zeros(daisychain_shape, dtype=self.dtype),
+            'reward_uncertainty': (np.ones(daisychain_shape, 
+                                           dtype=self.dtype) * 
+                                   self.INITIAL_UNCERTAINTY),
+            # The time step each row of count and pre_count was last aged
+            'last_aged': np.zeros((num_cogs, self.max_cables), dtype=np.int),
+            'pre': np.zeros(cable_shape, dtype=self.dtype),
+            'post': np.zeros(cable_shape, dtype=self.dtype),
+            'num_cables': np.zeros(num_cogs, dtype=np.int),
+            'reaction': np.zeros(cable_shape, dtype=self.dtype),
+            'deliberation_vote': np.zeros(cable_shape, dtype=self.dtype),
+            'surprise': np.ones(cable_shape, dtype=self.dtype),
+            'bundle_masks': np.zeros((num_cogs, self.max_bundles, 
+                                      self.words_per_bundle), 
+                                     dtype=np.uint64),
+            'agglomeration_energy': np.zeros(map_shape, dtype=self.dtype),
+            'nucleation_energy': np.zeros((num_cogs, self.max_chains, 1), 
+                                          dtype=self.dtype),
+            'bundle_activities': np.zeros((num_cogs, self.max_bundles, 1), 
+                                          dtype=self.dtype),
+            'num_bundles': np.zeros(num_cogs, dtype=np.int)}
+        if self.sparse:
+            # The post cable in each slot, or -1 where the slot is empty
+            state['successors'] = -np.ones(daisychain_shape, dtype=np.int)
+        return state
+
+    def add_agent(self, random_state=None):
+        """ 
+        Make room for the cogs of another agent 
+
+        It starts with no cogs, and draws its random numbers 
+        using random_state, or np.random if it is None.
+        Returns the index of the new agent.
+        """
+        if self.store is not None:
+            raise ValueError("A gearbox that keeps its state in an " +
+                             "ArrayStore can't be shared by several agents")
+        self.num_agents += 1
+        self.random_states.append(random_state)
+        self.agent_cogs = np.append(self.agent_cogs, self.num_cogs)
+        self.current_reward = np.append(self.current_reward, 
+                                        self.dtype.type(0.))
+        self.time_steps = np.append(self.time_steps, 0)
+        return self.num_agents - 1
+
+    def cog_slice(self, agent=0):
+        """ The slice of the cogs that belong to one of the agents """
+        return slice(self.agent_cogs[agent], self.agent_cogs[agent + 1])
+
+    def add_cogs(self, num_new_cogs, agent=0):
+        """ Create num_new_cogs cogs after the ones an agent already has """
+        num_agent_cogs = self.agent_cogs[agent + 1] - self.agent_cogs[agent]
+        num_new_cogs = min(num_new_cogs, self.max_cogs - num_agent_cogs)
+        if num_new_cogs <= 0:
+            return
+        new_num_cogs = self.num_cogs + num_new_cogs
+        # The new cogs go in after the agent's others, 
+        # ahead of the next agent's
+        position = self.agent_cogs[agent + 1]
+        for (state_name, new_state) in self._initial_state(
+                num_new_cogs).items():
+            state = getattr(self, state_name)
+            if self.store is None or state_name not in self.STORED_STATE:
+                setattr(self, state_name, np.concatenate(
+                        (state[:position], new_state, state[position:])))
+                continue
+            capacity = self.store.get(self._store_name(state_name))
+            # A gearbox loaded from a checkpoint has its state somewhere
+            # else until use_store() is called. It is moved into the store.
+            if not np.may_share_memory(state, capacity):
+                capacity[:self.num_cogs] = state
+            capacity[self.num_cogs:new_num_cogs] = new_state
+            setattr(self, state_name, capacity[:new_num_cogs])
+        self.num_cogs = new_num_cogs
+        self.agent_cogs[agent + 1:] += num_new_cogs
+        self.cog_agents = np.repeat(np.arange(self.num_agents), 
+                                    np.diff(self.agent_cogs))
+        self._allocate_workspace()
+
+    def _allocate_workspace(self):
+        """ 
+        Make room for the temporary arrays of the upward and downward passes
+
+        They are reused on every time step, and only reallocated
+        when cogs are added. Each is big enough for one group of 
+        WORKSPACE_COGS cogs. The daisychain updates gather the rows of
+        the active cables of a group of cogs into the top of the row 
+        workspaces.
+        The groups are found here too. Each agent's cogs are split into 
+        runs of WORKSPACE_COGS, as they would be in a gearbox of its own,
+        and runs are put together in a group while they fit.
+        """
+        self._groups = []
+        for agent in range(self.num_agents):
+            for first_cog in range(self.agent_cogs[agent], 
+                                   self.agent_cogs[agent + 1], 
+                                   self.WORKSPACE_COGS):
+                last_cog = min(first_cog + self.WORKSPACE_COGS, 
+                               self.agent_cogs[agent + 1])
+                if (self._groups and last_cog - self._groups[-1][0] <= 
+                        self.WORKSPACE_COGS):
+                    self._groups[-1] = (self._groups[-1][0], last_cog)
+                else:
+                    self._groups.append((first_cog, last_cog))
+        group_size = min(self.num_cogs, self.WORKSPACE_COGS)
+        daisychain_shape = (group_size, self.max_cables, self.max_successors)
+        self._chain_activities = np.zeros(daisychain_shape, dtype=self.dtype)
+        self._bundle_activities = np.zeros(
+                (self.num_cogs, self.max_bundles, 1), dtype=self.dtype)
+        row_shape = (group_size * self.max_cables, self.max_successors)
+        (self._pre_rows, self._pre_count_rows, 
+         self._pre_workspace) = np.zeros((3, row_shape[0], 1), 
+                                         dtype=self.dtype)
+        (self._post_rows, self._instant_post, self._chains, 
+         self._update_rate, self._values, self._uncertainties, 
+         self._difference, self._magnitude) = np.zeros((8,) + row_shape, 
+                                                       dtype=self.dtype)
+        (self._reward_noise, self._estimated_reward_value, 
+         self._reward_weights) = np.zeros((3,) + daisychain_shape, 
+                                          dtype=self.dtype)
+        map_shape = (group_size, self.max_bundles, self.max_chains)
+        (self._bundle_goals_by_chain, self._mapped_bundle_goals) = np.zeros(
+                (2,) + map_shape, dtype=self.dtype)
+
+    def step_up(self, cable_activities, num_cables, reward, enough_cables):
+        """
+        cable_activities percolate upward through daisychains and zipties
+
+        cable_activities is a (num_cogs x max_cables x 1) array,
+        padded with zeros where a cog has fewer than max_cables cables.
+        num_cables is the number of cables each cog actually has.
+        enough_cables is a boolean array, one element per cog, showing
+        which cogs are ready to start bundling their chains.
+        reward is a scalar, or an array with one element for each agent.
+        Returns a (num_cogs x max_bundles x 1) array of bundle activities,
+        which is overwritten on the next step.
+        """
+        self.num_cables = np.maximum(self.num_cables, num_cables)
+        self.current_reward[:] = reward
+        self.time_steps += 1
+        self.pre = self.post
+        self.post = cable_activities.astype(self.dtype, copy=False)
+        bundle_activities = self._bundle_activities
+        bundle_activities.fill(0.)
+        for (first_cog, last_cog) in self._groups:
+            start_time = self.instruments.start()
+            chain_activities = self._update_daisychains(first_cog, last_cog)
+            self.instruments.stop(self.name + '.update_daisychains', 
+                                  start_time)
+            bundling_cogs = np.nonzero(enough_cables[first_cog:last_cog])[0]
+            if bundling_cogs.size > 0:
+                start_time = self.instruments.start()
+                bundle_activities[bundling_cogs + first_cog] = (
+                        self._update_zipties(bundling_cogs + first_cog, 
+                                             chain_activities[bundling_cogs]))
+                self.instruments.stop(self.name + '.update_zipties', 
+                                      start_time)
+        return bundle_activities
+
+    def _update_daisychains(self, first_cog, last_cog):
+        """ 
+        Train a group of daisychains on the latest cable activities
+
+        The group is the cogs from first_cog up to, but not including,
+        last_cog. Only the rows of cables that were active on the 
+        previous time step, the pre cables, are changed. All the others 
+        would only have their counts aged. That is put off until they 
+        are next used, in _age_rows().
+        Returns the group's chain activities, which are overwritten 
+        by the next group.
+        """
+        group_size = last_cog - first_cog
+        chain_activities = self._chain_activities[:group_size]
+        chain_activities.fill(0.)
+        reaction = self.reaction[first_cog:last_cog]
+        surprise = self.surprise[first_cog:last_cog]
+        # group_cogs are numbered within the group, cogs within the gearbox
+        (group_cogs, rows) = np.nonzero(self.pre[first_cog:last_cog,:,0])
+        if rows.size == 0:
+            reaction.fill(0.)
+            surprise.fill(0.)
+            return chain_activities.reshape(group_size, self.max_chains, 1)
+        cogs = group_cogs + first_cog
+        agents = self.cog_agents[cogs]
+        time_steps = self.time_steps[agents]
+        reward = self.current_reward[agents][:,np.newaxis]
+        self._age_rows(cogs, rows, steps_behind=1)
+        if self.sparse:
+            self._admit_successors(cogs, rows)
+        # Work on the active rows, gathered into the top of the workspace
+        num_rows = rows.size
+        flat_rows = cogs * self.max_cables + rows
+        pre = self._get_rows(self.pre, flat_rows, self._pre_rows[:num_rows])
+        if self.sparse:
+            # The activity of the post cable in each slot. 
+            # Empty slots have none.
+            successors = self.successors[cogs, rows]
+            occupied = successors >= 0
+            post = np.take(self.post[:,:,0].ravel(), 
+                           cogs[:,np.newaxis] * self.max_cables + successors, 
+                           out=self._post_rows[:num_rows])
+            post *= occupied
+        else:
+            post = np.take(self.post[:,:,0], cogs, axis=0, 
+                           out=self._post_rows[:num_rows])
+        instant_post = np.multiply(pre, post, 
+                                   out=self._instant_post[:num_rows])
+        chains = self._chains[:num_rows]
+        chains[...] = instant_post
+        if self.sparse:
+            chains[successors == rows[:,np.newaxis]] = 0.
+        else:
+            chains[np.arange(num_rows), rows] = 0.
+        chain_activities[group_cogs, rows] = chains
+        update_rate = self._update_rate[:num_rows]
+        difference = self._difference[:num_rows]
+        magnitude = self._magnitude[:num_rows]
+
+        count = self._get_counts(self.count, cogs, rows, 
+                                 self._values[:num_rows])
+        self._find_update_rate(count, chains, update_rate)
+        count += chains
+        self._age_one_step(count, magnitude)
+        self._set_counts(self.count, cogs, rows, count)
+        reward_value = self._get_rows(self.reward_value, flat_rows, 
+                                      self._values[:num_rows])
+        reward_uncertainty = self._get_rows(self.reward_uncertainty, 
+                                            flat_rows, 
+                                            self._uncertainties[:num_rows])
+        np.subtract(reward, reward_value, out=difference)
+        np.abs(difference, out=magnitude)
+        difference *= update_rate
+        reward_value += difference
+        magnitude -= reward_uncertainty
+        magnitude *= update_rate
+        reward_uncertainty += magnitude
+        self.reward_value[cogs, rows] = reward_value
+        self.reward_uncertainty[cogs, rows] = reward_uncertainty
+
+        pre_count = self._get_counts(self.pre_count, cogs, rows, 
+                                     self._pre_count_rows[:num_rows])
+        self._find_update_rate(pre_count, pre, update_rate)
+        pre_count += pre
+        self._age_one_step(pre_count, self._pre_workspace[:num_rows])
+        self._set_counts(self.pre_count, cogs, rows, pre_count)
+        self.last_aged[cogs, rows] = time_steps
+        expected_post = self._get_rows(self.expected_post, flat_rows, 
+                                       self._values[:num_rows])
+        post_uncertainty = self._get_rows(self.post_uncertainty, flat_rows, 
+                                          self._uncertainties[:num_rows])
+        np.subtract(instant_post, expected_post, out=difference)
+        np.abs(difference, out=magnitude)
+        difference *= update_rate
+        expected_post += difference
+        magnitude -= post_uncertainty
+        magnitude *= update_rate
+        post_uncertainty += magnitude
+        self.expected_post[cogs, rows] = expected_post
+        self.post_uncertainty[cogs, rows] = post_uncertainty
+
+        # Reaction and surprise are weighted averages over the pre cables,
+        # as in tools.weighted_average
+        np.multiply(expected_post, pre, out=difference)
+        if self.sparse:
+            sum_of_pre = np.bincount(group_cogs, weights=pre[:,0], 
+                                     minlength=group_size)
+            reaction[:,:,0] = (self._sum_by_cable(
+                    group_cogs[:,np.newaxis], successors, difference, 
+                    group_size) / 
+                    (sum_of_pre[:,np.newaxis] + tools.EPSILON))
+        else:
+            self._average_rows(reaction, group_cogs, difference, pre)
+        np.subtract(post, expected_post, out=difference)
+        np.abs(difference, out=difference)
+        np.add(post_uncertainty, tools.EPSILON, out=magnitude)
+        np.divide(pre, magnitude, out=magnitude)
+        difference *= magnitude
+        if self.sparse:
+            # Pairs without a slot have no expected post 
+            # and no uncertainty
+            unstored_weights = self._unstored_weights(
+                    group_cogs, successors, pre, group_size) / tools.EPSILON
+            weighted_surprise = (self._sum_by_cable(
+                    group_cogs[:,np.newaxis], successors, difference, 
+                    group_size) + 
+                    unstored_weights * self.post[first_cog:last_cog,:,0])
+            surprise[:,:,0] = weighted_surprise / (self._sum_by_cable(
+                    group_cogs[:,np.newaxis], successors, magnitude, 
+                    group_size) + unstored_weights + tools.EPSILON)
+        else:
+            self._average_rows(surprise, group_cogs, difference, magnitude)
+        # Reshape chain activities into a single column for each cog
+        return chain_activities.reshape(group_size, self.max_chains, 1)
+
+    def _find_update_rate(self, count, activities, out):
+        """ The rate at which rows of a count's estimates are updated """
+        np.add(count, tools.EPSILON, out=out)
+        np.divide(1 - self.CHAIN_UPDATE_RATE, out, out=out)
+        out += self.CHAIN_UPDATE_RATE
+        out *= activities
+        np.minimum(out, 0.5, out=out)
+        return out
+
+    def _age_one_step(self, count, workspace):
+        """ Age rows of counts by one time step, in place """
+        np.multiply(count, self.AGING_TIME_CONSTANT, out=workspace)
+        workspace += tools.EPSILON
+        np.reciprocal(workspace, out=workspace)
+        count -= workspace
+        np.maximum(count, 0., out=count)
+        return count
+
+    def _admit_successors(self, cogs, rows):
+        """ 
+        Give slots to post cables that have just followed a pre cable
+
+        Each row admits its most active new post cable, 
+        then its next most active, and so on, until it runs out or
+        the new chains are weaker than any of the ones in its slots.
+        """
+        successors = self.successors[cogs, rows]
+        occupied = successors >= 0
+        new_activities = self.pre[cogs, rows] * self.post[cogs,:,0]
+        (row_indices, slots) = np.nonzero(occupied)
+        new_activities[row_indices, successors[row_indices, slots]] = 0.
+        if not np.any(new_activities > 0.):
+            return
+        count = self._get_counts(self.count, cogs, rows)
+        count[np.logical_not(occupied)] = -1.
+        row_indices = np.arange(rows.size)
+        for admission in range(self.max_successors):
+            new_posts = np.argmax(new_activities, axis=1)
+            new_activity = new_activities[row_indices, new_posts]
+            slots = np.argmin(count, axis=1)
+            admitted = np.nonzero(np.logical_and(
+                    new_activity > 0., 
+                    new_activity > count[row_indices, slots]))[0]
+            if admitted.size == 0:
+                return
+            slot_index = (cogs[admitted], rows[admitted], slots[admitted])
+            self.successors[slot_index] = new_posts[admitted]
+            self.count[slot_index] = 0
+            self.expected_post[slot_index] = 0.
+            self.post_uncertainty[slot_index] = 0.
+            self.reward_value[slot_index] = 0.
+            self.reward_uncertainty[slot_index] = self.INITIAL_UNCERTAINTY
+            # Keep a newly admitted chain from being evicted 
+            # by the next one
+            count[admitted, slots[admitted]] = np.inf
+            new_activities[admitted, new_posts[admitted]] = 0.
+
+    def _sum_by_cable(self, cogs, successors, values, num_cogs):
+        """ 
+        Add up the values of the slots that hold each post cable
+
+        cogs are the indices, within a group of num_cogs cogs, of 
+        the cogs that the slots belong to. They broadcast against 
+        successors, as values do. Returns a (num_cogs x max_cables) 
+        array of sums.
+        """
+        occupied = successors >= 0
+        columns = (cogs * self.max_cables + successors)[occupied]
+        return np.bincount(columns, weights=values[occupied], 
+                           minlength=num_cogs * self.max_cables).reshape(
+                                   num_cogs, self.max_cables)
+
+    def _unstored_weights(self, cogs, successors, weights, num_cogs):
+        """ 
+        Add up the weights of the rows that don't have a slot 
+        for each post cable
+
+        successors and weights hold a row for each of the rows, 
+        and cogs says which of a group of num_cogs cogs each belongs to.
+        Returns a (num_cogs x max_cables) array of sums.
+        """
+        unstored = np.ones((successors.shape[0], self.max_cables), 
+                           dtype=np.bool)
+        (row_indices, slots) = np.nonzero(successors >= 0)
+        unstored[row_indices, successors[row_indices, slots]] = False
+        (row_indices, columns) = np.nonzero(unstored)
+        return np.bincount(cogs[row_indices] * self.max_cables + columns,
+                           weights=weights[row_indices, 0], 
+                           minlength=num_cogs * self.max_cables).reshape(
+                                   num_cogs, self.max_cables)
+
+    def _average_rows(self, out, cogs, weighted_values, weights):
+        """ 
+        Average the rows belonging to each cog, writing into out 
+        
+        cogs is in ascending order, as np.nonzero returns it, so each 
+        cog's rows are next to each other and can be summed as a group.
+        """
+        (active_cogs, first_rows) = np.unique(cogs, return_index=True)
+        out[...] = 0.
+        sum_of_weights = np.add.reduceat(weights, first_rows, axis=0)
+        sum_of_weights += tools.EPSILON
+        averages = np.add.reduceat(weighted_values, first_rows, axis=0)
+        averages /= sum_of_weights
+        out[active_cogs,:,0] = averages
+
+    def _age_rows(self, cogs, rows, steps_behind=0):
+        """ 
+        Bring the counts in some rows up to date 
+        
+        Each row is brought up to steps_behind steps before the 
+        current time step of the agent its cog belongs to.
+        """
+        time_steps = self.time_steps[self.cog_agents[cogs]] - steps_behind
+        stale = self.last_aged[cogs, rows] < time_steps
+        if not np.any(stale):
+            return
+        (cogs, rows, time_steps) = (cogs[stale], rows[stale], 
+                                    time_steps[stale])
+        steps = (time_steps - self.last_aged[cogs, rows])[:,np.newaxis]
+        for counts in (self.count, self.pre_count):
+            self._set_counts(counts, cogs, rows, tools.age_count(
+                    self._get_counts(counts, cogs, rows), steps, 
+                    self.AGING_TIME_CONSTANT))
+        self.last_aged[cogs, rows] = time_steps
+
+    def _get_rows(self, state, flat_rows, out):
+        """ 
+        Gather some rows of a piece of state into out 
+
+        flat_rows are the rows' indices with the cogs' rows laid 
+        end to end, cog * max_cables + row.
+        """
+        return np.take(state.reshape((-1,) + state.shape[2:]), flat_rows, 
+                       axis=0, out=out)
+
+    def _get_counts(self, counts, cogs, rows, out=None):
+        """ Gather some rows of counts, as floating point numbers """
+        if self.compact:
+            return tools.from_fixed_point(counts[cogs, rows], 
+                                          self.COUNT_RESOLUTION, 
+                                          dtype=self.dtype, out=out)
+        if out is None:
+            return counts[cogs, rows]
+        return self._get_rows(counts, cogs * self.max_cables + rows, out)
+
+    def _set_counts(self, counts, cogs, rows, values):
+        """ Scatter floating point values back into some rows of counts """
+        if self.compact:
+            values = tools.to_fixed_point(
+                    values, self.COUNT_RESOLUTION, stochastic=True, 
+                    random_sample=lambda shape: self._random_sample(
+                            cogs, shape[1:]))
+        counts[cogs, rows] = values
+
+    def _random(self, cog):
+        """ Where to draw the random numbers for one of the cogs from """
+        return tools.random_source(self.random_states[self.cog_agents[cog]])
+
+    def _random_sample(self, cogs, shape):
+        """ 
+        Draw a (cogs.size,) + shape array of random numbers, 
+        a slice of shape for each of cogs
+
+        cogs are in ascending order. The slices for each agent's cogs
+        are drawn together, from its own random state. 
+        """
+        if cogs.size == 0:
+            return np.zeros((0,) + shape)
+        # Each agent's cogs are next to each other
+        starts = np.concatenate((
+                [0], np.nonzero(np.diff(self.cog_agents[cogs]))[0] + 1))
+        ends = np.append(starts[1:], cogs.size)
+        samples = [self._random(cogs[start]).random_sample(
+                           (end - start,) + shape)
+                   for (start, end) in zip(starts, ends)]
+        if len(samples) == 1:
+            return samples[0]
+        return np.concatenate(samples)
+
+    def _update_zipties(self, cogs, chain_activities):
+        """ Bundle the chains of the selected cogs, as in ZipTie.update """
+        # Membership is stored as bitsets, and unpacked to use as weights
+        bundle_map = tools.unpack_bits(self.bundle_masks[cogs], 
+                                       self.max_chains, dtype=self.dtype)
+        agglomeration_energy = self.agglomeration_energy[cogs]
+        nucleation_energy = self.nucleation_energy[cogs]
+        num_bundles = self.num_bundles[cogs]
+        map_transpose = bundle_map.transpose(0, 2, 1)
+        initial_bundle_activities = tools.generalized_mean(
+                chain_activities, map_transpose, ziptie.MEAN_EXPONENT)
+        bundle_contribution_map = np.zeros(bundle_map.shape, dtype=self.dtype)
+        bundle_contribution_map[np.nonzero(bundle_map)] = 1.
+        activated_bundle_map = (initial_bundle_activities *
+                                bundle_contribution_map)
+        # Find the largest bundle activity that each chain contributes to
+        max_activation = (np.max(activated_bundle_map, axis=1,
+                                 keepdims=True) + tools.EPSILON)
+        # Divide the energy that each chain contributes to each bundle
+        inhibited_chain_activities = ziptie.inhibit(
+                activated_bundle_map, max_activation, 
+                chain_activities.transpose(0, 2, 1))
+        bundle_activities = tools.generalized_mean(
+                inhibited_chain_activities.transpose(0, 2, 1), map_transpose,
+                ziptie.MEAN_EXPONENT)
+        # Calculate how much energy each chain has left to contribute
+        # to the co-activity estimate
+        final_activated_bundle_map = (bundle_activities *
+                                      bundle_contribution_map)
+        combined_weights = np.sum(final_activated_bundle_map,
+                                  axis=1)[:,:,np.newaxis]
+        nonbundle_activities = np.maximum(0., (chain_activities -
+                                               combined_weights))
+
+        # Create new bundles, as in ZipTie._create_new_bundles.
+        # Cogs whose bundles are all in use leave their energy untouched.
+        bundles_open = (num_bundles < self.max_bundles)[:,np.newaxis,np.newaxis]
+        ziptie.update_nucleation_energy(
+                nucleation_energy, chain_activities, nonbundle_activities, 
+                ziptie.NUCLEATION_ENERGY_RATE * bundles_open)
+        candidates = np.logical_and(
+                nucleation_energy[:,:,0] > ziptie.JOINING_THRESHOLD,
+                bundles_open[:,:,0])
+        for cog_index in np.nonzero(np.any(candidates, axis=1))[0]:
+            chain_indices = np.nonzero(candidates[cog_index,:])[0]
+            # Randomly pick a new chain from the candidates,
+            # if there is more than one
+            chain_index = chain_indices[int(
+                    self._random(cogs[cog_index]).random_sample() *
+                    chain_indices.size)]
+            tools.set_bit(self.bundle_masks[cogs[cog_index], 
+                                            num_bundles[cog_index]], 
+                          chain_index)
+            num_bundles[cog_index] += 1
+            self.instruments.count(self.name + '.bundles_created')
+            print ''.join(('cog', str(cogs[cog_index]))), 'ci', \
+                    chain_index, 'added as a bundle nucleus'
+            nucleation_energy[cog_index, chain_index, 0] = 0.
+            agglomeration_energy[cog_index, :, chain_index] = 0.
+
+        # Add chains to existing bundles, as in ZipTie._grow_bundles
+        nonbundle_transpose = nonbundle_activities.transpose(0, 2, 1)
+        coactivities = bundle_activities * nonbundle_transpose
+        proportions_by_bundle = (bundle_activities /
+                                 np.sum(bundle_activities + tools.EPSILON,
+                                        axis=(1, 2), keepdims=True))
+        proportions_by_chain = proportions_by_bundle * nonbundle_transpose
+        ziptie.update_agglomeration_energy(
+                agglomeration_energy, proportions_by_chain, 
+                chain_activities.transpose(0, 2, 1), coactivities, 
+                ziptie.AGGLOMERATION_ENERGY_RATE)
+        # For any bundles that are already full, don't change their coactivity
+        chains_per_bundle = tools.popcount(self.bundle_masks[cogs])
+        full_bundles = chains_per_bundle >= self.max_chains_per_bundle
+        agglomeration_energy *= 1. - full_bundles[:,:,np.newaxis]
+        candidates = agglomeration_energy >= ziptie.JOINING_THRESHOLD
+        for cog_index in np.nonzero(np.any(candidates.reshape(
+                cogs.size, -1), axis=1))[0]:
+            (candidate_bundles, candidate_chains) = np.nonzero(
+                    candidates[cog_index])
+            candidate_index = self._random(cogs[cog_index]).randint(
+                    candidate_chains.size)
+            candidate_chain = candidate_chains[candidate_index]
+            candidate_bundle = candidate_bundles[candidate_index]
+            tools.set_bit(self.bundle_masks[cogs[cog_index], 
+                                            candidate_bundle], 
+                          candidate_chain)
+            nucleation_energy[cog_index, candidate_chain, 0] = 0.
+            agglomeration_energy[cog_index, :, candidate_chain] = 0.
+            self.instruments.count(self.name + '.chains_added')
+            print ''.join(('cog', str(cogs[cog_index]))), 'chain', \
+                    candidate_chain, 'added to bundle', candidate_bundle
+
+        self.agglomeration_energy[cogs] = agglomeration_energy
+        self.nucleation_energy[cogs] = nucleation_energy
+        self.num_bundles[cogs] = num_bundles
+        self.bundle_activities[cogs] = bundle_activities
+        return bundle_activities
+
+    def step_down(self, bundle_activity_goals):
+        """
+        bundle_activity_goals percolate downward through all the cogs
+
+        bundle_activity_goals is a (num_cogs x max_bundles x 1) array.
+        Returns a (num_cogs x max_cables x 1) array of cable activity
+        goals, which are zero beyond each cog's num_cables.
+        """
+        cable_activity_goals = np.zeros((self.num_cogs, self.max_cables, 1),
+                                        dtype=self.dtype)
+        for (first_cog, last_cog) in self._groups:
+            group_size = last_cog - first_cog
+            # Project the bundle goals onto their chains,
+            # as in ZipTie.get_cable_deliberation_vote
+            bundle_goals_by_chain = tools.unpack_bits(
+                    self.bundle_masks[first_cog:last_cog], self.max_chains, 
+                    out=self._bundle_goals_by_chain[:group_size])
+            bundle_goals_by_chain *= bundle_activity_goals[first_cog:last_cog]
+            mapped_goals = tools.map_one_to_inf(
+                    bundle_goals_by_chain, 
+                    out=self._mapped_bundle_goals[:group_size])
+            chain_activity_goals = tools.map_inf_to_one(
+                    np.sum(mapped_goals, axis=1)[:,:,np.newaxis])
+            start_time = self.instruments.start()
+            if self.sparse:
+                deliberate = self._deliberate_sparse
+            else:
+                deliberate = self._deliberate
+            cable_activity_goals[first_cog:last_cog] = deliberate(
+                    first_cog, last_cog, chain_activity_goals)
+            self.instruments.stop(self.name + '.deliberate', start_time)
+        return cable_activity_goals
+
+    def _deliberate(self, first_cog, last_cog, goal_value_by_chain):
+        """ 
+        Choose goals for a group of cogs deliberatively
+
+        The group is the cogs from first_cog up to, but not including,
+        last_cog.
+        """
+        group = slice(first_cog, last_cog)
+        group_size = last_cog - first_cog
+        cogs = np.arange(first_cog, last_cog)
+        reward = self.current_reward[self.cog_agents[group]][
+                :,np.newaxis,np.newaxis]
+        post = self.post[group]
+        num_cables = self.num_cables[group]
+        reward_uncertainty = self.reward_uncertainty[group]
+        deliberation_vote = self.deliberation_vote[group]
+        # Maintain the internal deliberation_vote set
+        deliberation_vote_fulfillment = 1 - post
+        deliberation_vote_decay = 1 - self.VOTE_DECAY_RATE
+        deliberation_vote *= (deliberation_vote_fulfillment *
+                              deliberation_vote_decay)
+        # The similarity of each chain to the current state, post
+        # repeated across each row, is broadcast rather than built.
+        # Cables that a cog hasn't been assigned yet get no goals
+        unused_cables = (np.arange(self.max_cables)[np.newaxis,:,np.newaxis] >=
+                         num_cables[:,np.newaxis,np.newaxis])
+        reward_noise = self._reward_noise[:group_size]
+        reward_noise[...] = self._random_sample(cogs, 
+                                                reward_uncertainty.shape[1:])
+        reward_noise *= 2
+        reward_noise -= 1
+        reward_noise *= reward_uncertainty
+        estimated_reward_value = np.subtract(
+                self.reward_value[group], reward, 
+                out=self._estimated_reward_value[:group_size])
+        estimated_reward_value += reward_noise
+        np.maximum(estimated_reward_value, 0, out=estimated_reward_value)
+        np.minimum(estimated_reward_value, 1, out=estimated_reward_value)
+        reward_weights = np.add(reward_uncertainty, tools.EPSILON,
+                                out=self._reward_weights[:group_size])
+        np.divide(post, reward_weights, out=reward_weights)
+        reward_value_by_cable = tools.weighted_average(
+                estimated_reward_value, reward_weights)
+        reward_value_by_cable[unused_cables] = 0.
+        # Reshape goal_value_by_chain back into a square array for each cog
+        goal_value_by_chain = np.reshape(
+                goal_value_by_chain,
+                (group_size, self.max_cables, self.max_cables))
+        # Bounded sum of the deliberation_vote values from above
+        # over all chains
+        weighted_goals = np.multiply(goal_value_by_chain.transpose(0, 2, 1),
+                                     post, out=reward_noise)
+        mapped_goals = tools.map_one_to_inf(
+                weighted_goals, out=estimated_reward_value)
+        goal_value_by_cable = tools.map_inf_to_one(
+                np.sum(mapped_goals, axis=1)[:,:,np.newaxis])
+        # Only the rows of active cables contribute to count_by_cable
+        (active_cogs, rows) = np.nonzero(post[:,:,0])
+        self._age_rows(active_cogs + first_cog, rows)
+        count_by_cable = tools.weighted_average(self.count[group], post)
+        if self.compact:
+            count_by_cable *= self.COUNT_RESOLUTION
+        exploration_vote = ((1 - reward) /
+                (num_cables[:,np.newaxis,np.newaxis].astype(self.dtype) *
+                 (count_by_cable + 1) *
+                 self._random_sample(cogs, count_by_cable.shape[1:]).astype(
+                 self.dtype) + tools.EPSILON))
+        exploration_vote = np.minimum(exploration_vote, 1.)
+        exploration_vote[unused_cables] = 0.
+        cable_goals = tools.bounded_sum([reward_value_by_cable,
+                                         goal_value_by_cable,
+                                         exploration_vote])
+        np.maximum(cable_goals, deliberation_vote, out=deliberation_vote)
+        cable_goals[unused_cables] = 0.
+        return cable_goals
+
+    def _deliberate_sparse(self, first_cog, last_cog, goal_value_by_chain):
+        """ 
+        Choose goals for a group of cogs with sparse daisychains
+
+        The group is the cogs from first_cog up to, but not including,
+        last_cog. Pairs without a slot are taken to have no reward 
+        value, the initial uncertainty, and no count.
+        """
+        group = slice(first_cog, last_cog)
+        group_size = last_cog - first_cog
+        cogs = np.arange(first_cog, last_cog)
+        reward = self.current_reward[self.cog_agents[group]][
+                :,np.newaxis,np.newaxis]
+        post = self.post[group]
+        num_cables = self.num_cables[group]
+        reward_uncertainty = self.reward_uncertainty[group]
+        deliberation_vote = self.deliberation_vote[group]
+        # Maintain the internal deliberation_vote set
+        deliberation_vote_fulfillment = 1 - post
+        deliberation_vote_decay = 1 - self.VOTE_DECAY_RATE
+        deliberation_vote *= (deliberation_vote_fulfillment *
+                              deliberation_vote_decay)
+        unused_cables = (np.arange(self.max_cables)[np.newaxis,:,np.newaxis] >=
+                         num_cables[:,np.newaxis,np.newaxis])
+        successors = self.successors[group]
+        group_cogs = np.arange(group_size)[:,np.newaxis,np.newaxis]
+        slot_post = post[group_cogs, successors, 0] * (successors >= 0)
+        reward_noise = self._reward_noise[:group_size]
+        reward_noise[...] = self._random_sample(cogs, 
+                                                reward_uncertainty.shape[1:])
+        reward_noise *= 2
+        reward_noise -= 1
+        reward_noise *= reward_uncertainty
+        estimated_reward_value = np.subtract(
+                self.reward_value[group], reward, 
+                out=self._estimated_reward_value[:group_size])
+        estimated_reward_value += reward_noise
+        np.maximum(estimated_reward_value, 0, out=estimated_reward_value)
+        np.minimum(estimated_reward_value, 1, out=estimated_reward_value)
+        reward_weights = np.add(reward_uncertainty, tools.EPSILON,
+                                out=self._reward_weights[:group_size])
+        np.divide(post, reward_weights, out=reward_weights)
+        (active_cogs, active_rows) = np.nonzero(post[:,:,0])
+        unstored_weights = self._unstored_weights(
+                active_cogs, successors[active_cogs, active_rows], 
+                post[active_cogs, active_rows], group_size) / (
+                self.INITIAL_UNCERTAINTY + tools.EPSILON)
+        unstored_value = np.clip(-reward[:,:,0], 0, 1)
+        estimated_reward_value *= reward_weights
+        reward_value_by_cable = ((self._sum_by_cable(
+                group_cogs, successors, estimated_reward_value, group_size) +
+                unstored_weights * unstored_value) /
+                (self._sum_by_cable(
+                 group_cogs, successors, reward_weights, group_size) +
+                 unstored_weights + tools.EPSILON))
+        reward_value_by_cable = reward_value_by_cable[:,:,np.newaxis].astype(
+                self.dtype)
+        reward_value_by_cable[unused_cables] = 0.
+        # Bounded sum of the goals of each pre cable's chains,
+        # weighted by the activity of their post cables
+        goal_value_by_chain = np.reshape(goal_value_by_chain, successors.shape)
+        weighted_goals = np.multiply(goal_value_by_chain, slot_post, 
+                                     out=reward_noise)
+        mapped_goals = tools.map_one_to_inf(
+                weighted_goals, out=estimated_reward_value)
+        goal_value_by_cable = tools.map_inf_to_one(
+                np.sum(mapped_goals, axis=2)[:,:,np.newaxis])
+        # Only the rows of active cables contribute to count_by_cable
+        self._age_rows(active_cogs + first_cog, active_rows)
+        count = self.count[group]
+        if self.compact:
+            count = tools.from_fixed_point(count, self.COUNT_RESOLUTION,
+                                           dtype=self.dtype)
+        sum_of_post = np.sum(post[:,:,0], axis=1)
+        count_by_cable = (self._sum_by_cable(
+                group_cogs, successors, count * post, group_size) /
+                (sum_of_post[:,np.newaxis] + tools.EPSILON))[:,:,np.newaxis]
+        exploration_vote = ((1 - reward) /
+                (num_cables[:,np.newaxis,np.newaxis].astype(self.dtype) *
+                 (count_by_cable + 1) *
+                 self._random_sample(cogs, count_by_cable.shape[1:]).astype(
+                 self.dtype) + tools.EPSILON))
+        exploration_vote = np.minimum(exploration_vote, 1.)
+        exploration_vote[unused_cables] = 0.
+        cable_goals = tools.bounded_sum([reward_value_by_cable,
+                                         goal_value_by_cable,
+                                         exploration_vote])
+        np.maximum(cable_goals, deliberation_vote, out=deliberation_vote)
+        cable_goals[unused_cables] = 0.
+        return cable_goals
+
+    def get_projection(self, cog_index, bundle_index):
+        """ Project a bundle down through a cog's ziptie and daisychain """
+        chains = np.reshape(tools.unpack_bits(
+                self.bundle_masks[cog_index, bundle_index], self.max_chains),
+                (self.max_cables, self.max_successors))
+        projection = np.zeros((self.max_cables, 2))
+        if self.sparse:
+            # Only the chains in occupied slots project
+            successors = self.successors[cog_index]
+            chains = np.logical_and(chains, successors >= 0)
+            projection[:,0] = np.any(chains, axis=1)
+            projection[successors[chains], 1] = 1.
+            return projection
+        projection[:,0] = np.any(chains, axis=1)
+        projection[:,1] = np.any(chains, axis=0)
+        return projection
+
+    @property
+    def bundle_map(self):
+        """ The dense (num_cogs x max_bundles x max_chains) membership map """
+        return tools.unpack_bits(self.bundle_masks, self.max_chains)
+
+    def bundles_created(self, agent=0):
+        """ How many bundles have been created in one agent's cogs? """
+        return np.sum(self.num_bundles[self.cog_slice(agent)])
@@ -0,0 +1,175 @@
+import json
+import math
+import timeit
+
+import numpy as np
+
+# The most precise wall clock timer on this platform
+timer = timeit.default_timer
+
+class LatencyHistogram(object):
+    """
+    A fixed size histogram of durations
+
+    The bins are spaced evenly in the logarithm of the duration,
+    BINS_PER_DECADE to a factor of ten, from MIN_DURATION to
+    MAX_DURATION seconds. Durations outside of that range land
+    in the first or last bin. The count, total, minimum and maximum
+    are kept exactly. Percentiles are read from the bins, so they are
+    good to within the width of a bin, about 12 percent.
+    """
+    BINS_PER_DECADE = 20
+    MIN_DURATION = 1e-7
+    MAX_DURATION = 1e2
+
+    def __init__(self):
+        self.log_min_duration = math.log10(self.MIN_DURATION)
+        self.num_bins = int(self.BINS_PER_DECADE * (
+                math.log10(self.MAX_DURATION) - self.log_min_duration))
+        self.counts = [0] * self.num_bins
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+
+    def add(self, duration):
+        """ Record one duration, in seconds """
+        self.count += 1
+        self.total += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        if duration > 0.:
+            bin_index = int((math.log10(duration) - self.log_min_duration) *
+                            self.BINS_PER_DECADE)
+            bin_index = min(max(bin_index, 0), self.num_bins - 1)
+        else:
+            bin_index = 0
+        self.counts[bin_index] += 1
+
+    def percentile(self, percent):
+        """
+        Estimate the duration that percent of the durations fall below
+
+        This is the upper edge of the bin that holds it, kept
+        within the smallest and largest durations seen.
+        """
+        if self.count == 0:
+            return 0.
+        rank = percent / 100. * self.count
+        cumulative_counts = np.cumsum(self.counts)
+        bin_index = int(np.searchsorted(cumulative_counts, rank))
+        upper_edge = 10 ** (self.log_min_duration +
+                            float(bin_index + 1) / self.BINS_PER_DECADE)
+        return min(max(upper_edge, self.min), self.max)
+
+    def summary(self):
+        """ Summarize the durations, in milliseconds """
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count,
+                'total_ms': self.total * 1e3,
+                'mean_ms': self.total / self.count * 1e3,
+                'min_ms': self.min * 1e3,
+                'p50_ms': self.percentile(50) * 1e3,
+                'p99_ms': self.percentile(99) * 1e3,
+                'max_ms': self.max * 1e3}
+
+class Instruments(object):
+    """
+    Timers, counters and latency histograms for an agent's hot paths
+
+    The agent and its blocks, zipties and gearboxes share one
+    set of instruments. Each timed section is bracketed by
+        start_time = instruments.start()
+        ...
+        instruments.stop('name', start_time)
+    which adds its duration to the latency histogram for that name.
+    Counters are bumped with count('name').
+
+    While enabled is False, start() returns None and stop() and
+    count() return right away, so that the instruments cost a few
+    method calls per section, well under a microsecond.
+
+    If the timestep is one of trace_steps, every section timed during
+    it is also kept as an event, to be written out by write_trace()
+    as a Chrome trace (chrome://tracing, or ui.perfetto.dev).
+    """
+    def __init__(self, enabled=False, trace_steps=None):
+        self.enabled = enabled
+        if trace_steps is None:
+            trace_steps = []
+        self.trace_steps = set(trace_steps)
+        # The agent keeps this up to date, so that trace events
+        # can be labeled with the step they happened in
+        self.timestep = 0
+        self.reset()
+
+    def reset(self):
+        """ Throw away everything that has been recorded """
+        self.histograms = {}
+        self.counters = {}
+        self.trace_events = []
+
+    def start(self):
+        """ Start timing a section. Returns the time it started. """
+        if not self.enabled:
+            return None
+        return timer()
+
+    def stop(self, name, start_time):
+        """ Finish timing the section called name """
+        if start_time is None:
+            return
+        duration = timer() - start_time
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            self.histograms[name] = histogram
+        histogram.add(duration)
+        if self.timestep in self.trace_steps:
+            self.trace_events.append((name, self.timestep,
+                                      start_time, duration))
+
+    def count(self, name, amount=1):
+        """ Add amount to the counter called name """
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        """
+        Summarize everything that has been recorded
+
+        Returns a dict with a 'timers' dict, holding a summary of
+        each latency histogram in milliseconds, and a 'counters' dict.
+        """
+        return {'timers': dict([(name, histogram.summary()) for
+                                (name, histogram) in self.histograms.items()]),
+                'counters': dict(self.counters)}
+
+    def write_trace(self, filename):
+        """
+        Write the trace events out in the Chrome trace event format
+
+        Each section is a complete ('X') event, with times in
+        microseconds from the first of them.
+        """
+        if self.trace_events:
+            first_time = min([event[2] for event in self.trace_events])
+        else:
+            first_time = 0.
+        events = []
+        for (name, timestep, start_time, duration) in self.trace_events:
+            events.append({'name': name,
+                           'cat': name.split('.')[0],
+                           'ph': 'X',
+                           'ts': (start_time - first_time) * 1e6,
+                           'dur': duration * 1e6,
+                           'pid': 0,
+                           'tid': 0,
+                           'args': {'timestep': timestep}})
+        with open(filename, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      trace_file)
@@ -1,5 +1,3 @@
-import matplotlib.patches as mpatches
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import sys
@@ -10,7 +8,10 @@ Constants and functions for used across the BECCA core
 # Shared constants
 EPSILON = sys.float_info.epsilon
 BIG = 10 ** 20
+MAX_STEPWISE_AGING = 32
 MAX_INT16 = np.iinfo(np.int16).max
+MAX_UINT16 = np.iinfo(np.uint16).max
+BITS_PER_WORD = 64
 
 DARK_GREY = (0.2, 0.2, 0.2)
 LIGHT_GREY = (0.9, 0.9, 0.9)
@@ -23,73 +24,308 @@ DARK_COPPER = (132./255., 73./255., 36./255.)
 COPPER_SHADOW = (25./255., 22./255, 20./255.)
 OXIDE = (20./255., 120./255., 150./255.)
 
-def weighted_average(values, weights):
-    """ Perform a weighted average of values, using weights """
-    #print 'wav', values.shape
-    #print 'waw', weights.shape
-    weighted_sum_values = np.sum(values * weights, axis=0) 
-    #print 'wawsv', weighted_sum_values.shape
-    sum_of_weights = np.sum(weights, axis=0) 
-    #print 'wasow', sum_of_weights.shape
-    #print 'war',  (weighted_sum_values / (sum_of_weights + EPSILON))[:,np.newaxis].shape
-    return (weighted_sum_values / (sum_of_weights + EPSILON))[:,np.newaxis]
-
-def generalized_mean(values, weights, exponent):
-    #print 'v', values.ravel()
-    shifted_values = values + 1.
-    #print 'sv', shifted_values.ravel()
-    values_to_power = shifted_values ** exponent
-    #print 'vp', values_to_power.ravel()
-    #print 'vp', values_to_power.shape
-    #print 'w', weights.shape
-    mean_values_to_power = weighted_average(values_to_power, weights)
-    #print 'mvp', mean_values_to_power.ravel()
-    #print 'mvp', mean_values_to_power.shape
-    shifted_mean = (mean_values_to_power + EPSILON) ** (1./exponent)
-    #print 'sm', shifted_mean.ravel()
-    mean = shifted_mean - 1.
-    #print 'm', mean.ravel()
+def epsilon(dtype):
+    """ 
+    The smallest difference from 1 that dtype can represent
+
+    This is EPSILON for float64. Where 1 + EPSILON has to be 
+    distinguishable from 1, use this instead so that it also
+    holds for other precisions.
+    """
+    return float(np.finfo(dtype).eps)
+
+def random_source(random_state):
+    """ 
+    Where to draw random numbers from
+
+    This is random_state, a np.random.RandomState, or if it is None, 
+    the np.random module's global one.
+    """
+    if random_state is None:
+        return np.random
+    return random_state
+
+def float_type(a):
+    """ The floating point type that a's results should have """
+    dtype = np.asarray(a).dtype
+    if np.issubdtype(dtype, np.floating):
+        return dtype
+    return np.dtype(float)
+
+def weighted_average(values, weights, out=None):
+    """ 
+    Perform a weighted average of values, using weights 
+
+    The average is taken down the columns. Any leading axes are 
+    treated as a stack of independent arrays, so that the 
+    averages of all of a block's cogs can be found at once.
+    If out is given, the result is written into it.
+    """
+    weighted_sum_values = _weighted_sum(values, weights)
+    sum_of_weights = np.sum(weights, axis=-2) 
+    sum_of_weights += EPSILON
+    if out is None:
+        out = np.empty(weighted_sum_values.shape + (1,), 
+                       dtype=weighted_sum_values.dtype)
+    np.divide(weighted_sum_values, sum_of_weights, out=out[...,0])
+    return out
+
+def _weighted_sum(values, weights):
+    """ 
+    Sum the products of values and weights down the columns 
+
+    When either one is a single column, as it often is, this is a 
+    matrix product. When they are the same shape it is an einsum.
+    Neither needs a temporary array of products.
+    """
+    if weights.shape[-1] == 1 and values.shape[-1] != 1:
+        return np.matmul(np.swapaxes(values, -1, -2), weights)[...,0]
+    if values.shape[-1] == 1 and weights.shape[-1] != 1:
+        return np.matmul(np.swapaxes(weights, -1, -2), values)[...,0]
+    if values.shape == weights.shape:
+        return np.einsum('...ij,...ij->...j', values, weights)
+    return np.sum(values * weights, axis=-2) 
+
+def _power(a, exponent, out=None):
+    """ 
+    Raise a to exponent, avoiding the general power function 
+
+    Small integer exponents are built from multiplications,
+    and roots of order 2 and 4 from square roots. Negative 
+    exponents take a reciprocal at the end. Anything else falls
+    back to np.power.
+    """
+    magnitude = abs(exponent)
+    if out is None:
+        out = np.empty(np.shape(a), dtype=float_type(a))
+    if magnitude == 1.:
+        out[...] = a
+    elif magnitude == 2.:
+        np.multiply(a, a, out=out)
+    elif magnitude == 4.:
+        np.multiply(a, a, out=out)
+        np.multiply(out, out, out=out)
+    elif magnitude == .5:
+        np.sqrt(a, out=out)
+    elif magnitude == .25:
+        np.sqrt(a, out=out)
+        np.sqrt(out, out=out)
+    else:
+        return np.power(a, exponent, out=out)
+    if exponent < 0:
+        np.reciprocal(out, out=out)
+    return out
+
+def generalized_mean(values, weights, exponent, out=None):
+    """
+    Find the weighted generalized mean of values down the columns
+
+    values are shifted up by one before being raised to exponent,
+    and shifted back afterward, which keeps zero-valued signals 
+    well behaved for negative exponents. Means for which all the 
+    weights are zero are undefined, and are returned as zero.
+    If out is given, the result is written into it.
+    """
+    values_to_power = values + 1.
+    _power(values_to_power, exponent, out=values_to_power)
+    sum_weights = np.sum(weights, axis=-2)
+    mean = _weighted_sum(values_to_power, weights)
+    mean /= sum_weights + EPSILON
+    mean += EPSILON
+    _power(mean, 1. / exponent, out=mean)
+    mean -= 1.
     # Find means for which all weights are zero. These are undefined.
     # Set them equal to zero.
-    sum_weights = np.sum(weights, axis=0)
-    #print 'sw', sum_weights.ravel()
-    #print 'sw', sum_weights.shape
-    zero_indices = np.where(np.abs(sum_weights) < EPSILON)
-    #print 'zi', zero_indices
-    mean[zero_indices] = 0.
-    #print 'mz', mean
-    #print 'mz', mean.shape
-    return mean
-
-def map_one_to_inf(a):
+    mean[np.abs(sum_weights) < EPSILON] = 0.
+    if out is None:
+        return mean[...,np.newaxis]
+    out[...,0] = mean
+    return out
+
+def map_one_to_inf(a, out=None):
     """ ZipTie values from [0, 1] onto [0, inf) and map values 
-    from [-1, 0] onto (-inf, 0] """
-    eps = np.finfo(np.double).eps
-    a_prime = np.sign(a) / (1 - np.abs(a) + eps) - np.sign(a)
-    return a_prime
+    from [-1, 0] onto (-inf, 0] 
+
+    This is sign(a) / (1 - |a| + eps) - sign(a), evaluated in that 
+    order. Regrouping it changes the last bit of the result, and 
+    downstream weights of the form 1 / (uncertainty + EPSILON) 
+    amplify that until whole runs diverge. out can't be a.
+    """
+    if out is None:
+        out = np.empty(np.shape(a), dtype=float_type(a))
+    np.abs(a, out=out)
+    np.subtract(1., out, out=out)
+    out += epsilon(out.dtype)
+    np.reciprocal(out, out=out)
+    out -= 1.
+    out *= np.sign(a)
+    return out
 
-def map_inf_to_one(a_prime):
+def map_inf_to_one(a_prime, out=None):
     """ ZipTie values from [0, inf) onto [0, 1] and map values 
-    from  (-inf, 0] onto [-1, 0] """
-    a = np.sign(a_prime) * (1 - 1 / (np.abs(a_prime) + 1))
-    return a
+    from  (-inf, 0] onto [-1, 0] 
+
+    This is sign(a) * (1 - 1 / (|a| + 1)), evaluated in that order
+    for the same reason as in map_one_to_inf.
+    """
+    denominator = np.abs(a_prime)
+    denominator += 1.
+    np.reciprocal(denominator, out=denominator)
+    np.subtract(1., denominator, out=denominator)
+    if out is None:
+        out = denominator
+    np.multiply(np.sign(a_prime), denominator, out=out)
+    return out
 
-def bounded_sum(a, axis=0):
+def bounded_sum(a, axis=0, out=None):
     """ 
     Sum elements nonlinearly, such that the total is less than 1 
     
     To be more precise, as long as all elements in a are between -1
     and 1, their sum will also be between -1 and 1. a can be a 
-    list or a numpy array. 
+    list or a numpy array. If out is given, the result 
+    is written into it.
     """ 
     if type(a) is list:
         total = map_one_to_inf(a[0])
+        mapped_item = np.empty(total.shape, dtype=total.dtype)
         for item in a[1:]:
-            total += map_one_to_inf(item)
-        return map_inf_to_one(total)
+            if np.shape(item) == total.shape:
+                total += map_one_to_inf(item, out=mapped_item)
+            else:
+                total += map_one_to_inf(item)
+        return map_inf_to_one(total, out=out)
+    else:
+        total = np.sum(map_one_to_inf(a), axis=axis)[...,np.newaxis]
+        return map_inf_to_one(total, out=out)
+
+def age_count(count, steps, time_constant):
+    """ 
+    Age counts that have gone unused for a number of time steps 
+
+    Each time step, a count ages by 
+        count -= 1 / (time_constant * count)
+    and is kept from going below zero. Up to 32 steps are taken one 
+    at a time. Longer stretches are taken all at once, using a closed 
+    form, until the count is within a few steps of reaching zero. 
+    steps can be an array that broadcasts against count.
+    """
+    count, steps = np.broadcast_arrays(count, steps)
+    aged = np.array(count, dtype=float_type(count))
+    # Roughly the number of steps until each count reaches zero 
+    steps_left = time_constant * aged ** 2 / 2.
+    closed_form_steps = np.where(
+            steps > MAX_STEPWISE_AGING, 
+            np.clip(np.floor(steps_left - MAX_STEPWISE_AGING / 2), 0, steps), 
+            0)
+    closed_form = closed_form_steps > 0
+    if np.any(closed_form):
+        # Solve for the final steps_left with a couple of Newton steps
+        initial_steps_left = steps_left[closed_form]
+        target = (_aging_clock(initial_steps_left) - 
+                  closed_form_steps[closed_form])
+        final_steps_left = (initial_steps_left - 
+                            closed_form_steps[closed_form])
+        for iteration in range(2):
+            final_steps_left -= ((_aging_clock(final_steps_left) - target) /
+                                 (1. + 1. / (4. * final_steps_left) - 
+                                  1. / (16. * final_steps_left ** 2)))
+        aged[closed_form] = np.sqrt(2. * final_steps_left / time_constant)
+    stepwise_steps = np.minimum(steps - closed_form_steps, MAX_STEPWISE_AGING)
+    max_stepwise_steps = 0
+    if stepwise_steps.size > 0:
+        max_stepwise_steps = int(np.max(stepwise_steps))
+    for step in range(max_stepwise_steps):
+        stepping = stepwise_steps > step
+        stepping_count = aged[stepping]
+        aged[stepping] = np.maximum(stepping_count - 1. / (
+                time_constant * stepping_count + EPSILON), 0.)
+    return aged
+
+def to_fixed_point(a, resolution, stochastic=False, random_sample=None):
+    """ 
+    Store non-negative values as saturating 16 bit fixed point numbers
+
+    Each integer step is worth resolution. Values are rounded to 
+    the nearest step. Those too large to represent are held at 
+    MAX_UINT16 steps, rather than wrapping around.
+    If stochastic is True, values are instead rounded up with a 
+    probability equal to their fraction of a step, and down otherwise.
+    Then changes smaller than a step, which would always be rounded 
+    away, are kept on average. The random numbers that this takes 
+    are drawn by random_sample(shape), which defaults to 
+    np.random.random_sample.
+    """
+    steps = np.multiply(a, 1. / resolution)
+    if stochastic:
+        if random_sample is None:
+            random_sample = np.random.random_sample
+        steps += random_sample(steps.shape)
+        np.floor(steps, out=steps)
     else:
-        bounded_total = map_inf_to_one(np.sum(map_one_to_inf(a), axis=axis))
-        return bounded_total[:,np.newaxis]
+        np.rint(steps, out=steps)
+    np.clip(steps, 0, MAX_UINT16, out=steps)
+    return steps.astype(np.uint16)
+
+def from_fixed_point(a, resolution, dtype=float, out=None):
+    """ 
+    Convert fixed point numbers back into floating point ones 
+
+    If out is given, the result is written into it and dtype is ignored.
+    """
+    if out is None:
+        out = np.empty(a.shape, dtype=dtype)
+    return np.multiply(a, resolution, out=out)
+
+def num_words(num_bits):
+    """ How many 64 bit words it takes to hold num_bits bits """
+    return int(np.ceil(float(num_bits) / BITS_PER_WORD))
+
+def set_bit(words, bit):
+    """ Set one bit in a one dimensional array of uint64 words, in place """
+    words[bit // BITS_PER_WORD] |= np.uint64(1) << np.uint64(
+            bit % BITS_PER_WORD)
+    return words
+
+def unpack_bits(words, num_bits, dtype=bool, out=None):
+    """ 
+    Expand uint64 bitsets along the last axis into arrays of 0s and 1s 
+
+    Bit i of word j becomes element j * 64 + i. Elements past 
+    num_bits are dropped. If out is given, the result is written 
+    into it and dtype is ignored.
+    """
+    # Unpack each byte, least significant bit first
+    word_bytes = np.ascontiguousarray(words, dtype='<u8').view(np.uint8)
+    bits = np.unpackbits(word_bytes[...,np.newaxis], axis=-1)[...,::-1]
+    bits = bits.reshape(words.shape[:-1] + 
+                        (words.shape[-1] * BITS_PER_WORD,))[...,:num_bits]
+    if out is None:
+        return bits.astype(dtype)
+    out[...] = bits
+    return out
+
+def popcount(words):
+    """ Count the bits that are set in uint64 bitsets along the last axis """
+    # Sum neighboring bits, then pairs, then nibbles, 
+    # then add up all eight bytes at once with a multiply.
+    bits = words.astype(np.uint64)
+    bits -= np.right_shift(bits, np.uint64(1)) & np.uint64(0x5555555555555555)
+    bits = ((bits & np.uint64(0x3333333333333333)) + 
+            (np.right_shift(bits, np.uint64(2)) & 
+             np.uint64(0x3333333333333333)))
+    bits += np.right_shift(bits, np.uint64(4)) 
+    bits &= np.uint64(0x0f0f0f0f0f0f0f0f)
+    bits *= np.uint64(0x0101010101010101)
+    return np.sum(np.right_shift(bits, np.uint64(56)), axis=-1).astype(np.int)
+
+def _aging_clock(steps_left):
+    """ 
+    A function of steps_left that drops by very nearly 1 each step 
+    
+    Each step of aging, steps_left drops by 1 - 1 / (4 * steps_left).
+    """
+    return steps_left + np.log(steps_left) / 4. + 1. / (16. * steps_left)
 
 def pad(a, shape, val=0.):
     """
@@ -116,7 +352,7 @@ def pad(a, shape, val=0.):
         if cols < a.shape[1]:
             print ' '.join(['a.shape[1] is', str(a.shape[1]), ' but trying to',
                             ' pad to ', str(cols), 'cols.'])
-    padded = np.ones((rows,cols)) * val
+    padded = np.ones((rows,cols), dtype=float_type(a)) * val
     padded[:a.shape[0], :a.shape[1]] = a
 
     return padded
@@ -131,6 +367,8 @@ def str_to_int(exp):
 def visualize_array(image_data, shape=None, save_eps=False, 
                     label='data_figure', epsfilename=None):
     """ Produce a visual representation of the image_data matrix """    
+    # Imported here, so that agents that never plot never load it
+    import matplotlib.pyplot as plt
     if shape is None:
         shape = image_data.shape
     if epsfilename is None:
@@ -171,6 +409,8 @@ def report_roc(ground_truth_filename, surprise_log_filename, self_name):
     identified as targets divided by the total number of 
     non-target data points).
     """
+    import matplotlib.patches as mpatches
+    import matplotlib.pyplot as plt
     truth = np.loadtxt(ground_truth_filename)
     surprise = np.loadtxt(surprise_log_filename)
     # debug
@@ -1,7 +1,68 @@
 import numpy as np
 
+from instruments import Instruments
 import tools
 
+# Constants shared by every ziptie, including those of the cogs, 
+# which the Gearbox steps without ZipTie objects
+# The rates at which agglomeration and nucleation energy build up
+# real, 0 < x < 1, small
+AGGLOMERATION_ENERGY_RATE = 10 ** -2
+NUCLEATION_ENERGY_RATE = 10 ** -4
+ENERGY_DECAY_RATE = 10 ** -2
+# Coactivity value which, if it's ever exceeded, causes a 
+# cable to be added to a bundle
+# real, 0 < x < 1, small
+JOINING_THRESHOLD = 0.05
+# Exponent for calculating the generalized mean of signals in 
+# order to find bundle activities
+# real, x != 0
+MEAN_EXPONENT = -4
+# Exponent controlling the strength of inhibition between bundles
+ACTIVATION_WEIGHTING_EXPONENT = 6.
+
+def inhibit(activated_bundle_map, max_activation, cable_activities):
+    """ 
+    Find the effective strength of each cable to each bundle 
+    
+    Each cable's energy is divided between the bundles it contributes
+    to, in favor of the most active of them. activated_bundle_map
+    holds the activity of the bundles each cable contributes to, 
+    max_activation the largest of them, and cable_activities the
+    cables' own activities, all broadcast against each other.
+    """
+    input_inhibition_map = np.power(activated_bundle_map / max_activation,
+                                    ACTIVATION_WEIGHTING_EXPONENT)
+    return input_inhibition_map * cable_activities
+
+def update_nucleation_energy(nucleation_energy, cable_activities, 
+                             nonbundle_activities, rate):
+    """ 
+    Decay and build up the energy of cables toward starting a bundle 
+
+    nucleation_energy is updated in place. rate is the
+    NUCLEATION_ENERGY_RATE, scaled as needed.
+    """
+    nucleation_energy -= (cable_activities * nucleation_energy * 
+                          rate * ENERGY_DECAY_RATE)
+    nucleation_energy += (nonbundle_activities * (1. - nucleation_energy) *
+                          rate)
+
+def update_agglomeration_energy(agglomeration_energy, proportions, 
+                                cable_activities, coactivities, rate):
+    """ 
+    Decay and build up the energy of cables toward joining bundles
+
+    Each cable's nonbundle activity is distributed to the bundles 
+    in proportions. agglomeration_energy is updated in place. 
+    rate is the AGGLOMERATION_ENERGY_RATE, scaled as needed.
+    """
+    agglomeration_energy -= (proportions * cable_activities * 
+                             agglomeration_energy * 
+                             rate * ENERGY_DECAY_RATE)
+    agglomeration_energy += (proportions * coactivities * 
+                             (1. - agglomeration_energy) * rate)
+
 class ZipTie(object):
     """ 
     An incremental unsupervised learning algorithm
@@ -14,13 +75,36 @@ class ZipTie(object):
     into several different bundles. Co-activity is estimated 
     incrementally, that is, the algorithm updates the estimate after 
     each new set of signals is received. 
+
+    Each bundle holds at most max_cables_per_bundle cables, so
+    membership is stored sparsely: bundle_cables lists the cables in 
+    each bundle, in ascending order and padded with -1, and 
+    cables_per_bundle counts them. The dense bundle_map is 
+    available for display, but is built only when asked for.
     """
     def __init__(self, max_num_cables, max_num_bundles, 
                  max_cables_per_bundle=None,
-                 mean_exponent=-4, joining_threshold=0.05, 
-                 speedup = 1., name='ziptie_'):
-        """ Initialize each map, pre-allocating max_num_bundles """
+                 mean_exponent=MEAN_EXPONENT, 
+                 joining_threshold=JOINING_THRESHOLD, 
+                 speedup = 1., name='ziptie_', dtype=np.float64, 
+                 instruments=None, store=None, random_state=None):
+        """ 
+        Initialize each map, pre-allocating max_num_bundles 
+        
+        All of its activities and energies are kept in the 
+        floating point type dtype. Bundle growth is timed and counted 
+        in instruments, if they are given and enabled.
+        The (max_num_bundles x max_num_cables) maps are the largest 
+        part of it. If an ArrayStore is given, they are kept there.
+        The cables that bundles grow from are picked at random, 
+        using random_state, or np.random if it is None.
+        """
         self.name = name
+        self.random_state = random_state
+        if instruments is None:
+            instruments = Instruments()
+        self.instruments = instruments
+        self.dtype = np.dtype(dtype)
         self.max_num_cables = max_num_cables
         self.max_num_bundles = max_num_bundles
         if max_cables_per_bundle is None:
@@ -33,7 +117,7 @@ class ZipTie(object):
         #
         # real, 0 < x < 1, small
         #self.COACTIVITY_UPDATE_RATE = 10 ** -4 * speedup
-        self.AGGLOMERATION_ENERGY_RATE = 10 ** -2 * speedup
+        self.AGGLOMERATION_ENERGY_RATE = AGGLOMERATION_ENERGY_RATE * speedup
         # The rate at which affinity is updated
         # Affinity is the potentiation of a cable to being included in a
         # bundle. It increases over time when the cable is inactive and
@@ -45,31 +129,68 @@ class ZipTie(object):
         # Constant factor driving the rate at which new bundles are created
         # real, 0 < x < 1, small
         #self.NEW_BUNDLE_FACTOR = 10 ** -5
-        self.NUCLEATION_ENERGY_RATE = 10 ** -4 * speedup
-        self.ENERGY_DECAY_RATE = 10 ** -2
-        # Coactivity value which, if it's every exceeded, causes a 
-        # cable to be added to a bundle
-        # real, 0 < x < 1, small
+        self.NUCLEATION_ENERGY_RATE = NUCLEATION_ENERGY_RATE * speedup
         self.JOINING_THRESHOLD = joining_threshold
         self.NUCLEATION_THRESHOLD = joining_threshold
-        # Exponent for calculating the generalized mean of signals in 
-        # order to find bundle activities
-        # real, x != 0
         self.MEAN_EXPONENT = mean_exponent
-        # Exponent controlling the strength of inhibition between bundles
-        self.ACTIVATION_WEIGHTING_EXPONENT = 6.
 
         self.bundles_full = False        
-        self.bundle_activities = np.zeros((self.max_num_bundles, 1))
+        # Incremented every time a cable is added to the bundle_map, 
+        # so that anything derived from the map knows when to refresh.
+        self.map_version = 0
+        self.bundle_activities = np.zeros((self.max_num_bundles, 1), 
+                                          dtype=self.dtype)
         #self.affinity = np.ones((self.max_num_cables, 1))
         map_size = (self.max_num_bundles, self.max_num_cables)
-        self.bundle_map = np.zeros(map_size)
+        self.bundle_cables = -np.ones((self.max_num_bundles, 
+                                       self.max_cables_per_bundle), 
+                                      dtype=np.int)
+        self.cables_per_bundle = np.zeros(self.max_num_bundles, dtype=np.int)
         #self.bundle_coactivities = np.zeros(map_size)
         #self.cable_coactivities = np.zeros(map_size)
         #self.coactivities = np.zeros(map_size)
-        self.agglomeration_energy = np.zeros(map_size)
+        self.store = store
+        if store is None:
+            self.agglomeration_energy = np.zeros(map_size, dtype=self.dtype)
+            self.agglomeration_candidates = np.zeros(map_size, dtype=bool)
+        else:
+            self.agglomeration_energy = store.zeros(
+                    '/'.join((self.name, 'agglomeration_energy')), 
+                    map_size, self.dtype)
+            self.agglomeration_candidates = store.zeros(
+                    '/'.join((self.name, 'agglomeration_candidates')), 
+                    map_size, bool)
         #self.typical_nonbundle_activities = np.zeros((self.max_num_cables, 1))
-        self.nucleation_energy = np.zeros((self.max_num_cables, 1))
+        self.nucleation_energy = np.zeros((self.max_num_cables, 1), 
+                                          dtype=self.dtype)
+        # Energies only change where there is activity, so the entries 
+        # above threshold are tracked as they change, rather than 
+        # searched for on every time step.
+        self.nucleation_candidates = np.zeros(self.max_num_cables, 
+                                              dtype=bool)
+        self.num_nucleation_candidates = 0
+        self.candidates_per_bundle = np.zeros(self.max_num_bundles, 
+                                              dtype=np.int)
+        self.full_bundles = np.zeros(self.max_num_bundles, dtype=bool)
+
+    def use_store(self, store):
+        """ 
+        Keep the maps in an ArrayStore from now on, copying them in 
+
+        If store is None, they are left where they are.
+        """
+        if store is self.store:
+            return
+        self.store = store
+        if store is None:
+            return
+        for state_name in ['agglomeration_energy', 
+                           'agglomeration_candidates']:
+            state = getattr(self, state_name)
+            array = store.zeros('/'.join((self.name, state_name)), 
+                                state.shape, state.dtype)
+            array[...] = state
+            setattr(self, state_name, array)
 
     def update(self, cable_activities):
         """ Update co-activity estimates and calculate bundle activity """
@@ -79,98 +200,54 @@ class ZipTie(object):
         # At the extreme value of negative infinity, the 
         # generalized mean becomes the minimum operator.
         # Shifting by one helps handle zero-valued cable activities.
-        self.cable_activities = cable_activities
-        # debug
-        #print np.mean(self.cable_activities)
-        # weighted mean 
-        #initial_bundle_activities_gm = tools.generalized_mean(
-        #        self.cable_activities, self.bundle_map.T, 1)
-        initial_bundle_activities = tools.generalized_mean(
-                self.cable_activities, self.bundle_map.T, self.MEAN_EXPONENT)
-        # debug      
-        """ Make a first pass at the bundle activation levels by 
-        multiplying across the bundle map.
-        """
-        #print self.name
-        #print 'ca', self.cable_activities.shape
-        #print 'ca', self.cable_activities.ravel()
-        #print 'nb', self.num_bundles
-        #print 'bm', self.bundle_map.shape
-        #print 'bm-sized', self.bundle_map [:self.num_bundles, 
-        #                                   :self.cable_activities.size] 
-       
-        #initial_bundle_activities = np.dot(self.bundle_map,
-        #                                   self.cable_activities)
-        #print 'iba', initial_bundle_activities.shape
-        #print self.name
-        #print 'ibag', initial_bundle_activities_gm.ravel()
-        #print 'iba', initial_bundle_activities.ravel()
-        #print 'diba', (initial_bundle_activities_gm - initial_bundle_activities).ravel()
-        """ Find the activity levels of the bundles contributed to 
-        by each cable.
-        """
-        bundle_contribution_map = np.zeros(self.bundle_map.shape)
-        #bundle_contribution_map = np.zeros((self.num_bundles, 
-        #                                    self.cable_activities.size))
-        bundle_contribution_map[np.nonzero(self.bundle_map)] = 1.
-        #print 'bcm', bundle_contribution_map.shape
-        activated_bundle_map = (initial_bundle_activities * 
-                                bundle_contribution_map)
-        #print 'abm', activated_bundle_map.shape                                                
-        """ Find the largest bundle activity that each input contributes to """
-        max_activation = np.max(activated_bundle_map, axis=0) + tools.EPSILON
-        #print 'ma', max_activation
-        """ Divide the energy that each input contributes to each bundle """
-        input_inhibition_map = np.power(activated_bundle_map / max_activation, 
-                                        self.ACTIVATION_WEIGHTING_EXPONENT)
-        #print 'iim', input_inhibition_map.shape
-        """ Find the effective strength of each cable to each bundle 
-        after inhibition.
-        """
-        inhibited_cable_activities = (input_inhibition_map * 
-                                      self.cable_activities.T)
-        #print 'ii', inhibited_cable_activities.shape
-        #print 'bm', self.bundle_map.shape
-        #print 'di', np.nonzero(inhibited_cable_activities)
-        final_bundle_activities = tools.generalized_mean(
-                inhibited_cable_activities.T, self.bundle_map.T, 
-                self.MEAN_EXPONENT)
-        #final_bundle_activities = np.sum(self.bundle_map * 
-        #                                 inhibited_cable_activities, axis=1)
-        #final_bundle_activities = np.sum(
-        #        self.bundle_map[:self.num_bundles,:self.cable_activities.size] *
-        #        inhibited_cable_activities, axis=1)
-        #print 'fba', final_bundle_activities.shape
-        #print 'fba', final_bundle_activities.ravel()
-        #self.bundle_activities = final_bundle_activities[:,np.newaxis]
-        self.bundle_activities = final_bundle_activities
-        #self.bundle_activities[:self.num_bundles,0] = (
-        #        final_bundle_activities[:self.num_bundles])
-        #print 'ba', self.bundle_activities.shape
-        """ Calculate how much energy each input has left to contribute 
-        to the co-activity estimate. 
-        """
-        final_activated_bundle_map = (final_bundle_activities * 
-                                      bundle_contribution_map)
-
-        #final_activated_bundle_map = (final_bundle_activities[:,np.newaxis] * 
-        #                              bundle_contribution_map)
-        #print 'fabm', final_activated_bundle_map.shape
-        #combined_weights = (np.sum(final_activated_bundle_map, axis=0) + 
-        #                    tools.EPSILON)
-        # combination method 1: exponential weighting
-        #coactivities_inputs = self.cable_activities * 2 ** (
-        #    -combined_weights[:, np.newaxis] * self.DISSIPATION_FACTOR)
-        
-        # Calculate how much energy each signal has left to contribute 
-        # to the co-activities estimate
-        #final_activated_bundle_map = self.bundle_activities * self.bundle_map
-        # combination method 2: straight sum
-        combined_weights = np.sum(final_activated_bundle_map, 
-                                  axis=0)[:,np.newaxis]
-        #print 'cw', combined_weights.shape
-        #print 'cw', combined_weights.ravel()
-        self.nonbundle_activities = np.maximum(0., (cable_activities - 
+        self.cable_activities = cable_activities.astype(self.dtype, 
+                                                        copy=False)
+        self.bundle_activities = np.zeros((self.max_num_bundles, 1), 
+                                          dtype=self.dtype)
+        combined_weights = np.zeros((self.max_num_cables, 1), 
+                                    dtype=self.dtype)
+        if self.num_bundles > 0:
+            # Only the cables in nucleated bundles take part. 
+            # Work on a (num_bundles x max_cables_per_bundle) array 
+            # of their activities, with weights of zero for the padding.
+            bundle_cables = self.bundle_cables[:self.num_bundles,:]
+            member_weights = (bundle_cables >= 0).astype(self.dtype)
+            member_cables = bundle_cables[member_weights > 0]
+            member_activities = (self.cable_activities[bundle_cables, 0] * 
+                                 member_weights)
+            initial_bundle_activities = tools.generalized_mean(
+                    member_activities.T, member_weights.T, 
+                    self.MEAN_EXPONENT)
+            """ Find the activity levels of the bundles contributed to 
+            by each cable.
+            """
+            activated_bundle_map = initial_bundle_activities * member_weights
+            """ Find the largest bundle activity that each input 
+            contributes to 
+            """
+            max_activation = np.zeros(self.max_num_cables, dtype=self.dtype)
+            np.maximum.at(max_activation, member_cables, 
+                          activated_bundle_map[member_weights > 0])
+            max_activation += tools.EPSILON
+            """ Divide the energy that each input contributes to each 
+            bundle 
+            """
+            inhibited_cable_activities = inhibit(
+                    activated_bundle_map, max_activation[bundle_cables], 
+                    member_activities)
+            final_bundle_activities = tools.generalized_mean(
+                    inhibited_cable_activities.T, member_weights.T, 
+                    self.MEAN_EXPONENT)
+            self.bundle_activities[:self.num_bundles,:] = (
+                    final_bundle_activities)
+            """ Calculate how much energy each input has left to contribute 
+            to the co-activity estimate. 
+            """
+            final_activated_bundle_map = (final_bundle_activities * 
+                                          member_weights)
+            np.add.at(combined_weights[:,0], member_cables, 
+                      final_activated_bundle_map[member_weights > 0])
+        self.nonbundle_activities = np.maximum(0., (self.cable_activities - 
                                                     combined_weights))
         #self.typical_nonbundle_activities *= (
         #        1. - self.NONBUNDLE_ACTIVITY_UPDATE_RATE)
@@ -179,9 +256,11 @@ class ZipTie(object):
         #print 'tnba', self.typical_nonbundle_activities.ravel()
         # As appropriate update the co-activity estimate and 
         # create new bundles
+        start_time = self.instruments.start()
         if not self.bundles_full:
             self._create_new_bundles()
         self._grow_bundles()
+        self.instruments.stop(self.name + '.grow_bundles', start_time)
         return self.bundle_activities[:self.num_bundles,:]
 
     def _create_new_bundles(self):
@@ -198,32 +277,37 @@ class ZipTie(object):
         #cable_indices = np.where(np.random.random_sample(
         #        self.typical_nonbundle_activities.shape) <
         #        new_bundle_thresholds) 
-        # Decay the energy        
-        self.nucleation_energy -= (self.cable_activities *
-                                   self.nucleation_energy * 
-                                   self.NUCLEATION_ENERGY_RATE * 
-                                   self.ENERGY_DECAY_RATE)
-        self.nucleation_energy += (self.nonbundle_activities * 
-                                   (1. - self.nucleation_energy) *
-                                   self.NUCLEATION_ENERGY_RATE)
+        # Decay the energy. Only active cables can have 
+        # nonbundle activity, so only their energy changes.
+        active_cables = np.nonzero(self.cable_activities[:,0])[0]
+        nucleation_energy = self.nucleation_energy[active_cables,:]
+        update_nucleation_energy(nucleation_energy, 
+                                 self.cable_activities[active_cables,:],
+                                 self.nonbundle_activities[active_cables,:],
+                                 self.NUCLEATION_ENERGY_RATE)
+        self.nucleation_energy[active_cables,:] = nucleation_energy
         #print 'nba', self.nonbundle_activities.ravel()
         #print 'ne', self.nucleation_energy.ravel()
-        cable_indices = np.where(self.nucleation_energy * availability > 
-                                 self.NUCLEATION_THRESHOLD)
+        new_candidates = (nucleation_energy[:,0] * availability > 
+                          self.NUCLEATION_THRESHOLD)
+        self.num_nucleation_candidates += (
+                np.sum(new_candidates) - 
+                np.sum(self.nucleation_candidates[active_cables]))
+        self.nucleation_candidates[active_cables] = new_candidates
         # Add a new bundle if appropriate
-        if cable_indices[0].size > 0:
+        if self.num_nucleation_candidates > 0:
+            cable_indices = np.nonzero(self.nucleation_candidates)[0]
             # Randomly pick a new cable from the candidates, 
             # if there is more than one
-            cable_index = cable_indices[0][int(np.random.random_sample() * 
-                                                  cable_indices[0].size)]
-            self.bundle_map[self.num_bundles, cable_index] = 1.
+            cable_index = cable_indices[int(
+                    tools.random_source(self.random_state).random_sample() * 
+                    cable_indices.size)]
             self.num_bundles += 1
             if self.num_bundles == self.max_num_bundles:
                 self.bundles_full = True
             #self.typical_nonbundle_activities[cable_index, 0] = 0.
             print self.name, 'ci', cable_index, 'added as a bundle nucleus'
-            self.nucleation_energy[cable_index, 0] = 0.
-            self.agglomeration_energy[:, cable_index] = 0.
+            self._add_cable(self.num_bundles - 1, cable_index)
         return 
           
     def _grow_bundles(self):
@@ -231,28 +315,43 @@ class ZipTie(object):
         #print self.name
         #print 'ba', self.bundle_activities.shape
         #print 'nba', self.nonbundle_activities.shape
-        coactivities = np.dot(self.bundle_activities, 
-                              self.nonbundle_activities.T)
-        #print 'ca', coactivities.shape
-        #print coactivities
-        # Each cable's nonbundle activity is distributed to agglomeration energy 
-        # with each bundle proportionally to their coactivities.
-        proportions_by_bundle = (self.bundle_activities / 
-                                 np.sum(self.bundle_activities + tools.EPSILON))
-        proportions_by_cable = np.dot(proportions_by_bundle, 
-                                      self.nonbundle_activities.T)
-        #print 'ppb', proportions_by_bundle.ravel()
-        #print 'ppc', proportions_by_cable.ravel()
-        # Decay the energy        
-        self.agglomeration_energy -= (proportions_by_cable * 
-                                      self.cable_activities.T *
-                                      self.agglomeration_energy * 
-                                      self.AGGLOMERATION_ENERGY_RATE * 
-                                      self.ENERGY_DECAY_RATE)
-        self.agglomeration_energy += (proportions_by_cable * 
-                                      coactivities * 
-                                      (1. - self.agglomeration_energy) *
-                                      self.AGGLOMERATION_ENERGY_RATE)
+        # Energy only changes between active bundles and cables with 
+        # nonbundle activity. Bundles that are already full are left 
+        # out, since their energy is held at zero.
+        active_bundles = np.nonzero(np.logical_and(
+                self.bundle_activities[:,0] > 0., 
+                np.logical_not(self.full_bundles)))[0]
+        active_cables = np.nonzero(self.nonbundle_activities[:,0] > 0.)[0]
+        if active_bundles.size > 0 and active_cables.size > 0:
+            bundle_activities = self.bundle_activities[active_bundles,:]
+            nonbundle_activities = self.nonbundle_activities[active_cables,:]
+            coactivities = np.dot(bundle_activities, nonbundle_activities.T)
+            #print 'ca', coactivities.shape
+            #print coactivities
+            # Each cable's nonbundle activity is distributed to 
+            # agglomeration energy with each bundle proportionally 
+            # to their coactivities.
+            proportions_by_bundle = (bundle_activities / 
+                                     np.sum(self.bundle_activities + 
+                                            tools.EPSILON))
+            proportions_by_cable = np.dot(proportions_by_bundle, 
+                                          nonbundle_activities.T)
+            #print 'ppb', proportions_by_bundle.ravel()
+            #print 'ppc', proportions_by_cable.ravel()
+            # Decay the energy        
+            active_entries = np.ix_(active_bundles, active_cables)
+            agglomeration_energy = self.agglomeration_energy[active_entries]
+            update_agglomeration_energy(
+                    agglomeration_energy, proportions_by_cable, 
+                    self.cable_activities[active_cables,:].T, coactivities,
+                    self.AGGLOMERATION_ENERGY_RATE)
+            self.agglomeration_energy[active_entries] = agglomeration_energy
+            new_candidates = agglomeration_energy >= self.JOINING_THRESHOLD
+            self.candidates_per_bundle[active_bundles] += (
+                    np.sum(new_candidates, axis=1) - 
+                    np.sum(self.agglomeration_candidates[active_entries], 
+                           axis=1))
+            self.agglomeration_candidates[active_entries] = new_candidates
         #print self.agglomeration_energy
         # Determine the upper bound on the size of the incremental step 
         # toward the instant co-activity.
@@ -287,31 +386,69 @@ class ZipTie(object):
         #self.affinity = np.ones(self.affinity.shape)
         
         
-        # for any bundles that are already full, don't change their coactivity
+        # Bundles that are already full stop changing their coactivity.
+        # They are marked as full in _add_cable.
         # TODO: make this more elegant than enforcing a hard maximum count
-        full_bundles = np.zeros((self.max_num_bundles, 1))
-        cables_per_bundle = np.sum(self.bundle_map, axis=1)[:,np.newaxis]
-        full_bundles[np.where(cables_per_bundle >= 
-                              self.max_cables_per_bundle)] = 1.
-        #self.coactivities *= 1. - full_bundles
-        self.agglomeration_energy *= 1 - full_bundles
-
         #new_candidates = np.where(self.coactivities >= self.JOINING_THRESHOLD)
-        new_candidates = np.where(self.agglomeration_energy >= 
-                                  self.JOINING_THRESHOLD)
-        num_candidates =  new_candidates[0].size 
-        if num_candidates > 0:
-            candidate_index = np.random.randint(num_candidates) 
+        if np.any(self.candidates_per_bundle):
+            candidate_bundles = np.nonzero(self.candidates_per_bundle)[0]
+            new_candidates = np.nonzero(
+                    self.agglomeration_candidates[candidate_bundles,:])
+            num_candidates =  new_candidates[0].size 
+            candidate_index = tools.random_source(
+                    self.random_state).randint(num_candidates) 
             candidate_cable = new_candidates[1][candidate_index]
-            candidate_bundle = new_candidates[0][candidate_index]
-            self.bundle_map[candidate_bundle, candidate_cable] = 1.
+            candidate_bundle = candidate_bundles[
+                    new_candidates[0][candidate_index]]
             #self.bundle_map[np.where(self.coactivities >= 
             #                         self.JOINING_THRESHOLD)] = 1.
-            self.nucleation_energy[candidate_cable, 0] = 0.
-            self.agglomeration_energy[:, candidate_cable] = 0.
-            print self.name, 'cable', candidate_cable, 'added to bundle', candidate_bundle
+            self._add_cable(candidate_bundle, candidate_cable)
+            print self.name, 'cable', candidate_cable, 'added to bundle', \
+                    candidate_bundle
         return
         
+    def _add_cable(self, bundle_index, cable_index):
+        """ 
+        Add a cable to a bundle, keeping its cables in ascending order 
+
+        The cable's energies are used up in the process.
+        """
+        num_cables = self.cables_per_bundle[bundle_index]
+        cables = self.bundle_cables[bundle_index,:num_cables]
+        insert_index = np.searchsorted(cables, cable_index)
+        # A cable can build up energy toward a bundle it already belongs to
+        if (insert_index == num_cables or 
+                cables[insert_index] != cable_index):
+            self.bundle_cables[bundle_index,:num_cables + 1] = np.insert(
+                    cables, insert_index, cable_index)
+            self.cables_per_bundle[bundle_index] += 1
+            self.map_version += 1
+            self.instruments.count(self.name + '.cables_added')
+        self.nucleation_energy[cable_index, 0] = 0.
+        if self.nucleation_candidates[cable_index]:
+            self.nucleation_candidates[cable_index] = False
+            self.num_nucleation_candidates -= 1
+        self.agglomeration_energy[:, cable_index] = 0.
+        self.candidates_per_bundle -= self.agglomeration_candidates[
+                :, cable_index]
+        self.agglomeration_candidates[:, cable_index] = False
+        # For any bundles that are full, don't change their coactivity
+        if (self.cables_per_bundle[bundle_index] >= 
+                self.max_cables_per_bundle):
+            self.full_bundles[bundle_index] = True
+            self.agglomeration_energy[bundle_index,:] = 0.
+            self.candidates_per_bundle[bundle_index] = 0
+            self.agglomeration_candidates[bundle_index,:] = False
+        return
+
+    @property
+    def bundle_map(self):
+        """ The dense (max_num_bundles x max_num_cables) membership map """
+        bundle_map = np.zeros((self.max_num_bundles, self.max_num_cables))
+        (bundles, slots) = np.nonzero(self.bundle_cables >= 0)
+        bundle_map[bundles, self.bundle_cables[bundles, slots]] = 1.
+        return bundle_map
+
     def get_cable_deliberation_vote(self, bundle_activity_goals):
         """ 
         Project the bundle goal values to the appropriate cables
@@ -320,25 +457,27 @@ class ZipTie(object):
         to them, and perform a bounded sum over all bundles to get 
         the estimated activity associated with each cable.
         """
+        cable_activity_goals = np.zeros((self.max_num_cables, 1), 
+                                        dtype=self.dtype)
         if bundle_activity_goals.size > 0:
             bundle_activity_goals = tools.pad(bundle_activity_goals, 
                                        (self.max_num_bundles, 0))
-            cable_activity_goals = tools.bounded_sum(self.bundle_map * 
-                                              bundle_activity_goals, axis=0)
-        else:
-            cable_activity_goals = np.zeros((self.max_num_cables, 1))
+            (bundles, slots) = np.nonzero(self.bundle_cables >= 0)
+            np.add.at(cable_activity_goals[:,0], 
+                      self.bundle_cables[bundles, slots], 
+                      tools.map_one_to_inf(bundle_activity_goals[bundles, 0]))
+            cable_activity_goals = tools.map_inf_to_one(cable_activity_goals)
         return cable_activity_goals
         
     def get_projection(self, bundle_index):
         """ Project bundles down to the cables they're composed of """
-        bundle = np.zeros((self.max_num_bundles, 1))
-        bundle[bundle_index, 0] = 1.
-        projection = np.sign(np.max(self.bundle_map * bundle, 
-                                    axis=0))[np.newaxis, :]
+        projection = np.zeros((1, self.max_num_cables))
+        num_cables = self.cables_per_bundle[bundle_index]
+        projection[0, self.bundle_cables[bundle_index, :num_cables]] = 1.
         return projection
         
     def cable_fraction_in_bundle(self, bundle_index):
-        cable_count = np.nonzero(self.bundle_map[bundle_index,:])[0].size
+        cable_count = self.cables_per_bundle[bundle_index]
         cable_fraction = float(cable_count) / float(self.max_cables_per_bundle)
         return cable_fraction
 
@@ -350,7 +489,8 @@ class ZipTie(object):
         #                   save_eps=save_eps)
         #tools.visualize_array(self.bundle_map, 
         #                   label=self.name + '_bundle_map')
-        print self.name, '0', np.nonzero(self.bundle_map)[0]
-        print self.name, '1', np.nonzero(self.bundle_map)[1]
+        bundle_map = self.bundle_map
+        print self.name, '0', np.nonzero(bundle_map)[0]
+        print self.name, '1', np.nonzero(bundle_map)[1]
         print self.max_num_bundles, 'bundles maximum'
         return
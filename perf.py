@@ -0,0 +1,346 @@
+
+"""
+perf
+
+Measure how fast BECCA runs, rather than how well it does.
+
+For each of the benchmark worlds, an agent is run for a fixed number
+of time steps and its steps per second, mean and 99th percentile
+step latency, and peak memory are reported. A set of micro-benchmarks
+times the parts of the agent that most of its time is spent in.
+
+Run at the command line as a script with no arguments:
+> python perf.py
+The results are written to log/perf.json. To check them against
+a stored baseline, flagging anything more than 10% slower:
+> python perf.py --baseline log/perf_baseline.json
+The script exits with a status of 1 if there are any regressions,
+and 2 if the baseline was run with a different number of steps or dtype.
+Only steps per second and the micro-benchmarks' best times are checked.
+
+To time only the micro-benchmarks, or only some of the worlds:
+> python perf.py --steps 0
+> python perf.py --worlds grid_1D image_2D
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import timeit
+
+# Importing the benchmark pins each process to one BLAS thread,
+# which keeps the timings from depending on what else is running.
+from benchmark import WORLDS
+from core.agent import Agent
+from core.block import Block
+import core.tools as tools
+from core.ziptie import ZipTie
+
+import numpy as np
+
+N_STEPS = 2000
+# Metrics for which a higher value is better.
+# For all the others, lower is better.
+HIGHER_IS_BETTER = ['steps_per_second']
+# The metrics that are checked against a baseline. The others,
+# such as the mean of the micro-benchmarks' batches, vary too much
+# from one run to the next to be a reliable sign of a regression.
+COMPARED_METRICS = ['steps_per_second', 'best_us']
+# Results can only be compared if these parts of their configs match
+COMPARED_CONFIG = ['num_steps', 'dtype']
+
+def world_name(World):
+    """ The name of a world's module, which is what it is known by here """
+    return World.__module__.split('.')[-1]
+
+def time_world(job):
+    """
+    Run an agent in a world and measure its speed
+
+    job is a (World, num_steps, dtype) tuple. This is meant to be run
+    in a fresh process of its own, so that the peak memory is that of
+    this world alone. The world's visualization is skipped and
+    everything printed along the way is discarded.
+    Returns a dict of the measurements.
+    """
+    (World, num_steps, dtype) = job
+    np.random.seed(0)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        world = World(lifespan=num_steps)
+        agent = Agent(world.num_sensors, world.num_actions,
+                      agent_name='_'.join((world.name, 'perf_agent')),
+                      show=False, dtype=dtype)
+        agent.graphing = False
+        world.set_agent_parameters(agent)
+        actions = np.zeros((world.num_actions, 1))
+        latencies = []
+        timer = timeit.default_timer
+        start_time = timer()
+        while world.is_alive():
+            step_start_time = timer()
+            sensors, reward = world.step(actions)
+            actions = agent.step(sensors, reward)
+            latencies.append(timer() - step_start_time)
+        total_time = timer() - start_time
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    latencies = np.array(latencies)
+    # ru_maxrss is in kilobytes on Linux, but in bytes on OS X
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak_memory *= 1024
+    return {'steps_per_second': latencies.size / total_time,
+            'mean_latency_ms': np.mean(latencies) * 1e3,
+            'p99_latency_ms': np.percentile(latencies, 99) * 1e3,
+            'peak_memory_mb': peak_memory / 2. ** 20}
+
+def _random_activities(num_cables, num_samples=64, active_fraction=.3):
+    """ A set of sparse cable activity arrays to cycle through """
+    return (np.random.random_sample((num_samples, num_cables, 1)) *
+            (np.random.random_sample((num_samples, num_cables, 1)) <
+             active_fraction))
+
+def _ziptie_update():
+    ziptie = ZipTie(256, 64, max_cables_per_bundle=8, mean_exponent=-2)
+    activities = _random_activities(256)
+    calls = [0]
+    def call():
+        calls[0] += 1
+        ziptie.update(activities[calls[0] % activities.shape[0]])
+    # Let some bundles form before timing
+    for i in range(2000):
+        call()
+    return call
+
+def _warm_block():
+    """ A block that has been running long enough to have some cogs """
+    block = Block(64)
+    activities = _random_activities(64)
+    for i in range(2000):
+        block.step_up(activities[i % activities.shape[0]], .5)
+        block.step_down(np.zeros((block.max_bundles, 1)))
+    return (block, activities)
+
+def _block_step_up():
+    (block, activities) = _warm_block()
+    calls = [0]
+    def call():
+        calls[0] += 1
+        block.step_up(activities[calls[0] % activities.shape[0]], .5)
+    return call
+
+def _block_step_down():
+    (block, activities) = _warm_block()
+    goals = np.random.random_sample((block.max_bundles, 1)) * .1
+    return lambda: block.step_down(goals)
+
+def _gearbox_inputs(block, cable_activities):
+    """ The arguments that block passes to its gearbox's step_up """
+    cable_activities = tools.pad(cable_activities, (block.max_cables, 1))
+    cog_cable_activities = np.zeros((block.gearbox.num_cogs,
+                                     block.max_cables_per_cog, 1))
+    cog_cable_activities[block.cog_cable_assigned] = (
+            cable_activities[block.assigned_cables])
+    enough_cables = (block.cog_cable_counts.astype(float) /
+                     float(block.ziptie.max_cables_per_bundle) > 0.7)
+    return (cog_cable_activities, block.cog_cable_counts, .5, enough_cables)
+
+def _gearbox_step_up():
+    (block, activities) = _warm_block()
+    inputs = [_gearbox_inputs(block, activities[i])
+              for i in range(activities.shape[0])]
+    calls = [0]
+    def call():
+        calls[0] += 1
+        block.gearbox.step_up(*inputs[calls[0] % len(inputs)])
+    return call
+
+def _gearbox_step_down():
+    (block, activities) = _warm_block()
+    goals = np.random.random_sample((block.gearbox.num_cogs,
+                                     block.max_bundles_per_cog, 1)) * .1
+    return lambda: block.gearbox.step_down(goals)
+
+def _bounded_sum():
+    terms = [np.random.random_sample((256, 1)) * .5 for i in range(3)]
+    return lambda: tools.bounded_sum(terms)
+
+def _map_one_to_inf():
+    a = np.random.random_sample((256, 8, 1)) * 2. - 1.
+    out = np.empty(a.shape)
+    return lambda: tools.map_one_to_inf(a, out=out)
+
+def _map_inf_to_one():
+    a_prime = np.random.standard_cauchy((256, 8, 1))
+    out = np.empty(a_prime.shape)
+    return lambda: tools.map_inf_to_one(a_prime, out=out)
+
+def _weighted_average():
+    weights = np.random.random_sample((256, 8, 8))
+    values = np.random.random_sample((256, 8, 1))
+    out = np.empty((256, 8, 1))
+    return lambda: tools.weighted_average(values, weights, out=out)
+
+def _generalized_mean():
+    weights = (np.random.random_sample((8, 64)) < .5).astype(float)
+    values = np.random.random_sample((8, 64)) * weights
+    return lambda: tools.generalized_mean(values, weights, -2)
+
+def _center_surround():
+    # The visual worlds' tools aren't needed by anything else here
+    import worlds.world_tools as wtools
+    fov = np.random.random_sample((100, 100))
+    return lambda: wtools.center_surround(fov, 5, 5)
+
+# Each micro-benchmark sets up what it needs and returns the call to time
+MICRO_BENCHMARKS = [('ZipTie.update', _ziptie_update),
+                    ('Block.step_up', _block_step_up),
+                    ('Block.step_down', _block_step_down),
+                    ('Gearbox.step_up', _gearbox_step_up),
+                    ('Gearbox.step_down', _gearbox_step_down),
+                    ('tools.bounded_sum', _bounded_sum),
+                    ('tools.map_one_to_inf', _map_one_to_inf),
+                    ('tools.map_inf_to_one', _map_inf_to_one),
+                    ('tools.weighted_average', _weighted_average),
+                    ('tools.generalized_mean', _generalized_mean),
+                    ('world_tools.center_surround', _center_surround)]
+
+def time_micro(setup, num_calls=200, num_repeats=5):
+    """
+    Time many calls to the function that setup returns
+
+    The calls are timed in num_repeats batches of num_calls.
+    Returns a dict with the mean time per call, in microseconds,
+    of the fastest batch and of all of them.
+    """
+    np.random.seed(0)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        call = setup()
+        batch_times = []
+        timer = timeit.default_timer
+        for repeat in range(num_repeats):
+            start_time = timer()
+            for i in range(num_calls):
+                call()
+            batch_times.append(timer() - start_time)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    batch_times = np.array(batch_times) / num_calls
+    return {'best_us': np.min(batch_times) * 1e6,
+            'mean_us': np.mean(batch_times) * 1e6}
+
+def run(num_steps=N_STEPS, world_names=None, dtype=np.float64):
+    """
+    Run the world timings and micro-benchmarks
+
+    world_names is a list of the worlds to time. It defaults to all
+    of the benchmark worlds. Returns a dict of the results.
+    """
+    results = {'config': {'num_steps': num_steps,
+                          'dtype': np.dtype(dtype).name,
+                          'python': platform.python_version(),
+                          'numpy': np.__version__,
+                          'machine': platform.machine()},
+               'worlds': {}, 'micro': {}}
+    if num_steps > 0:
+        for World in WORLDS:
+            name = world_name(World)
+            if world_names is not None and name not in world_names:
+                continue
+            # A fresh process for each world keeps their peak memory apart
+            pool = multiprocessing.Pool(processes=1)
+            try:
+                results['worlds'][name] = pool.apply(
+                        time_world, ((World, num_steps, dtype),))
+            finally:
+                pool.close()
+                pool.join()
+            print name, _format(results['worlds'][name])
+    for (name, setup) in MICRO_BENCHMARKS:
+        results['micro'][name] = time_micro(setup)
+        print name, _format(results['micro'][name])
+    return results
+
+def _format(measurements):
+    return '  '.join(['%s %.3f' % (key, measurements[key])
+                      for key in sorted(measurements.keys())])
+
+def compare(results, baseline, tolerance=.1):
+    """
+    Find the measurements that have gotten worse since the baseline
+
+    A measurement regresses if it is more than a fraction tolerance
+    worse than the baseline's. Only the COMPARED_METRICS are checked,
+    and anything that is missing from either of them is skipped.
+    Returns a list of descriptions of the regressions.
+    Raises a ValueError if the results and the baseline were run with
+    different numbers of steps or dtypes.
+    """
+    for key in COMPARED_CONFIG:
+        value = results['config'].get(key)
+        baseline_value = baseline.get('config', {}).get(key)
+        if value != baseline_value:
+            raise ValueError('Results with %s %s can\'t be compared to '
+                             'a baseline with %s %s' % (
+                                     key, value, key, baseline_value))
+    regressions = []
+    for section in ['worlds', 'micro']:
+        for (name, measurements) in sorted(results[section].items()):
+            baseline_measurements = baseline.get(section, {}).get(name, {})
+            for (metric, value) in sorted(measurements.items()):
+                if (metric not in COMPARED_METRICS or
+                        metric not in baseline_measurements):
+                    continue
+                baseline_value = baseline_measurements[metric]
+                if metric in HIGHER_IS_BETTER:
+                    regressed = value < baseline_value * (1. - tolerance)
+                else:
+                    regressed = value > baseline_value * (1. + tolerance)
+                if regressed:
+                    regressions.append('%s %s: %.3f, baseline %.3f' % (
+                            name, metric, value, baseline_value))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure how fast BECCA runs')
+    parser.add_argument("dtype", nargs='?', default='float64',
+                        help="floating point type the agent runs in")
+    parser.add_argument("--steps", type=int, default=N_STEPS,
+                        help="time steps to run each world for, 0 to skip them")
+    parser.add_argument("--worlds", nargs='+', default=None,
+                        help="names of the worlds to time (default: all)")
+    parser.add_argument("-o", "--output", default='log/perf.json',
+                        help="file to write the results to")
+    parser.add_argument("-b", "--baseline", default=None,
+                        help="results file to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=.1,
+                        help="fraction by which a measurement can get worse")
+    args = parser.parse_args()
+    results = run(num_steps=args.steps, world_names=args.worlds,
+                  dtype=np.dtype(args.dtype))
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    print 'Results written to', args.output
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        try:
+            regressions = compare(results, baseline,
+                                  tolerance=args.tolerance)
+        except ValueError as error:
+            print error
+            sys.exit(2)
+        for regression in regressions:
+            print 'Regression in', regression
+        if regressions:
+            sys.exit(1)
+        print 'No regressions against', args.baseline
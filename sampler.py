@@ -0,0 +1,96 @@
+
+"""
+A low overhead, in-process sampling profiler
+
+Every interval seconds of CPU time, the profiler interrupts the
+program and records the stack of function calls that it was in.
+The samples can be written out as collapsed stacks, one line per
+distinct stack with the number of times it was seen,
+    tester.py:<module>;tester.py:test;agent.py:step 1234
+which is the input that flamegraph.pl, speedscope and most other
+flamegraph tools expect.
+
+Unlike cProfile, it leaves the functions being profiled alone, so
+their relative times aren't distorted by the cost of tracing every call.
+It uses SIGPROF, so it only works on POSIX systems, and only samples
+the main thread.
+"""
+import os
+import signal
+
+class SamplingProfiler(object):
+    """ Sample the main thread's call stack at regular intervals """
+    def __init__(self, interval=.002):
+        """ interval is the CPU time between samples, in seconds """
+        self.interval = interval
+        self.stacks = {}
+        self.num_samples = 0
+        # Labels are cached by code object, so that each one is only
+        # built the first time it is seen
+        self._labels = {}
+        self._previous_handler = None
+
+    def start(self):
+        """ Start sampling """
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """ Stop sampling. The samples taken so far are kept. """
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+
+    def _sample(self, signal_number, frame):
+        """ Record the stack that the program was interrupted in """
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = ':'.join((os.path.basename(code.co_filename),
+                                  code.co_name))
+                self._labels[code] = label
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        stack = ';'.join(labels)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.num_samples += 1
+
+    def write_collapsed(self, filename):
+        """ Write the samples out as collapsed stacks """
+        with open(filename, 'w') as collapsed_file:
+            for (stack, count) in sorted(self.stacks.items()):
+                collapsed_file.write('%s %d\n' % (stack, count))
+
+    def function_times(self):
+        """
+        Estimate the CPU time spent in each function
+
+        Returns a list of (label, self time, total time) tuples,
+        in seconds, sorted with the largest self time first.
+        Self time is spent in the function itself, and total time
+        includes the functions it calls.
+        """
+        self_counts = {}
+        total_counts = {}
+        for (stack, count) in self.stacks.items():
+            labels = stack.split(';')
+            self_counts[labels[-1]] = self_counts.get(labels[-1], 0) + count
+            # Recursive functions are only counted once per stack
+            for label in set(labels):
+                total_counts[label] = total_counts.get(label, 0) + count
+        times = [(label, self_counts.get(label, 0) * self.interval,
+                  total_counts[label] * self.interval)
+                 for label in total_counts.keys()]
+        times.sort(key=lambda time: (-time[1], -time[2]))
+        return times
+
+    def print_stats(self, num_lines=30):
+        """ Print the functions with the most self time """
+        print 'Sampled %d stacks, every %.1f ms of CPU time' % (
+                self.num_samples, self.interval * 1e3)
+        print '%10s %10s  %s' % ('self (s)', 'total (s)', 'function')
+        for (label, self_time, total_time) in (
+                self.function_times()[:num_lines]):
+            print '%10.3f %10.3f  %s' % (self_time, total_time, label)
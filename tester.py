@@ -2,7 +2,9 @@
 
 
 import cProfile
+import importlib
 import numpy as np
+import os
 import pstats
 import argparse
 
@@ -14,6 +16,18 @@ will be placed in.
 Make sure the appropriate import line is included and uncommented below. 
 Run from the command line, e.g. 
 > python tester.py
+or choose a world by name, e.g. 
+> python tester.py -w grid_2D
+
+To profile the agent in a world for --profilelife time steps:
+> python tester.py -w grid_2D --profile
+This writes cProfile stats to log/tester_profile. To sample the 
+call stacks instead, and write them out as collapsed stacks for 
+flamegraph tools, to log/tester_profile.collapsed:
+> python tester.py -w grid_2D --profile --sample
+Both also print how long each block took. To compare two saved 
+cProfile stats, say from before and after a change:
+> python tester.py --diff log/before_profile log/after_profile
 """
 
 # Worlds from the benchmark
@@ -28,9 +42,16 @@ Run from the command line, e.g.
 
 # If you want to run a world of your own, add the appropriate line here
 from core.agent import Agent 
+from core.display import Display
+from sampler import SamplingProfiler
+
+# The worlds that can be chosen by name from the command line
+BENCHMARK_WORLDS = ['grid_1D', 'grid_1D_ms', 'grid_1D_noise', 'grid_2D', 
+                    'grid_2D_dc', 'image_1D', 'image_2D']
 
 
-def test(world, restore=False, show=True, agent_name=None):
+def test(world, restore=False, show=True, agent_name=None, 
+         dtype=np.float64, instrument=False):
     """ 
     Run BECCA with world.  
     
@@ -41,13 +62,24 @@ def test(world, restore=False, show=True, agent_name=None):
     
     To profile BECCA's performance with world, manually set
     profile_flag in the top level script environment to True.
+    dtype is the floating point type the agent runs in.
+    If instrument is True, the agent's instruments are turned on,
+    world.step is timed along with them, and a summary of the 
+    timings is printed at the end.
+    If show is True, the agent and the world publish their plots 
+    to a Display, which draws them in a separate process, and
+    the plots stay up at the end until they are closed. 
     """
     if agent_name is None:
         agent_name = '_'.join((world.name, 'agent'))
+    display = Display() if show else None
+    world.display = display
     agent = Agent(world.num_sensors, world.num_actions, 
-                  agent_name=agent_name, show=show)
+                  agent_name=agent_name, show=show, dtype=dtype,
+                  display=display)
     if restore:
         agent = agent.restore()
+    agent.instruments.enabled = instrument
 
     # If configured to do so, the world sets some BECCA parameters to 
     # modify its behavior. This is a development hack, and 
@@ -58,23 +90,137 @@ def test(world, restore=False, show=True, agent_name=None):
     
     # Repeat the loop through the duration of the existence of the world 
     while(world.is_alive()):
+        start_time = agent.instruments.start()
         sensors, reward = world.step(actions)
+        agent.instruments.stop('world.step', start_time)
         actions = agent.step(sensors, reward)
         world.visualize(agent)
-    return agent.report_performance()
-
-def profile():
-    """ Profile BECCA's performance """
-    cProfile.run('test(World(lifespan=profiling lifespan), restore=True)', 
-                 'tester_profile')
-    p = pstats.Stats('tester_profile')
-    p.strip_dirs().sort_stats('time', 'cum').print_stats(30)
+    if instrument:
+        report_stats(agent.stats())
+    performance = agent.report_performance()
+    if display is not None:
+        display.close(hold=True)
+    return performance
+
+def report_stats(stats):
+    """ Print the timings and counts from an agent's stats() """
+    for (name, timings) in sorted(stats['timers'].items()):
+        print '%-40s %8d calls  p50 %8.3f ms  p99 %8.3f ms  total %10.1f ms' % (
+                name, timings['count'], timings['p50_ms'], 
+                timings['p99_ms'], timings['total_ms'])
+    for (name, count) in sorted(stats['counters'].items()):
+        print '%-40s %8d' % (name, count)
+
+def profile(world, restore=False, sample=False, sample_interval=.002,
+            filename='log/tester_profile'):
+    """ 
+    Profile BECCA's performance with world 
+
+    By default, cProfile stats are written to filename and the 
+    functions with the most time in them are printed. If sample is True,
+    the call stack is sampled every sample_interval seconds of CPU time 
+    instead, which distorts the timings much less, and the samples
+    are written to filename + '.collapsed' for flamegraph tools.
+    Either way, the time spent in each block is printed as well.
+    """
+    if sample:
+        sampler = SamplingProfiler(interval=sample_interval)
+        sampler.start()
+        try:
+            test(world, restore=restore, show=False, instrument=True)
+        finally:
+            sampler.stop()
+        collapsed_filename = filename + '.collapsed'
+        sampler.write_collapsed(collapsed_filename)
+        sampler.print_stats()
+        print 'Collapsed stacks written to', collapsed_filename
+    else:
+        profiler = cProfile.Profile()
+        profiler.runcall(test, world, restore=restore, show=False, 
+                         instrument=True)
+        profiler.dump_stats(filename)
+        p = pstats.Stats(filename)
+        p.strip_dirs().sort_stats('time', 'cumulative').print_stats(30)
+        print 'Profile written to', filename
+
+def _function_times(filename):
+    """ 
+    Read the self and total time of each function from saved cProfile stats
+
+    Functions are known by their file and name, rather than their 
+    line number, so that they still match after their code is edited.
+    """
+    times = {}
+    for ((path, line, function_name), (primitive_calls, calls, self_time, 
+            total_time, callers)) in pstats.Stats(filename).stats.items():
+        label = ':'.join((os.path.basename(path), function_name))
+        (previous_self_time, previous_total_time) = times.get(label, (0., 0.))
+        times[label] = (previous_self_time + self_time, 
+                        previous_total_time + total_time)
+    return times
+
+def diff_profiles(before_filename, after_filename, num_lines=30):
+    """ 
+    Compare two saved cProfile stats, function by function 
+    
+    Prints the functions whose self time changed the most, and 
+    returns a list of (label, before, after) self times, in seconds, 
+    for all of them, sorted by the size of the change.
+    """
+    before = _function_times(before_filename)
+    after = _function_times(after_filename)
+    changes = []
+    for label in set(before.keys()) | set(after.keys()):
+        changes.append((label, before.get(label, (0., 0.))[0], 
+                        after.get(label, (0., 0.))[0]))
+    changes.sort(key=lambda change: -abs(change[2] - change[1]))
+    total_before = sum([change[1] for change in changes])
+    total_after = sum([change[2] for change in changes])
+    print '%10s %10s %10s  %s' % ('before (s)', 'after (s)', 'change', 
+                                  'function')
+    print '%10.3f %10.3f %+9.1f%%  %s' % (
+            total_before, total_after, 
+            100. * (total_after - total_before) / (total_before + 1e-12), 
+            'total')
+    for (label, before_time, after_time) in changes[:num_lines]:
+        print '%10.3f %10.3f %+10.3f  %s' % (before_time, after_time, 
+                                             after_time - before_time, label)
+    return changes
+
+def make_world(name, lifespan, args):
+    """ Create the world called name """
+    if name in BENCHMARK_WORLDS:
+        world_module = importlib.import_module('.'.join(('worlds', name)))
+        return world_module.World(lifespan=lifespan)
+    if name == "listen":
+        from becca_world_listen.listen import World
+        return World(lifespan=lifespan, test=args.test, 
+                     visualize_period=args.viz)
+    if name == "watch":
+        from becca_world_watch.watch import World
+        return World(lifespan=lifespan, test=args.test, 
+                     fov_horz_span=args.horizontal, 
+                     fov_vert_span=args.vertical, visualize_period=args.viz)
+    if name == "tiny_images":
+        from becca_world_tiny_images.tiny_images import World
+        return World(lifespan=lifespan, test=args.test, 
+                     visualize_period=args.viz)
+    if name == "audio_video":
+        from becca_world_audio_video.audio_video import World
+        return World(lifespan=lifespan, test=args.test, 
+                     fov_horz_span=args.horizontal, 
+                     fov_vert_span=args.vertical, visualize_period=args.viz)
+    raise ValueError(' '.join(('There is no world called', name)))
     
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run BECCA against possible worlds')
     parser.add_argument("-w", "--world", help="choose which world to run", default="watch")
     parser.add_argument("-t", "--test", help="Enable testing mode")
-    parser.add_argument("-p", "--profile", help="Begin Profiling mode")
+    parser.add_argument("-p", "--profile", action="store_true", help="Begin Profiling mode")
+    parser.add_argument("-s", "--sample", action="store_true", help="Profile by sampling call stacks")
+    parser.add_argument("--interval", type=float, help="Sampling interval (in ms of CPU time)", default=2.)
+    parser.add_argument("--profilefile", help="Profile output file", default="log/tester_profile")
+    parser.add_argument("--diff", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two saved profiles")
     parser.add_argument("--viz", type=int, help="Visualization period (in timesteps)", default=10**4)
     parser.add_argument("-o", "--horizontal", type=int, help="Horizontal size (in pixels)", default=40)
     parser.add_argument("-v", "--vertical", type=int, help="Vertical size (in pixels)", default=40)
@@ -83,27 +229,12 @@ if __name__ == '__main__':
     args = parser.parse_args()
     
 
-    if args.world == "listen":
-        from becca_world_listen.listen import World
-        if args.profile:
-            profile()
-        else:
-            test(World(lifespan=args.testlife, test=args.test,visualize_period=args.viz), restore=True)
-    elif args.world == "watch":
-        from becca_world_watch.watch import World
-        if args.profile:
-            profile()
-        else:
-            test(World(lifespan=args.testlife, test=args.test, fov_horz_span=args.horizontal, fov_vert_span=args.vertical, visualize_period=args.viz), restore=True)
-    elif args.world == "tiny_images":
-        from becca_world_tiny_images.tiny_images import World
-        if args.profile:
-            profile()
-        else:
-            test(World(lifespan=args.testlife, test=args.test, visualize_period=args.viz), restore=True)
-    elif args.world == "audio_video":
-        from becca_world_audio_video.audio_video import World
-        if args.profile:
-            profile()
-        else:
-            test(World(lifespan=args.testlife, test=args.test, fov_horz_span=args.horizontal, fov_vert_span=args.vertical, visualize_period=args.viz), restore=True)
\ No newline at end of file
+    if args.diff:
+        diff_profiles(args.diff[0], args.diff[1])
+    elif args.profile:
+        profile(make_world(args.world, args.profilelife, args), 
+                restore=True, sample=args.sample, 
+                sample_interval=args.interval / 1000., 
+                filename=args.profilefile)
+    else:
+        test(make_world(args.world, args.testlife, args), restore=True)
\ No newline at end of file
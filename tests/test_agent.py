@@ -0,0 +1,88 @@
+"""
+Check saving, restoring and storing agents.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from core.agent import Agent
+
+
+class AgentTestCase(unittest.TestCase):
+    """ Run each test in its own directory, with its output hidden """
+
+    def setUp(self):
+        self.original_directory = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.mkdir('log')
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        os.chdir(self.original_directory)
+        shutil.rmtree(self.directory)
+
+
+class RestoreTest(AgentTestCase):
+
+    def test_refuse_pickle(self):
+        """ An agent pickled whole by an earlier version isn't loaded """
+        agent = Agent(4, 2, show=False, agent_name='old_agent')
+        with open(agent.pickle_filename, 'wb') as agent_data:
+            agent_data.write('(icore.block\nBlock\n(dp0\nS\'cogs\'\n')
+        restored_agent = agent.restore()
+        self.assertIs(restored_agent, agent)
+        restored_agent.step([0., 1., 0., 1.], 0.)
+
+
+class StoreTest(AgentTestCase):
+
+    def _run(self, agent, num_steps=100):
+        """ Step the agent, then fill its stored arrays """
+        state = np.random.RandomState(1)
+        for i in range(num_steps):
+            sensors = (state.random_sample(agent.num_sensors) < .3)
+            agent.step(sensors.astype(float), state.random_sample())
+        for array in self._stored(agent):
+            array[...] = state.random_sample(array.shape)
+
+    def _stored(self, agent):
+        """ The agent's arrays that are kept in its store """
+        ziptie = agent.blocks[0].ziptie
+        return [ziptie.agglomeration_energy, ziptie.agglomeration_candidates]
+
+    def test_same_directory(self):
+        """ A second agent in the same directory leaves the first's alone """
+        memmap_directory = os.path.join(self.directory, 'memmap')
+        agent = Agent(16, 2, show=False, memmap_directory=memmap_directory)
+        self._run(agent)
+        before = [array.copy() for array in self._stored(agent)]
+        Agent(16, 2, show=False, memmap_directory=memmap_directory)
+        for (array, copy) in zip(self._stored(agent), before):
+            np.testing.assert_array_equal(array, copy)
+
+    def test_restore_same_directory(self):
+        """ Restoring into the same directory leaves the saved agent alone """
+        memmap_directory = os.path.join(self.directory, 'memmap')
+        agent = Agent(16, 2, show=False, memmap_directory=memmap_directory)
+        self._run(agent)
+        agent._save()
+        agent.wait_for_checkpoint()
+        before = [array.copy() for array in self._stored(agent)]
+        restored_agent = Agent(16, 2, show=False, 
+                               memmap_directory=memmap_directory).restore()
+        for (array, copy) in zip(self._stored(agent), before):
+            np.testing.assert_array_equal(array, copy)
+        for (array, copy) in zip(self._stored(restored_agent), before):
+            np.testing.assert_array_equal(array, copy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+Check that agents stepped together behave as they do alone.
+"""
+import unittest
+
+import numpy as np
+
+from core.agent import Agent
+from core.agentbatch import AgentBatch
+import core.ziptie as ziptie
+from test_agent import AgentTestCase
+
+
+class BatchTest(AgentTestCase):
+
+    seeds = [4, 7, 4]
+    num_sensors = 6
+    num_actions = 2
+    num_steps = 300
+    # The steps at which each agent adds a block,
+    # so that the agents grow apart
+    block_steps = [(100, 250), (), (150,)]
+
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        # Grow bundles, and the cogs for them, within a few hundred steps
+        self.energy_rates = (ziptie.NUCLEATION_ENERGY_RATE,
+                             ziptie.AGGLOMERATION_ENERGY_RATE)
+        ziptie.NUCLEATION_ENERGY_RATE *= 100
+        ziptie.AGGLOMERATION_ENERGY_RATE *= 10
+
+    def tearDown(self):
+        (ziptie.NUCLEATION_ENERGY_RATE,
+         ziptie.AGGLOMERATION_ENERGY_RATE) = self.energy_rates
+        AgentTestCase.tearDown(self)
+
+    def _grow(self, agent, block_steps):
+        """ Have agent add a block at each of block_steps """
+        agent._top_block_full = lambda: agent.timestep in block_steps
+
+    def _world(self, seed):
+        """ Sensors with some structure, and the rewards for them """
+        world = np.random.RandomState(seed)
+        sensors = (world.random_sample((self.num_steps, self.num_sensors))
+                   < .3).astype(float)
+        sensors[:,3:] = sensors[:,:3]
+        rewards = sensors[:,1] - sensors[:,2] * .5
+        return (sensors, rewards)
+
+    def _compare(self, **kwargs):
+        """ Step a batch and separate agents through the same world """
+        num_agents = len(self.seeds)
+        # Each agent has a world of its own
+        worlds = [self._world(i) for i in range(num_agents)]
+        sensors = np.array([world[0] for world in worlds]).swapaxes(0, 1)
+        rewards = np.array([world[1] for world in worlds]).T
+        batch = AgentBatch(num_agents, self.num_sensors, self.num_actions,
+                           seeds=self.seeds, **kwargs)
+        for (agent, block_steps) in zip(batch.agents, self.block_steps):
+            self._grow(agent, block_steps)
+        batch_actions = np.zeros((self.num_steps, num_agents,
+                                  self.num_actions))
+        for step in range(self.num_steps):
+            batch_actions[step] = batch.step(sensors[step], rewards[step])
+        for (i, seed) in enumerate(self.seeds):
+            agent = Agent(self.num_sensors, self.num_actions, show=False,
+                          agent_name=''.join(('agent_', str(i))),
+                          random_state=np.random.RandomState(seed),
+                          **kwargs)
+            self._grow(agent, self.block_steps[i])
+            for step in range(self.num_steps):
+                action = agent.step(sensors[step, i], rewards[step, i])
+                self.assertTrue(np.array_equal(action[:,0],
+                                               batch_actions[step, i]))
+            batch_agent = batch.agents[i]
+            self.assertEqual(agent.surprise_history,
+                             batch_agent.surprise_history)
+            self.assertEqual(len(agent.blocks), len(batch_agent.blocks))
+            for (block, batch_block) in zip(agent.blocks,
+                                            batch_agent.blocks):
+                cogs = batch_block.gearbox.cog_slice(batch_block.agent_index)
+                for state_name in block.gearbox.STORED_STATE:
+                    self.assertTrue(np.array_equal(
+                            getattr(block.gearbox, state_name),
+                            getattr(batch_block.gearbox, state_name)[cogs]))
+                self.assertTrue(np.array_equal(
+                        block.ziptie.agglomeration_energy,
+                        batch_block.ziptie.agglomeration_energy))
+        self.assertEqual(len(batch.gearboxes), 3)
+        self.assertEqual(set(batch.gearboxes[1].cog_agents), set([0, 1]))
+
+    def test_batch(self):
+        """ Batched agents act as separate agents seeded alike """
+        self._compare()
+
+    def test_batch_compact(self):
+        """ Batched compact agents act as separate agents seeded alike """
+        self._compare(dtype=np.float32, compact=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
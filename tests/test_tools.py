@@ -0,0 +1,45 @@
+"""
+Check the numeric kernels in core.tools.
+"""
+import unittest
+
+import numpy as np
+
+import core.tools as tools
+
+
+class MapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = np.random.RandomState(0)
+
+    def test_map_one_to_inf_order(self):
+        """ The result is bit for bit the original formula's """
+        a = self.state.uniform(-1., 1., (1000, 1))
+        a[:3, 0] = [-1., 0., 1.]
+        eps = np.finfo(np.double).eps
+        expected = np.sign(a) / (1 - np.abs(a) + eps) - np.sign(a)
+        np.testing.assert_array_equal(tools.map_one_to_inf(a), expected)
+        out = np.empty(a.shape)
+        tools.map_one_to_inf(a, out=out)
+        np.testing.assert_array_equal(out, expected)
+
+    def test_map_inf_to_one_order(self):
+        """ The result is bit for bit the original formula's """
+        a_prime = self.state.standard_cauchy((1000, 1))
+        a_prime[0, 0] = 0.
+        expected = np.sign(a_prime) * (1 - 1 / (np.abs(a_prime) + 1))
+        np.testing.assert_array_equal(tools.map_inf_to_one(a_prime), 
+                                      expected)
+        out = np.empty(a_prime.shape)
+        tools.map_inf_to_one(a_prime, out=out)
+        np.testing.assert_array_equal(out, expected)
+
+    def test_dtype(self):
+        a = np.array([[-.5], [0.], [.5]], dtype=np.float32)
+        self.assertEqual(tools.map_one_to_inf(a).dtype, np.float32)
+        self.assertEqual(tools.map_inf_to_one(a).dtype, np.float32)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,9 @@ class World(object):
         else:
             self.LIFESPAN = lifespan
         self.timestep = 0
+        # If the world is being watched, tester sets this to a Display, 
+        # which its plots are published to
+        self.display = None
         self.name = 'abstract base world'
         # These will likely be overridden in any subclass
         self.num_sensors = 0
@@ -36,3 +39,49 @@ class World(object):
         """ Let the world show BECCA's internal state as well as its own"""
         print self.timestep, 'timesteps'
         return
+
+class VecWorld(object):
+    """ 
+    The base class for stepping many copies of a world in lockstep 
+
+    Each copy has its own state, held along a leading axis, and they 
+    all draw their random numbers together from one RandomState,
+    seeded with seed. step() takes a (num_worlds x num_actions) 
+    array of actions and returns a (num_worlds x num_sensors) array 
+    of sensors and a (num_worlds,) array of rewards.
+    """
+    def __init__(self, num_worlds, lifespan=None, seed=None):
+        """ Initialize the worlds with some benign default values """
+        if lifespan is None:
+            self.LIFESPAN = 10 ** 4
+        else:
+            self.LIFESPAN = lifespan
+        self.num_worlds = num_worlds
+        self.random = np.random.RandomState(seed)
+        self.timestep = 0
+        self.name = 'abstract base world'
+        # These will likely be overridden in any subclass
+        self.num_sensors = 0
+        self.num_actions = 0
+
+    def step(self, actions):
+        """ Take a timestep through empty worlds that do nothing """
+        self.timestep += 1
+        sensors = np.zeros((self.num_worlds, self.num_sensors))
+        rewards = np.zeros(self.num_worlds)
+        return sensors, rewards
+
+    def set_agent_parameters(self, agents):
+        """ 
+        If desired, manually adjust the parameters of a list of agents,
+        such as an AgentBatch's agents
+        """
+        pass
+
+    def is_alive(self):
+        """ Returns True until the worlds have come to an end """
+        return self.timestep < self.LIFESPAN
+
+    def _jumps(self, jump_fraction):
+        """ Choose which of the worlds jump to a random position """
+        return self.random.random_sample(self.num_worlds) < jump_fraction
@@ -1,6 +1,7 @@
 import numpy as np
 
 from worlds.base_world import World as BaseWorld
+from worlds.base_world import VecWorld as BaseVecWorld
 
 class World(BaseWorld):
     """ 
@@ -94,3 +95,56 @@ class World(BaseWorld):
             
         if (self.timestep % self.VISUALIZE_PERIOD) == 0:
             print("world age is %s timesteps " % self.timestep)
+
+class VecWorld(BaseVecWorld):
+    """ 
+    num_worlds copies of the one-dimensional grid task, in lockstep 
+
+    The step sizes and energies of all the worlds are found 
+    with one product of the actions and a weight for each action.
+    """
+    def __init__(self, num_worlds, lifespan=None, seed=None):
+        """ Set up the worlds """
+        BaseVecWorld.__init__(self, num_worlds, lifespan, seed)
+        self.REWARD_MAGNITUDE = 100.
+        self.ENERGY_COST = 0.01 * self.REWARD_MAGNITUDE
+        self.JUMP_FRACTION = 0.1
+        self.name = 'grid_1D'
+        self.name_long = 'one dimensional grid world'
+        self.num_sensors = 9
+        self.num_actions = 9
+        # How far, and how hard, each action moves
+        self.STEP_WEIGHTS = np.array([1., 2., 3., 4., -1., -2., -3., -4., 0.])
+        self.ENERGY_WEIGHTS = np.abs(self.STEP_WEIGHTS)
+        self.world_state = np.zeros(num_worlds)
+        self.simple_state = np.zeros(num_worlds, dtype=np.int)
+
+    def step(self, actions):
+        """ Take one time step through all the worlds """
+        actions = np.reshape(actions, (self.num_worlds, self.num_actions))
+        self.timestep += 1
+        step_size = np.dot(actions, self.STEP_WEIGHTS)
+        energy = np.dot(actions, self.ENERGY_WEIGHTS)
+        self.world_state += step_size
+        # At random intervals, jump to a random position in the world
+        jumps = self._jumps(self.JUMP_FRACTION)
+        self.world_state[jumps] = (self.num_sensors * 
+                                   self.random.random_sample(np.sum(jumps)))
+        # Ensure that the world state falls between 0 and 9
+        self.world_state -= self.num_sensors * np.floor_divide(
+                self.world_state, self.num_sensors)
+        self.simple_state = np.floor(self.world_state).astype(np.int)
+        sensors = np.zeros((self.num_worlds, self.num_sensors))
+        sensors[np.arange(self.num_worlds), self.simple_state] = 1
+        rewards = sensors[:,8] * (-self.REWARD_MAGNITUDE)
+        rewards += sensors[:,3] * self.REWARD_MAGNITUDE
+        # Punish actions just a little
+        rewards -= energy * self.ENERGY_COST
+        rewards = np.maximum(rewards, -self.REWARD_MAGNITUDE)
+        return sensors, rewards
+
+    def set_agent_parameters(self, agents):
+        """ Turn a few of the knobs to adjust BECCA for these worlds """
+        for agent in agents:
+            agent.reward_min = -100.
+            agent.reward_max = 100.
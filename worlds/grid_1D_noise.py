@@ -1,6 +1,7 @@
 import numpy as np
 
 from worlds.base_world import World as BaseWorld
+from worlds.base_world import VecWorld as BaseVecWorld
 
 class World(BaseWorld):
     """ 
@@ -86,3 +87,54 @@ class World(BaseWorld):
 
         if (self.timestep % self.VISUALIZE_PERIOD) == 0:
             print("world age is %s timesteps " % self.timestep)
+
+class VecWorld(BaseVecWorld):
+    """ num_worlds copies of the noisy grid task, in lockstep """
+    def __init__(self, num_worlds, lifespan=None, seed=None):
+        """ Set up the worlds """
+        BaseVecWorld.__init__(self, num_worlds, lifespan, seed)
+        self.REWARD_MAGNITUDE = 100.
+        self.ENERGY_COST = 0.01 * self.REWARD_MAGNITUDE
+        self.JUMP_FRACTION = 0.1
+        self.name = 'grid_1D_noise'
+        self.name_long = 'noisy one dimensional grid world'
+        self.num_real_sensors = 3
+        self.num_noise_sensors = 15        
+        self.num_sensors = self.num_noise_sensors + self.num_real_sensors
+        self.num_actions = 3
+        self.STEP_WEIGHTS = np.array([1., -1., 0.])
+        self.ENERGY_WEIGHTS = np.abs(self.STEP_WEIGHTS)
+        self.world_state = np.zeros(num_worlds)
+        self.simple_state = np.zeros(num_worlds, dtype=np.int)
+
+    def step(self, actions):
+        """ Take one time step through all the worlds """
+        actions = np.reshape(actions, (self.num_worlds, self.num_actions))
+        self.timestep += 1
+        energy = np.dot(actions, self.ENERGY_WEIGHTS)
+        self.world_state += np.dot(actions, self.STEP_WEIGHTS)
+        # At random intervals, jump to a random position in the world
+        jumps = self._jumps(self.JUMP_FRACTION)
+        self.world_state[jumps] = (self.num_real_sensors * 
+                                   self.random.random_sample(np.sum(jumps)))
+        # Ensure that the world state falls between 0 and num_real_sensors 
+        self.world_state -= (self.num_real_sensors * 
+                             np.floor_divide(self.world_state, 
+                                             self.num_real_sensors))
+        self.simple_state = np.floor(self.world_state).astype(np.int)
+        sensors = np.zeros((self.num_worlds, self.num_sensors))
+        sensors[np.arange(self.num_worlds), self.simple_state] = 1
+        # The rest of the sensors are noise
+        sensors[:,self.num_real_sensors:] = np.round(
+                self.random.random_sample((self.num_worlds, 
+                                           self.num_noise_sensors)))
+        rewards = np.where(self.simple_state == 1, self.REWARD_MAGNITUDE, 
+                           -self.REWARD_MAGNITUDE)
+        rewards -= energy * self.ENERGY_COST        
+        return sensors, rewards
+
+    def set_agent_parameters(self, agents):
+        """ Make some adjustements, as necessary, to the agents """
+        for agent in agents:
+            agent.reward_min = -100.
+            agent.reward_max = 100.
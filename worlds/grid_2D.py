@@ -1,6 +1,7 @@
 import numpy as np
 
 from worlds.base_world import World as BaseWorld
+from worlds.base_world import VecWorld as BaseVecWorld
 
 class World(BaseWorld):
     """ 
@@ -38,10 +39,10 @@ class World(BaseWorld):
         """ Take one time step through the world """
         self.action = action.ravel()
         self.timestep += 1
-        self.world_state += (self.action[0:2] - 
-                             self.action[4:6] + 
-                             2 * self.action[2:4] -
-                             2 * self.action[6:8]).T
+        self.world_state = self.world_state + (self.action[0:2] - 
+                                               self.action[4:6] + 
+                                               2 * self.action[2:4] -
+                                               2 * self.action[6:8]).T
         energy = (np.sum(self.action[0:2]) + 
                   np.sum(self.action[4:6]) + 
                   np.sum(2 * self.action[2:4]) +
@@ -56,7 +57,7 @@ class World(BaseWorld):
         self.world_state[indices] -= self.world_size
         indices = (self.world_state <= -0.5).nonzero()
         self.world_state[indices] += self.world_size
-        self.simple_state = np.round(self.world_state)
+        self.simple_state = np.round(self.world_state).astype(np.int)
         sensors = self.assign_sensors()
         reward = 0
         if tuple(self.simple_state.flatten()) == self.obstacle:
@@ -93,3 +94,72 @@ class World(BaseWorld):
         agent.visualize()
         projections = agent.get_projections(to_screen=True)
         return
+
+class VecWorld(BaseVecWorld):
+    """ 
+    num_worlds copies of the two-dimensional grid task, in lockstep 
+
+    Positions are kept as floating point numbers, so that the 
+    actions can be added to them directly.
+    """
+    def __init__(self, num_worlds, lifespan=None, seed=None):
+        """ Set up the worlds """
+        BaseVecWorld.__init__(self, num_worlds, lifespan, seed)
+        self.REWARD_MAGNITUDE = 100.
+        self.ENERGY_COST = 0.05 * self.REWARD_MAGNITUDE
+        self.JUMP_FRACTION = 0.1
+        self.name = 'grid_2D'
+        self.name_long = 'two dimensional grid world'
+        self.num_actions = 9            
+        self.world_size = 5
+        self.num_sensors = self.world_size ** 2
+        # How far each action moves along each of the two dimensions
+        self.STEP_WEIGHTS = np.zeros((self.num_actions, 2))
+        self.STEP_WEIGHTS[0:2,:] = np.eye(2)
+        self.STEP_WEIGHTS[2:4,:] = 2 * np.eye(2)
+        self.STEP_WEIGHTS[4:6,:] = -np.eye(2)
+        self.STEP_WEIGHTS[6:8,:] = -2 * np.eye(2)
+        self.ENERGY_WEIGHTS = np.sum(np.abs(self.STEP_WEIGHTS), axis=1)
+        self.world_state = np.ones((num_worlds, 2))
+        self.simple_state = self.world_state.astype(np.int)
+        self.target = (3,3)
+        self.obstacle = (1,1)
+
+    def step(self, actions):
+        """ Take one time step through all the worlds """
+        actions = np.reshape(actions, (self.num_worlds, self.num_actions))
+        self.timestep += 1
+        self.world_state += np.dot(actions, self.STEP_WEIGHTS)
+        energy = np.dot(actions, self.ENERGY_WEIGHTS)
+        # At random intervals, jump to a random position in the world
+        jumps = self._jumps(self.JUMP_FRACTION)
+        self.world_state[jumps,:] = self.random.randint(
+                0, self.world_size + 1, (np.sum(jumps), 2))
+        # Enforce lower and upper limits on the grid world 
+        # by looping them around
+        self.world_state[self.world_state >= 
+                         self.world_size - 0.5] -= self.world_size
+        self.world_state[self.world_state <= -0.5] += self.world_size
+        self.simple_state = np.round(self.world_state).astype(np.int)
+        sensors = self.assign_sensors()
+        rewards = np.zeros(self.num_worlds)
+        rewards[np.all(self.simple_state == self.obstacle, axis=1)] = (
+                -self.REWARD_MAGNITUDE)
+        rewards[np.all(self.simple_state == self.target, axis=1)] = (
+                self.REWARD_MAGNITUDE)
+        rewards -= self.ENERGY_COST * energy
+        return sensors, rewards
+
+    def assign_sensors(self):
+        """ Construct the sensor arrays from the state information """
+        sensors = np.zeros((self.num_worlds, self.num_sensors))
+        sensors[np.arange(self.num_worlds), 
+                self.simple_state[:,1] + 
+                self.simple_state[:,0] * self.world_size] = 1
+        return sensors
+
+    def set_agent_parameters(self, agents):
+        """ Set a few parameters in the agents """
+        for agent in agents:
+            agent.reward_min = -100.
+            agent.reward_max = 100.
@@ -1,6 +1,7 @@
 import numpy as np
 
 from worlds.grid_2D import World as Grid_2D_World
+from worlds.grid_2D import VecWorld as Grid_2D_VecWorld
 
 class World(Grid_2D_World):
     """ Two-dimensional grid task
@@ -33,3 +34,20 @@ class World(Grid_2D_World):
         sensors[self.simple_state[0]] = 1
         sensors[self.simple_state[1] + self.world_size] = 1
         return sensors
+
+class VecWorld(Grid_2D_VecWorld):
+    """ num_worlds copies of the decoupled two-dimensional grid task """
+    def __init__(self, num_worlds, lifespan=None, seed=None):
+        """ Set up the worlds """    
+        Grid_2D_VecWorld.__init__(self, num_worlds, lifespan, seed)
+        self.name = 'grid_2D_dc'
+        self.name_long = 'decoupled two dimensional grid world'
+        self.num_sensors = self.world_size * 2
+            
+    def assign_sensors(self):
+        """ Construct the sensor arrays from the state information """
+        sensors = np.zeros((self.num_worlds, self.num_sensors))
+        worlds = np.arange(self.num_worlds)
+        sensors[worlds, self.simple_state[:,0]] = 1
+        sensors[worlds, self.simple_state[:,1] + self.world_size] = 1
+        return sensors
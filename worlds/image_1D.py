@@ -1,7 +1,8 @@
-import matplotlib.pyplot as plt
+from collections import deque
 import numpy as np
 
 from worlds.base_world import World as BaseWorld
+from worlds.base_world import VecWorld as BaseVecWorld
 import worlds.world_tools as wtools
 
 class World(BaseWorld):
@@ -19,6 +20,8 @@ class World(BaseWorld):
         """ Set up the world """
         BaseWorld.__init__(self, lifespan)
         self.VISUALIZE_PERIOD = 10 ** 4
+        # The number of recent positions kept for plotting
+        self.HISTORY_LENGTH = 10 ** 4
         self.print_feature_set = True
         self.REWARD_MAGNITUDE = 100.
         self.JUMP_FRACTION = 0.1
@@ -37,7 +40,7 @@ class World(BaseWorld):
 
         # Initialize the image to be used as the environment
         self.block_image_filename = "./images/bar_test.png" 
-        self.data = plt.imread(self.block_image_filename)
+        self.data = wtools.read_image(self.block_image_filename)
         # Convert it to grayscale if it's in color
         if self.data.shape[2] == 3:
             # Collapse the three RGB matrices into one b/w value matrix
@@ -50,11 +53,11 @@ class World(BaseWorld):
         self.REWARD_REGION_WIDTH = image_width / 8
         self.NOISE_MAGNITUDE = 0.1
     
-        self.column_history = []
+        self.column_history = deque(maxlen=self.HISTORY_LENGTH)
         self.fov_height = np.min(self.data.shape)
         self.fov_width = self.fov_height
-        self.column_min = np.ceil(self.fov_width / 2)
-        self.column_max = np.floor(self.data.shape[1] - self.column_min)
+        self.column_min = int(np.ceil(self.fov_width / 2))
+        self.column_max = int(np.floor(self.data.shape[1] - self.column_min))
         self.column_position = np.random.random_integers(self.column_min, 
                                                          self.column_max)
         self.block_width = self.fov_width / (self.fov_span + 2)
@@ -122,29 +125,100 @@ class World(BaseWorld):
             agent.visualize() 
 
             print ''.join(["world is ", str(self.timestep), " timesteps old"])
-            fig = plt.figure(11)
-            plt.clf()
-            plt.plot( self.column_history, 'k.')    
-            plt.title("Column history")
-            plt.xlabel('time step')
-            plt.ylabel('position (pixels)')
-            fig.show()
-            fig.canvas.draw()
-
-            fig  = plt.figure(12)
-            sensed_image = np.reshape(
-                    0.5 * (self.sensors[:len(self.sensors)/2] - 
-                           self.sensors[len(self.sensors)/2:] + 1), 
-                    (self.fov_span, self.fov_span))
-            plt.gray()
-            plt.imshow(sensed_image, interpolation='nearest')
-            plt.title("Image sensed")
-            fig.show()
-            fig.canvas.draw()
+            # The plots are drawn by the display, in a process of its own
+            if self.display is None:
+                return
+            wtools.publish_position_history(self.display, 11, 
+                                             self.column_history, 
+                                             self.timestep, "Column history")
+            wtools.publish_sensed_image(self.display, 12, self.sensors, 
+                                        self.fov_span)
             # Periodically visualize the entire feature set
             if self.print_feature_set:
                 (feature_set, feature_activities) = agent.get_projections()
-                wtools.print_pixel_array_features(feature_set, self.num_sensors,
-                                                  self.num_actions, 
-                                                  directory='log', world_name=self.name)
+                self.display.publish(wtools.print_pixel_array_features, 
+                                     feature_set, self.num_sensors,
+                                     self.num_actions, self.fov_span, 
+                                     self.fov_span, directory='log', 
+                                     world_name=self.name)
         return
+
+class VecWorld(BaseVecWorld):
+    """ 
+    num_worlds copies of the one-dimensional visual servo task 
+
+    The gazes of all the worlds are moved at once, with one product 
+    of the actions and a weight for each action. Their fields of 
+    view are filtered together, from an integral image of the data.
+    """
+    def __init__(self, num_worlds, lifespan=None, seed=None):
+        """ Set up the worlds """
+        BaseVecWorld.__init__(self, num_worlds, lifespan, seed)
+        self.REWARD_MAGNITUDE = 100.
+        self.JUMP_FRACTION = 0.1
+        self.STEP_COST = 0.1 * self.REWARD_MAGNITUDE
+        self.name_long = 'one dimensional visual world'
+        self.name = 'image_1D'
+        self.fov_span = 5 
+        self.num_sensors = 2 * self.fov_span ** 2
+        self.num_actions = 9
+
+        # Initialize the image to be used as the environment
+        self.block_image_filename = "./images/bar_test.png" 
+        self.data = wtools.read_image(self.block_image_filename)
+        # Convert it to grayscale if it's in color
+        if self.data.shape[2] == 3:
+            # Collapse the three RGB matrices into one b/w value matrix
+            self.data = np.sum(self.data, axis=2) / 3.0
+        image_width = self.data.shape[1]
+        self.MAX_STEP_SIZE = image_width / 2
+        self.TARGET_COLUMN = image_width / 2
+        self.REWARD_REGION_WIDTH = image_width / 8
+        self.NOISE_MAGNITUDE = 0.1
+        # Actions 0-3 move the field of view to a higher-numbered column 
+        # with varying magnitudes, and actions 4-7 do the opposite.
+        self.STEP_WEIGHTS = self.MAX_STEP_SIZE * np.array(
+                [1/2., 1/4., 1/8., 1/16., -1/2., -1/4., -1/8., -1/16., 0.])
+        self.fov_height = int(np.min(self.data.shape))
+        self.fov_width = self.fov_height
+        self.column_min = int(np.ceil(self.fov_width / 2))
+        self.column_max = int(np.floor(self.data.shape[1] - self.column_min))
+        self.column_position = self.random.randint(
+                self.column_min, self.column_max + 1, num_worlds)
+        self.integral_data = wtools.integral_image(self.data)
+
+    def step(self, actions): 
+        """ Take one step through all the worlds """
+        actions = np.reshape(actions, (self.num_worlds, self.num_actions))
+        self.timestep += 1
+        column_step = np.round(np.dot(actions, self.STEP_WEIGHTS))
+        noise = self.random.random_sample((2, self.num_worlds))
+        column_step = np.round(column_step * (
+                1 + self.NOISE_MAGNITUDE * noise[0] * 2.0 - 
+                self.NOISE_MAGNITUDE * noise[1] * 2.0))
+        self.column_position = np.clip(
+                self.column_position + column_step.astype(np.int), 
+                self.column_min, self.column_max)
+        # At random intervals, jump to a random position in the world
+        jumps = self._jumps(self.JUMP_FRACTION)
+        self.column_position[jumps] = self.random.randint(
+                self.column_min, self.column_max + 1, np.sum(jumps))
+        # Create the sensory input vectors
+        center_surround_pixels = wtools.center_surround_at(
+                self.integral_data, np.zeros(self.num_worlds, dtype=np.int), 
+                self.column_position - self.fov_width / 2, 
+                self.fov_height, 2 * (self.fov_width / 2), 
+                self.fov_span).reshape(self.num_worlds, -1)
+        sensors = np.hstack((np.maximum(center_surround_pixels, 0), 
+                             np.abs(np.minimum(center_surround_pixels, 0))))
+        rewards = np.where(np.abs(self.column_position - self.TARGET_COLUMN) < 
+                           self.REWARD_REGION_WIDTH / 2.0, 
+                           self.REWARD_MAGNITUDE, 0.)
+        rewards -= np.abs(column_step) / self.MAX_STEP_SIZE * self.STEP_COST
+        return sensors, rewards
+
+    def set_agent_parameters(self, agents):
+        """ Initalize some of BECCA's parameters to ensure smooth running """
+        for agent in agents:
+            agent.reward_min = 0.
+            agent.reward_max = 100.
@@ -1,8 +1,9 @@
-import matplotlib.pyplot as plt
+from collections import deque
 import numpy as np
 import os
 
 from worlds.base_world import World as BaseWorld
+from worlds.base_world import VecWorld as BaseVecWorld
 import worlds.world_tools as wtools
 
 class World(BaseWorld):
@@ -21,6 +22,8 @@ class World(BaseWorld):
         """ Set up the world """
         BaseWorld.__init__(self, lifespan)
         self.VISUALIZE_PERIOD = 10 ** 4
+        # The number of recent positions kept for plotting
+        self.HISTORY_LENGTH = 10 ** 4
         self.REWARD_MAGNITUDE = 100.
         self.JUMP_FRACTION = 0.1
         self.print_feature_set = True
@@ -33,7 +36,7 @@ class World(BaseWorld):
         self.fov_span = 10 
         # Initialize the block_image_data to be used as the environment 
         self.block_image_filename = "./images/block_test.png" 
-        self.block_image_data = plt.imread(self.block_image_filename)
+        self.block_image_data = wtools.read_image(self.block_image_filename)
         # Convert it to grayscale if it's in color
         if self.block_image_data.shape[2] == 3:
             # Collapse the three RGB matrices into one b/w value matrix
@@ -48,12 +51,12 @@ class World(BaseWorld):
         self.REWARD_REGION_WIDTH = im_size / 8
         self.NOISE_MAGNITUDE = 0.1
         self.FIELD_OF_VIEW_FRACTION = 0.5;
-        self.fov_height =  im_size * self.FIELD_OF_VIEW_FRACTION
+        self.fov_height = int(im_size * self.FIELD_OF_VIEW_FRACTION)
         self.fov_width = self.fov_height
-        self.column_min = np.ceil(self.fov_width / 2)
-        self.column_max = np.floor(im_width - self.column_min)
-        self.row_min = np.ceil(self.fov_height / 2)
-        self.row_max = np.floor(im_height - self.row_min)
+        self.column_min = int(np.ceil(self.fov_width / 2))
+        self.column_max = int(np.floor(im_width - self.column_min))
+        self.row_min = int(np.ceil(self.fov_height / 2))
+        self.row_max = int(np.floor(im_height - self.row_min))
         self.column_position = np.random.random_integers(self.column_min, 
                                                          self.column_max)
         self.row_position = np.random.random_integers(self.row_min, 
@@ -62,8 +65,8 @@ class World(BaseWorld):
         self.num_sensors = 2 * self.fov_span ** 2
         self.num_actions = 17
         self.sensors = np.zeros(self.num_sensors)
-        self.column_history = []
-        self.row_history = []
+        self.column_history = deque(maxlen=self.HISTORY_LENGTH)
+        self.row_history = deque(maxlen=self.HISTORY_LENGTH)
         self.last_feature_vizualized = 0
         self.step_counter = 0
 
@@ -150,39 +153,124 @@ class World(BaseWorld):
             return
 
         print ' '.join(["world is", str(self.timestep), "timesteps old."])
-        fig = plt.figure(11)
-        plt.clf()
-        plt.plot( self.row_history, 'k.')    
-        plt.title("Row history")
-        plt.xlabel('time step')
-        plt.ylabel('position (pixels)')
-        fig.show()
-        fig.canvas.draw()
-
-        fig = plt.figure(12)
-        plt.clf()
-        plt.plot( self.column_history, 'k.')    
-        plt.title("Column history")
-        plt.xlabel('time step')
-        plt.ylabel('position (pixels)')
-        fig.show()
-        fig.canvas.draw()
-
-        fig = plt.figure(13)
-        sensed_image = np.reshape(0.5 * (
-                self.sensors[:len(self.sensors)/2] - 
-                self.sensors[len(self.sensors)/2:] + 1), 
-                (self.fov_span, self.fov_span))
-        plt.gray()
-        plt.imshow(sensed_image, interpolation='nearest')
-        plt.title("Image sensed")
-        fig.show()
-        fig.canvas.draw()
+        # The plots are drawn by the display, in a process of its own
+        if self.display is None:
+            return
+        wtools.publish_position_history(self.display, 11, self.row_history, 
+                                         self.timestep, "Row history")
+        wtools.publish_position_history(self.display, 12, 
+                                         self.column_history, 
+                                         self.timestep, "Column history")
+        wtools.publish_sensed_image(self.display, 13, self.sensors, 
+                                    self.fov_span)
 
         # Periodcally show the entire feature set 
         if self.print_feature_set:
             (feature_set, feature_activities) = agent.get_projections()
-            wtools.print_pixel_array_features(feature_set, self.num_sensors,
-                                              self.num_actions,
-                                              directory='log', world_name=self.name)  
+            self.display.publish(wtools.print_pixel_array_features, 
+                                 feature_set, self.num_sensors,
+                                 self.num_actions, self.fov_span, 
+                                 self.fov_span, directory='log', 
+                                 world_name=self.name)
         return
+
+class VecWorld(BaseVecWorld):
+    """ 
+    num_worlds copies of the two-dimensional visual servo task 
+
+    The gazes of all the worlds are moved at once, with one product 
+    of the actions and a weight for each action and direction. 
+    Their fields of view are filtered together, from an integral image 
+    of the block_image_data.
+    """
+    def __init__(self, num_worlds, lifespan=None, seed=None):
+        """ Set up the worlds """
+        BaseVecWorld.__init__(self, num_worlds, lifespan, seed)
+        self.REWARD_MAGNITUDE = 100.
+        self.JUMP_FRACTION = 0.1
+        self.name = 'image_2D'
+        self.name_long = 'two dimensional visual world'
+
+        self.fov_span = 10 
+        # Initialize the block_image_data to be used as the environment 
+        self.block_image_filename = "./images/block_test.png" 
+        self.block_image_data = wtools.read_image(self.block_image_filename)
+        # Convert it to grayscale if it's in color
+        if self.block_image_data.shape[2] == 3:
+            # Collapse the three RGB matrices into one b/w value matrix
+            self.block_image_data = np.sum(self.block_image_data, axis=2) / 3.0
+        (im_height, im_width) = self.block_image_data.shape
+        im_size = np.minimum(im_height, im_width)
+        self.MAX_STEP_SIZE = im_size / 2
+        self.TARGET_COLUMN = im_width / 2
+        self.TARGET_ROW = im_height / 2
+        self.REWARD_REGION_WIDTH = im_size / 8
+        self.NOISE_MAGNITUDE = 0.1
+        self.FIELD_OF_VIEW_FRACTION = 0.5
+        self.fov_height = int(im_size * self.FIELD_OF_VIEW_FRACTION)
+        self.fov_width = self.fov_height
+        self.column_min = int(np.ceil(self.fov_width / 2))
+        self.column_max = int(np.floor(im_width - self.column_min))
+        self.row_min = int(np.ceil(self.fov_height / 2))
+        self.row_max = int(np.floor(im_height - self.row_min))
+        self.num_sensors = 2 * self.fov_span ** 2
+        self.num_actions = 17
+        # Actions 0-3 move the field of view to a higher-numbered 
+        # row with varying magnitudes, and actions 4-7 do the opposite.
+        # Actions 8-11 move it to a higher-numbered column, 
+        # and actions 12-15 do the opposite.
+        magnitudes = np.array([1/2., 1/4., 1/8., 1/16.])
+        self.STEP_WEIGHTS = np.zeros((self.num_actions, 2))
+        self.STEP_WEIGHTS[0:4,0] = magnitudes
+        self.STEP_WEIGHTS[4:8,0] = -magnitudes
+        self.STEP_WEIGHTS[8:12,1] = magnitudes
+        self.STEP_WEIGHTS[12:16,1] = -magnitudes
+        self.STEP_WEIGHTS *= self.MAX_STEP_SIZE
+        self.position_min = np.array([self.row_min, self.column_min])
+        self.position_max = np.array([self.row_max, self.column_max])
+        # Each world's (row, column) position
+        self.position = np.zeros((num_worlds, 2), dtype=np.int)
+        self._jump_to_random_position(np.ones(num_worlds, dtype=np.bool))
+        self.integral_data = wtools.integral_image(self.block_image_data)
+
+    def _jump_to_random_position(self, jumps):
+        """ Move the selected worlds to random positions """
+        num_jumps = np.sum(jumps)
+        self.position[jumps,1] = self.random.randint(
+                self.column_min, self.column_max + 1, num_jumps)
+        self.position[jumps,0] = self.random.randint(
+                self.row_min, self.row_max + 1, num_jumps)
+
+    def step(self, actions): 
+        """ Take one time step through all the worlds """
+        actions = np.reshape(actions, (self.num_worlds, self.num_actions))
+        self.timestep += 1
+        position_step = np.round(np.dot(actions, self.STEP_WEIGHTS))
+        noise = self.random.random_sample((2, self.num_worlds, 2))
+        position_step = np.round(position_step * (
+                1 + self.NOISE_MAGNITUDE * noise[0] * 2.0 - 
+                self.NOISE_MAGNITUDE * noise[1] * 2.0))
+        # Respect the boundaries of the block_image_data
+        self.position = np.clip(self.position + position_step.astype(np.int),
+                                self.position_min, self.position_max)
+        # At random intervals, jump to a random position in the world
+        self._jump_to_random_position(self._jumps(self.JUMP_FRACTION))
+        # Create the sensory input vectors
+        center_surround_pixels = wtools.center_surround_at(
+                self.integral_data, 
+                self.position[:,0] - self.fov_height / 2, 
+                self.position[:,1] - self.fov_width / 2, 
+                2 * (self.fov_height / 2), 2 * (self.fov_width / 2), 
+                self.fov_span).reshape(self.num_worlds, -1)
+        sensors = np.hstack((np.maximum(center_surround_pixels, 0), 
+                             np.abs(np.minimum(center_surround_pixels, 0))))
+        targets = np.array([self.TARGET_ROW, self.TARGET_COLUMN])
+        on_target = np.all(np.abs(self.position - targets) < 
+                           self.REWARD_REGION_WIDTH / 2, axis=1)
+        rewards = np.where(on_target, self.REWARD_MAGNITUDE, 0.)
+        return sensors, rewards
+
+    def set_agent_parameters(self, agents):
+        for agent in agents:
+            agent.reward_min = 0.
+            agent.reward_max = 100.
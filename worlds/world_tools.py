@@ -1,49 +1,54 @@
-import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 
+from core.display import downsample, plot_history, show_image
 import core.tools as tools
+# matplotlib and cv2 are slow to import, and only needed for display
+# and for making movies, so the functions that use them import them
 
 """
 Utilities shared between several worlds dealing with visual input
 """
 
-def center_surround(fov, fov_horz_span, fov_vert_span, verbose=False):
+def center_surround(fov, fov_horz_span, fov_vert_span=None, verbose=False):
     """ 
     Convert a 2D array of b/w pixel values to center-surround 
     
     fov (field of view) is the 2D array of pixel values and 
-    fov_span is the number of center-surround superpixel rows and columns.
+    fov_horz_span and fov_vert_span are the number of center-surround 
+    superpixel columns and rows. fov_vert_span defaults to fov_horz_span.
     Returns a 2D array of the center surround vales.
+    Any leading axes of fov are treated as a stack of fields of view,
+    so that those of many worlds can be converted at once.
     """ 
-    fov_height = fov.shape[0]
-    fov_width = fov.shape[1]
-    block_width = np.round(fov_width / (fov_horz_span + 2))
-    block_height = np.round(fov_height / (fov_vert_span + 2))
-    super_pixels = np.zeros((fov_vert_span + 2, fov_horz_span + 2))
-    center_surround_pixels = np.zeros((fov_vert_span, fov_horz_span))
+    if fov_vert_span is None:
+        fov_vert_span = fov_horz_span
+    fov_height = fov.shape[-2]
+    fov_width = fov.shape[-1]
+    block_width = int(np.round(fov_width / (fov_horz_span + 2)))
+    block_height = int(np.round(fov_height / (fov_vert_span + 2)))
+    num_rows = fov_vert_span + 2
+    num_columns = fov_horz_span + 2
     # Create the superpixels by averaging pixel blocks
-    for row in range(fov_vert_span + 2):
-        for column in range(fov_horz_span + 2):
-            super_pixels[row][column] = np.mean(
-                    fov[row * block_height:(row + 1) * block_height,
-                        column * block_width: (column + 1) * block_width ])
-    for row in range(fov_vert_span):
-        for column in range(fov_horz_span):
-            # Calculate a center-surround value that represents
-            # the difference between the pixel and its surroundings.
-            center_surround_pixels[row][column] = \
-                super_pixels[row + 1][column + 1] - \
-                super_pixels[row    ][column + 1] / 6 - \
-                super_pixels[row + 2][column + 1] / 6 - \
-                super_pixels[row + 1][column    ] / 6 - \
-                super_pixels[row + 1][column + 2] / 6 - \
-                super_pixels[row    ][column    ] / 12 - \
-                super_pixels[row + 2][column    ] / 12 - \
-                super_pixels[row    ][column + 2] / 12 - \
-                super_pixels[row + 2][column + 2] / 12
+    if (num_rows * block_height <= fov_height and 
+        num_columns * block_width <= fov_width):
+        blocks = fov[...,:num_rows * block_height, 
+                     :num_columns * block_width].reshape(
+                fov.shape[:-2] + (num_rows, block_height, 
+                                  num_columns, block_width))
+        super_pixels = np.mean(np.mean(blocks, axis=-1), axis=-2)
+    else:
+        # The last blocks are cut short by the edge of the field of view
+        super_pixels = np.zeros(fov.shape[:-2] + (num_rows, num_columns))
+        for row in range(num_rows):
+            for column in range(num_columns):
+                super_pixels[...,row,column] = np.mean(np.mean(
+                        fov[...,row * block_height:(row + 1) * block_height,
+                            column * block_width: (column + 1) * block_width],
+                        axis=-1), axis=-1)
+    center_surround_pixels = surround_difference(super_pixels)
     if verbose:
+        import matplotlib.pyplot as plt
         # Display the field of view clipped from the original image
         plt.figure("fov")
         plt.gray()
@@ -67,6 +72,80 @@ def center_surround(fov, fov_horz_span, fov_vert_span, verbose=False):
         plt.draw() 
     return center_surround_pixels
 
+def surround_difference(super_pixels):
+    """
+    Find the center-surround values of arrays of superpixels
+
+    Each value is the difference between a superpixel and its 
+    surroundings. The outermost superpixels only serve as surroundings,
+    so the result has one less row and column on each side.
+    Any leading axes of super_pixels are treated as a stack.
+    """
+    inner = (slice(1, -1),)
+    before = (slice(None, -2),)
+    after = (slice(2, None),)
+    def shifted(rows, columns):
+        return super_pixels[(Ellipsis,) + rows + columns]
+    return (shifted(inner, inner) - 
+            shifted(before, inner) / 6 - 
+            shifted(after, inner) / 6 - 
+            shifted(inner, before) / 6 - 
+            shifted(inner, after) / 6 - 
+            shifted(before, before) / 12 - 
+            shifted(after, before) / 12 - 
+            shifted(before, after) / 12 - 
+            shifted(after, after) / 12)
+
+def integral_image(image):
+    """ 
+    Sum a 2D array of pixel values over every upper left corner
+
+    Element [row, column] of the result is the sum of 
+    image[:row, :column], so the result has one more row and column 
+    than image. The sum over any rectangle can then be read from 
+    its four corners. The sums are taken in float64 whatever the 
+    type of image, since the corners of small rectangles are the 
+    differences of large sums.
+    """
+    integral = np.zeros((image.shape[0] + 1, image.shape[1] + 1))
+    np.cumsum(np.cumsum(image, axis=0, dtype=np.float64), axis=1, 
+              out=integral[1:,1:])
+    return integral
+
+def center_surround_at(integral, top, left, fov_height, fov_width,
+                       fov_horz_span, fov_vert_span=None):
+    """ 
+    Convert many fields of view, cut from the same image, to center-surround 
+
+    integral is the integral_image() of the image. top and left are 
+    arrays of the upper left corners of the fields of view, each of which 
+    is fov_height by fov_width pixels. Returns a stack of 2D arrays
+    of center-surround values, one for each field of view, the same as 
+    center_surround() would for each of them. 
+    The superpixels are read from the corners of their blocks, 
+    rather than averaged over every pixel, so that cutting 
+    out many large fields of view stays cheap.
+    """
+    if fov_vert_span is None:
+        fov_vert_span = fov_horz_span
+    block_width = int(np.round(fov_width / (fov_horz_span + 2)))
+    block_height = int(np.round(fov_height / (fov_vert_span + 2)))
+    # The edges of the superpixel blocks. As in center_surround(), 
+    # the last blocks are cut short by the edge of the field of view.
+    row_edges = (np.asarray(top)[:,np.newaxis] + 
+                 np.minimum(np.arange(fov_vert_span + 3) * block_height, 
+                            fov_height))
+    column_edges = (np.asarray(left)[:,np.newaxis] + 
+                    np.minimum(np.arange(fov_horz_span + 3) * block_width, 
+                               fov_width))
+    corners = integral[row_edges[:,:,np.newaxis], 
+                       column_edges[:,np.newaxis,:]]
+    block_sums = (corners[:,1:,1:] - corners[:,:-1,1:] - 
+                  corners[:,1:,:-1] + corners[:,:-1,:-1])
+    block_sizes = (np.diff(row_edges)[:,:,np.newaxis] * 
+                   np.diff(column_edges)[:,np.newaxis,:])
+    return surround_difference(block_sums / block_sizes)
+
 def visualize_pixel_array_feature(feature, 
                                  fov_horz_span=None, fov_vert_span=None,
                                   block_index=-1, feature_index=-1, 
@@ -86,6 +165,7 @@ def visualize_pixel_array_feature(feature,
         fig_title = ' '.join(('Block', block_str, 'Feature', feature_str, 
                               'from', world_name))
         fig_name = ' '.join(('Features from ', world_name))
+        import matplotlib.pyplot as plt
         fig = plt.figure(tools.str_to_int(fig_name))
         fig.clf()
     num_states = feature.shape[1]
@@ -119,6 +199,7 @@ def visualize_pixel_array_feature(feature,
 def print_pixel_array_features(projections, num_sensors, num_actions, 
                                fov_horz_span, fov_vert_span, 
                                directory='log', world_name=''):
+    import matplotlib.pyplot as plt
     num_blocks = len(projections)
     for block_index in range(num_blocks):
         for feature_index in range(len(projections[block_index])):
@@ -149,6 +230,7 @@ def print_pixel_array_features(projections, num_sensors, num_actions,
     return
 
 def make_movie(stills_directory, movie_filename='', frames_per_still = 1):
+    import cv2
     if not movie_filename:
         movie_filename = ''.join((stills_directory, '.avi'))
     stills_filenames = []
@@ -175,6 +257,31 @@ def make_movie(stills_directory, movie_filename='', frames_per_still = 1):
         for frame_counter in range(frames_per_still):
             video_writer.write(resized_image)
 
+def publish_position_history(display, figure, history, timestep, title):
+    """ 
+    Publish a history of positions to display, to be plotted 
+
+    history holds the positions of the most recent time steps, 
+    up to timestep. It is downsampled if it is long.
+    """
+    (indices, positions) = downsample(history)
+    steps = indices + timestep - len(history) + 1
+    display.publish(plot_history, figure, steps, positions, title, 
+                    ylabel='position (pixels)', style='k.')
+
+def publish_sensed_image(display, figure, sensors, fov_span):
+    """ Publish the center-surround sensors to display, as an image """
+    num_pixels = len(sensors) / 2
+    sensed_image = np.reshape(
+            0.5 * (sensors[:num_pixels] - sensors[num_pixels:] + 1), 
+            (fov_span, fov_span))
+    display.publish(show_image, figure, sensed_image, "Image sensed")
+
+def read_image(filename):
+    """ Read an image file into an array, without loading pyplot """
+    import matplotlib.image
+    return matplotlib.image.imread(filename)
+
 def resample2D(array, num_rows, num_cols):
     """ Return resampled array that is num_rows by num_cols """
     rows = (np.linspace(0., .9999999, num_rows) * 